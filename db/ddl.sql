@@ -33,7 +33,9 @@ CREATE TABLE bikes (
     type_id INT REFERENCES bike_types(type_id) ON DELETE SET NULL,
     station_id INT REFERENCES stations(station_id) ON DELETE SET NULL,
     status VARCHAR(20) NOT NULL CHECK (status IN ('available', 'rented', 'under_maintenance')),
-    purchase_date DATE NOT NULL
+    purchase_date DATE NOT NULL,
+    reserved_by BIGINT,  -- Пользователь, удерживающий велосипед до подтверждения аренды
+    reserved_until TIMESTAMP  -- Удержание действует до этого момента
 );
 
 CREATE TABLE rentals (
@@ -68,8 +70,27 @@ CREATE TABLE reviews (
 -- ----------------------------
 
 CREATE INDEX idx_bikes_status ON bikes(status);
-CREATE INDEX idx_rentals_user_id ON rentals(user_id);
 CREATE INDEX idx_rentals_bike_id ON rentals(bike_id);
+-- Аренды пользователя по убыванию даты (get_user_rentals, get_rentals_per_day по пользователю)
+CREATE INDEX idx_rentals_user_start ON rentals(user_id, start_time DESC);
+-- Аренды по дням (get_rentals_per_day)
+CREATE INDEX idx_rentals_start_time ON rentals(start_time);
+-- Аренды по станции начала (get_station_stats)
+CREATE INDEX idx_rentals_start_station ON rentals(start_station_id);
+-- Открытые аренды (active_rentals, get_active_rentals)
+CREATE INDEX idx_rentals_open ON rentals(user_id) WHERE end_time IS NULL;
+-- Доступные велосипеды по станциям (get_available_bikes)
+CREATE INDEX idx_bikes_available_station ON bikes(station_id, bike_id) WHERE status = 'available';
+-- Постраничный список доступных велосипедов по ID и по типу (get_available_bikes_page)
+CREATE INDEX idx_bikes_available ON bikes(bike_id) WHERE status = 'available';
+CREATE INDEX idx_bikes_available_type ON bikes(type_id, bike_id) WHERE status = 'available';
+-- Платежи аренды (get_payments_by_user, close_rental)
+CREATE INDEX idx_payments_rental_id ON payments(rental_id);
+-- Завершенные платежи по дате (get_completed_payments, calculate_total_income)
+CREATE INDEX idx_payments_completed_date ON payments(payment_date) INCLUDE (amount) WHERE status = 'completed';
+-- Отзывы по велосипеду и пользователю (get_reviews_by_bike, get_average_rating, get_user_reviews)
+CREATE INDEX idx_reviews_bike_id ON reviews(bike_id) INCLUDE (rating);
+CREATE INDEX idx_reviews_user_date ON reviews(user_id, review_date DESC);
 
 -- ----------------------------
 -- 3. Триггеры и функции (Triggers & Functions)
@@ -79,7 +100,11 @@ CREATE OR REPLACE FUNCTION set_bike_rented()
 RETURNS TRIGGER AS $$
 BEGIN
     UPDATE bikes
-    SET status = 'rented', station_id = NULL
+    SET 
+        status = 'rented',
+        station_id = NULL,
+        reserved_by = NULL,
+        reserved_until = NULL
     WHERE bike_id = NEW.bike_id;
     RETURN NEW;
 END;
@@ -115,30 +140,78 @@ EXECUTE FUNCTION update_bike_on_rental_end();
 -- 4. Хранимые процедуры (Stored Procedures)
 -- ----------------------------
 
-CREATE OR REPLACE PROCEDURE close_rental(
-    IN rental_id INT,
-    IN end_station_id INT
+-- Завершение аренды, расчет стоимости и оплата за один вызов.
+-- Велосипед возвращается на станцию триггером trigger_rental_end.
+-- Возврат на заполненную станцию отклоняется с кодом BR001 (счетчики station_occupancy)
+CREATE OR REPLACE FUNCTION close_rental(
+    p_rental_id INT,
+    p_end_station_id INT
 )
+RETURNS TABLE (payment_id INT, cost NUMERIC)
 LANGUAGE plpgsql
 AS $$
 DECLARE
-    rental_cost NUMERIC;
+    v_cost NUMERIC(10, 2);
+    v_payment_id INT;
+    v_free_docks INT;
+    v_start_station_id INT;
 BEGIN
-    UPDATE rentals
-    SET 
-        end_time = NOW(),
-        end_station_id = end_station_id
-    WHERE rentals.rental_id = close_rental.rental_id;
-
-    SELECT (EXTRACT(EPOCH FROM (end_time - start_time)/3600) * bt.price_per_hour)
-    INTO rental_cost
+    SELECT r.start_station_id INTO v_start_station_id
     FROM rentals r
-    JOIN bikes b ON r.bike_id = b.bike_id
-    JOIN bike_types bt ON b.type_id = bt.type_id
-    WHERE r.rental_id = close_rental.rental_id;
+    WHERE r.rental_id = p_rental_id;
+
+    -- Строки счетчиков станций начала и возврата блокируются до конца транзакции
+    -- в порядке station_id (триггеры ниже берут те же строки): параллельные возвраты
+    -- на одну станцию не превысят вместимость, встречные возвраты не взаимоблокируются
+    INSERT INTO station_occupancy (station_id)
+    SELECT DISTINCT s.station_id
+    FROM unnest(ARRAY[v_start_station_id, p_end_station_id]) AS s(station_id)
+    WHERE s.station_id IS NOT NULL
+    ON CONFLICT (station_id) DO NOTHING;
+
+    PERFORM 1
+    FROM station_occupancy o
+    WHERE o.station_id IN (v_start_station_id, p_end_station_id)
+    ORDER BY o.station_id
+    FOR UPDATE;
+
+    SELECT s.capacity - o.available - o.maintenance
+    INTO v_free_docks
+    FROM station_occupancy o
+    JOIN stations s ON s.station_id = o.station_id
+    WHERE o.station_id = p_end_station_id;
+
+    IF v_free_docks <= 0 THEN
+        RAISE EXCEPTION 'Station % is full', p_end_station_id USING ERRCODE = 'BR001';
+    END IF;
+
+    WITH closed AS (
+        UPDATE rentals r
+        SET 
+            end_time = NOW(),
+            end_station_id = p_end_station_id
+        WHERE r.rental_id = p_rental_id AND r.end_time IS NULL
+        RETURNING r.bike_id, r.start_time, r.end_time
+    )
+    -- Минимальная сумма платежа - 0.01 (payments.amount > 0)
+    SELECT GREATEST(
+        ROUND(EXTRACT(EPOCH FROM (c.end_time - c.start_time)) / 3600 * COALESCE(bt.price_per_hour, 0), 2),
+        0.01
+    )
+    INTO v_cost
+    FROM closed c
+    LEFT JOIN bikes b ON c.bike_id = b.bike_id
+    LEFT JOIN bike_types bt ON b.type_id = bt.type_id;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Rental % not found or already closed', p_rental_id;
+    END IF;
 
     INSERT INTO payments (rental_id, amount, status)
-    VALUES (rental_id, rental_cost, 'completed');
+    VALUES (p_rental_id, v_cost, 'completed')
+    RETURNING payments.payment_id INTO v_payment_id;
+
+    RETURN QUERY SELECT v_payment_id, v_cost;
 END;
 $$;
 
@@ -157,4 +230,368 @@ FROM rentals r
 JOIN users u ON r.user_id = u.user_id
 JOIN bikes b ON r.bike_id = b.bike_id
 JOIN stations s ON r.start_station_id = s.station_id
-WHERE r.end_time IS NULL;
\ No newline at end of file
+WHERE r.end_time IS NULL;
+
+-- ----------------------------
+-- 6. Агрегаты (Rollups)
+-- ----------------------------
+
+-- Дневные агрегаты по станции начала аренды и типу велосипеда.
+-- station_id/type_id = 0: станция или тип неизвестны (удалены)
+CREATE TABLE daily_station_stats (
+    day DATE NOT NULL,
+    station_id INT NOT NULL DEFAULT 0,
+    type_id INT NOT NULL DEFAULT 0,
+    rentals INT NOT NULL DEFAULT 0,
+    ride_minutes NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, station_id, type_id)
+);
+
+CREATE INDEX idx_daily_station_stats_station ON daily_station_stats(station_id, day);
+
+CREATE OR REPLACE FUNCTION rollup_add(
+    p_day DATE,
+    p_station_id INT,
+    p_type_id INT,
+    p_rentals INT,
+    p_ride_minutes NUMERIC,
+    p_revenue NUMERIC
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO daily_station_stats AS s (day, station_id, type_id, rentals, ride_minutes, revenue)
+    VALUES (p_day, COALESCE(p_station_id, 0), COALESCE(p_type_id, 0), p_rentals, p_ride_minutes, p_revenue)
+    ON CONFLICT (day, station_id, type_id) DO UPDATE
+    SET 
+        rentals = s.rentals + EXCLUDED.rentals,
+        ride_minutes = s.ride_minutes + EXCLUDED.ride_minutes,
+        revenue = s.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Вклад аренды: количество и минуты поездки относятся к дню и станции начала
+CREATE OR REPLACE FUNCTION rollup_rentals()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_old_type_id INT;
+    v_new_type_id INT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        v_old_type_id := (SELECT type_id FROM bikes WHERE bike_id = OLD.bike_id);
+        PERFORM rollup_add(
+            OLD.start_time::date,
+            OLD.start_station_id,
+            v_old_type_id,
+            -1,
+            -COALESCE(EXTRACT(EPOCH FROM (OLD.end_time - OLD.start_time)) / 60, 0),
+            0
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        v_new_type_id := (SELECT type_id FROM bikes WHERE bike_id = NEW.bike_id);
+        PERFORM rollup_add(
+            NEW.start_time::date,
+            NEW.start_station_id,
+            v_new_type_id,
+            1,
+            COALESCE(EXTRACT(EPOCH FROM (NEW.end_time - NEW.start_time)) / 60, 0),
+            0
+        );
+    END IF;
+    -- Смена станции начала или велосипеда переносит выручку аренды в другую группу
+    IF TG_OP = 'UPDATE' AND (
+        OLD.start_station_id IS DISTINCT FROM NEW.start_station_id OR
+        v_old_type_id IS DISTINCT FROM v_new_type_id
+    ) THEN
+        PERFORM rollup_rental_payments(OLD.rental_id, OLD.start_station_id, v_old_type_id, -1);
+        PERFORM rollup_rental_payments(NEW.rental_id, NEW.start_station_id, v_new_type_id, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Выручка по завершенным платежам аренды с указанным знаком (группа задается явно)
+CREATE OR REPLACE FUNCTION rollup_rental_payments(p_rental_id INT, p_station_id INT, p_type_id INT, p_sign INT)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM rollup_add(p.payment_date::date, p_station_id, p_type_id, 0, 0, p_sign * p.amount)
+    FROM payments p
+    WHERE p.rental_id = p_rental_id AND p.status = 'completed';
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаление аренды (cancel_rental): выручка каскадно удаляемых платежей вычитается, пока
+-- аренда еще существует - триггер платежа после каскада уже не найдет ее станцию и тип
+CREATE OR REPLACE FUNCTION rollup_rental_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM rollup_rental_payments(
+        OLD.rental_id,
+        OLD.start_station_id,
+        (SELECT type_id FROM bikes WHERE bike_id = OLD.bike_id),
+        -1
+    );
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_rollup_rentals_insert
+AFTER INSERT OR DELETE ON rentals
+FOR EACH ROW
+EXECUTE FUNCTION rollup_rentals();
+
+CREATE TRIGGER trigger_rollup_rentals_update
+AFTER UPDATE ON rentals
+FOR EACH ROW
+WHEN (
+    OLD.start_time IS DISTINCT FROM NEW.start_time OR
+    OLD.end_time IS DISTINCT FROM NEW.end_time OR
+    OLD.start_station_id IS DISTINCT FROM NEW.start_station_id OR
+    OLD.bike_id IS DISTINCT FROM NEW.bike_id
+)
+EXECUTE FUNCTION rollup_rentals();
+
+CREATE TRIGGER trigger_rollup_rentals_delete
+BEFORE DELETE ON rentals
+FOR EACH ROW
+EXECUTE FUNCTION rollup_rental_delete();
+
+-- Вклад платежа: выручка по дню платежа, станции начала аренды и типу велосипеда
+CREATE OR REPLACE FUNCTION rollup_payment_amount(p_rental_id INT, p_payment_date TIMESTAMP, p_amount NUMERIC)
+RETURNS VOID AS $$
+DECLARE
+    v_station_id INT;
+    v_type_id INT;
+BEGIN
+    SELECT r.start_station_id, b.type_id
+    INTO v_station_id, v_type_id
+    FROM rentals r
+    LEFT JOIN bikes b ON r.bike_id = b.bike_id
+    WHERE r.rental_id = p_rental_id;
+
+    -- Аренда удалена: выручку ее платежей уже вычел rollup_rental_delete
+    IF p_rental_id IS NOT NULL AND NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    PERFORM rollup_add(p_payment_date::date, v_station_id, v_type_id, 0, 0, p_amount);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_payments()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'completed' THEN
+        PERFORM rollup_payment_amount(OLD.rental_id, OLD.payment_date, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'completed' THEN
+        PERFORM rollup_payment_amount(NEW.rental_id, NEW.payment_date, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_rollup_payments
+AFTER INSERT OR UPDATE OR DELETE ON payments
+FOR EACH ROW
+EXECUTE FUNCTION rollup_payments();
+
+-- Пересчет агрегатов за период из rentals/payments (первичное заполнение и исправление)
+CREATE OR REPLACE FUNCTION backfill_daily_stats(p_from DATE, p_to DATE)
+RETURNS INT AS $$
+DECLARE
+    v_rows INT;
+BEGIN
+    -- Триггеры параллельных транзакций ждут окончания пересчета
+    LOCK TABLE daily_station_stats IN SHARE ROW EXCLUSIVE MODE;
+
+    DELETE FROM daily_station_stats WHERE day BETWEEN p_from AND p_to;
+
+    INSERT INTO daily_station_stats (day, station_id, type_id, rentals, ride_minutes, revenue)
+    SELECT day, station_id, type_id, SUM(rentals), SUM(ride_minutes), SUM(revenue)
+    FROM (
+        SELECT 
+            r.start_time::date AS day,
+            COALESCE(r.start_station_id, 0) AS station_id,
+            COALESCE(b.type_id, 0) AS type_id,
+            1 AS rentals,
+            COALESCE(EXTRACT(EPOCH FROM (r.end_time - r.start_time)) / 60, 0) AS ride_minutes,
+            0 AS revenue
+        FROM rentals r
+        LEFT JOIN bikes b ON r.bike_id = b.bike_id
+        WHERE r.start_time >= p_from AND r.start_time < p_to + 1
+
+        UNION ALL
+
+        SELECT 
+            p.payment_date::date,
+            COALESCE(r.start_station_id, 0),
+            COALESCE(b.type_id, 0),
+            0,
+            0,
+            p.amount
+        FROM payments p
+        LEFT JOIN rentals r ON p.rental_id = r.rental_id
+        LEFT JOIN bikes b ON r.bike_id = b.bike_id
+        WHERE p.status = 'completed' AND p.payment_date >= p_from AND p.payment_date < p_to + 1
+    ) src
+    GROUP BY day, station_id, type_id;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ----------------------------
+-- 7. Заполненность станций (Occupancy)
+-- ----------------------------
+
+-- Счетчики велосипедов по станциям, поддерживаются триггерами на bikes и rentals:
+-- available и maintenance - велосипеды на станции, rented - взятые с нее и еще не возвращенные.
+-- Свободные места: capacity - available - maintenance
+CREATE TABLE station_occupancy (
+    station_id INT PRIMARY KEY,
+    available INT NOT NULL DEFAULT 0,
+    rented INT NOT NULL DEFAULT 0,
+    maintenance INT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION occupancy_add(
+    p_station_id INT,
+    p_available INT,
+    p_rented INT,
+    p_maintenance INT
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_station_id IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO station_occupancy AS o (station_id, available, rented, maintenance)
+    VALUES (p_station_id, p_available, p_rented, p_maintenance)
+    ON CONFLICT (station_id) DO UPDATE
+    SET 
+        available = o.available + EXCLUDED.available,
+        rented = o.rented + EXCLUDED.rented,
+        maintenance = o.maintenance + EXCLUDED.maintenance;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Велосипед на станции: вклад по станции и статусу (rented-велосипеды на станции не стоят)
+CREATE OR REPLACE FUNCTION occupancy_bikes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM occupancy_add(
+            OLD.station_id,
+            -(OLD.status = 'available')::int,
+            0,
+            -(OLD.status = 'under_maintenance')::int
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM occupancy_add(
+            NEW.station_id,
+            (NEW.status = 'available')::int,
+            0,
+            (NEW.status = 'under_maintenance')::int
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_occupancy_bikes_insert
+AFTER INSERT OR DELETE ON bikes
+FOR EACH ROW
+EXECUTE FUNCTION occupancy_bikes();
+
+CREATE TRIGGER trigger_occupancy_bikes_update
+AFTER UPDATE ON bikes
+FOR EACH ROW
+WHEN (
+    OLD.station_id IS DISTINCT FROM NEW.station_id OR
+    OLD.status IS DISTINCT FROM NEW.status
+)
+EXECUTE FUNCTION occupancy_bikes();
+
+-- Открытая аренда: велосипед числится взятым со станции начала
+CREATE OR REPLACE FUNCTION occupancy_rentals()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.end_time IS NULL THEN
+        PERFORM occupancy_add(OLD.start_station_id, 0, -1, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.end_time IS NULL THEN
+        PERFORM occupancy_add(NEW.start_station_id, 0, 1, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_occupancy_rentals_insert
+AFTER INSERT OR DELETE ON rentals
+FOR EACH ROW
+EXECUTE FUNCTION occupancy_rentals();
+
+CREATE TRIGGER trigger_occupancy_rentals_update
+AFTER UPDATE ON rentals
+FOR EACH ROW
+WHEN (
+    OLD.end_time IS DISTINCT FROM NEW.end_time OR
+    OLD.start_station_id IS DISTINCT FROM NEW.start_station_id
+)
+EXECUTE FUNCTION occupancy_rentals();
+
+-- Пересчет счетчиков из bikes и rentals (первичное заполнение, загрузка без триггеров)
+CREATE OR REPLACE FUNCTION rebuild_station_occupancy()
+RETURNS INT AS $$
+DECLARE
+    v_rows INT;
+BEGIN
+    LOCK TABLE station_occupancy IN SHARE ROW EXCLUSIVE MODE;
+
+    DELETE FROM station_occupancy;
+
+    INSERT INTO station_occupancy (station_id, available, rented, maintenance)
+    SELECT 
+        s.station_id,
+        COALESCE(b.available, 0),
+        COALESCE(r.rented, 0),
+        COALESCE(b.maintenance, 0)
+    FROM stations s
+    LEFT JOIN (
+        SELECT 
+            station_id,
+            COUNT(*) FILTER (WHERE status = 'available') AS available,
+            COUNT(*) FILTER (WHERE status = 'under_maintenance') AS maintenance
+        FROM bikes
+        WHERE station_id IS NOT NULL
+        GROUP BY station_id
+    ) b ON b.station_id = s.station_id
+    LEFT JOIN (
+        SELECT start_station_id AS station_id, COUNT(*) AS rented
+        FROM rentals
+        WHERE end_time IS NULL
+        GROUP BY start_station_id
+    ) r ON r.station_id = s.station_id;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ----------------------------
+-- 8. Состояние бота (Bot state)
+-- ----------------------------
+
+-- Состояние бота между перезапусками и экземплярами (utils/persistence.py):
+-- namespace - user_data или conversation:<имя диалога>, key - ID пользователя или ключ диалога (JSON)
+CREATE TABLE bot_state (
+    namespace VARCHAR(64) NOT NULL,
+    key VARCHAR(64) NOT NULL,
+    data JSONB NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (namespace, key)
+);
@@ -1,5 +1,8 @@
 -- Очистка таблиц (опционально)
 TRUNCATE TABLE 
+    daily_station_stats,
+    station_occupancy,
+    bot_state,
     reviews,
     payments,
     rentals,
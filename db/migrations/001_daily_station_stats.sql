@@ -0,0 +1,166 @@
+-- Дневные агрегаты аренд, минут поездок и выручки (для существующих БД).
+-- Повторный пересчет за период: python backfill_stats.py --from YYYY-MM-DD --to YYYY-MM-DD
+
+-- Дневные агрегаты по станции начала аренды и типу велосипеда.
+-- station_id/type_id = 0: станция или тип неизвестны (удалены)
+CREATE TABLE daily_station_stats (
+    day DATE NOT NULL,
+    station_id INT NOT NULL DEFAULT 0,
+    type_id INT NOT NULL DEFAULT 0,
+    rentals INT NOT NULL DEFAULT 0,
+    ride_minutes NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    revenue NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, station_id, type_id)
+);
+
+CREATE INDEX idx_daily_station_stats_station ON daily_station_stats(station_id, day);
+
+CREATE OR REPLACE FUNCTION rollup_add(
+    p_day DATE,
+    p_station_id INT,
+    p_type_id INT,
+    p_rentals INT,
+    p_ride_minutes NUMERIC,
+    p_revenue NUMERIC
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO daily_station_stats AS s (day, station_id, type_id, rentals, ride_minutes, revenue)
+    VALUES (p_day, COALESCE(p_station_id, 0), COALESCE(p_type_id, 0), p_rentals, p_ride_minutes, p_revenue)
+    ON CONFLICT (day, station_id, type_id) DO UPDATE
+    SET 
+        rentals = s.rentals + EXCLUDED.rentals,
+        ride_minutes = s.ride_minutes + EXCLUDED.ride_minutes,
+        revenue = s.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Вклад аренды: количество и минуты поездки относятся к дню и станции начала
+CREATE OR REPLACE FUNCTION rollup_rentals()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rollup_add(
+            OLD.start_time::date,
+            OLD.start_station_id,
+            (SELECT type_id FROM bikes WHERE bike_id = OLD.bike_id),
+            -1,
+            -COALESCE(EXTRACT(EPOCH FROM (OLD.end_time - OLD.start_time)) / 60, 0),
+            0
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM rollup_add(
+            NEW.start_time::date,
+            NEW.start_station_id,
+            (SELECT type_id FROM bikes WHERE bike_id = NEW.bike_id),
+            1,
+            COALESCE(EXTRACT(EPOCH FROM (NEW.end_time - NEW.start_time)) / 60, 0),
+            0
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_rollup_rentals_insert
+AFTER INSERT OR DELETE ON rentals
+FOR EACH ROW
+EXECUTE FUNCTION rollup_rentals();
+
+CREATE TRIGGER trigger_rollup_rentals_update
+AFTER UPDATE ON rentals
+FOR EACH ROW
+WHEN (
+    OLD.start_time IS DISTINCT FROM NEW.start_time OR
+    OLD.end_time IS DISTINCT FROM NEW.end_time OR
+    OLD.start_station_id IS DISTINCT FROM NEW.start_station_id
+)
+EXECUTE FUNCTION rollup_rentals();
+
+-- Вклад платежа: выручка по дню платежа, станции начала аренды и типу велосипеда
+CREATE OR REPLACE FUNCTION rollup_payment_amount(p_rental_id INT, p_payment_date TIMESTAMP, p_amount NUMERIC)
+RETURNS VOID AS $$
+DECLARE
+    v_station_id INT;
+    v_type_id INT;
+BEGIN
+    SELECT r.start_station_id, b.type_id
+    INTO v_station_id, v_type_id
+    FROM rentals r
+    LEFT JOIN bikes b ON r.bike_id = b.bike_id
+    WHERE r.rental_id = p_rental_id;
+
+    PERFORM rollup_add(p_payment_date::date, v_station_id, v_type_id, 0, 0, p_amount);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_payments()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'completed' THEN
+        PERFORM rollup_payment_amount(OLD.rental_id, OLD.payment_date, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'completed' THEN
+        PERFORM rollup_payment_amount(NEW.rental_id, NEW.payment_date, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_rollup_payments
+AFTER INSERT OR UPDATE OR DELETE ON payments
+FOR EACH ROW
+EXECUTE FUNCTION rollup_payments();
+
+-- Пересчет агрегатов за период из rentals/payments (первичное заполнение и исправление)
+CREATE OR REPLACE FUNCTION backfill_daily_stats(p_from DATE, p_to DATE)
+RETURNS INT AS $$
+DECLARE
+    v_rows INT;
+BEGIN
+    -- Триггеры параллельных транзакций ждут окончания пересчета
+    LOCK TABLE daily_station_stats IN SHARE ROW EXCLUSIVE MODE;
+
+    DELETE FROM daily_station_stats WHERE day BETWEEN p_from AND p_to;
+
+    INSERT INTO daily_station_stats (day, station_id, type_id, rentals, ride_minutes, revenue)
+    SELECT day, station_id, type_id, SUM(rentals), SUM(ride_minutes), SUM(revenue)
+    FROM (
+        SELECT 
+            r.start_time::date AS day,
+            COALESCE(r.start_station_id, 0) AS station_id,
+            COALESCE(b.type_id, 0) AS type_id,
+            1 AS rentals,
+            COALESCE(EXTRACT(EPOCH FROM (r.end_time - r.start_time)) / 60, 0) AS ride_minutes,
+            0 AS revenue
+        FROM rentals r
+        LEFT JOIN bikes b ON r.bike_id = b.bike_id
+        WHERE r.start_time >= p_from AND r.start_time < p_to + 1
+
+        UNION ALL
+
+        SELECT 
+            p.payment_date::date,
+            COALESCE(r.start_station_id, 0),
+            COALESCE(b.type_id, 0),
+            0,
+            0,
+            p.amount
+        FROM payments p
+        LEFT JOIN rentals r ON p.rental_id = r.rental_id
+        LEFT JOIN bikes b ON r.bike_id = b.bike_id
+        WHERE p.status = 'completed' AND p.payment_date >= p_from AND p.payment_date < p_to + 1
+    ) src
+    GROUP BY day, station_id, type_id;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заполнение агрегатов за всю историю
+SELECT backfill_daily_stats(
+    (SELECT COALESCE(MIN(start_time)::date, CURRENT_DATE) FROM rentals),
+    CURRENT_DATE
+);
@@ -0,0 +1,45 @@
+-- Процедура close_rental заменяется функцией, возвращающей payment_id и стоимость
+DROP PROCEDURE IF EXISTS close_rental(INT, INT);
+
+-- Завершение аренды, расчет стоимости и оплата за один вызов.
+-- Велосипед возвращается на станцию триггером trigger_rental_end
+CREATE OR REPLACE FUNCTION close_rental(
+    p_rental_id INT,
+    p_end_station_id INT
+)
+RETURNS TABLE (payment_id INT, cost NUMERIC)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_cost NUMERIC(10, 2);
+    v_payment_id INT;
+BEGIN
+    WITH closed AS (
+        UPDATE rentals r
+        SET 
+            end_time = NOW(),
+            end_station_id = p_end_station_id
+        WHERE r.rental_id = p_rental_id AND r.end_time IS NULL
+        RETURNING r.bike_id, r.start_time, r.end_time
+    )
+    -- Минимальная сумма платежа - 0.01 (payments.amount > 0)
+    SELECT GREATEST(
+        ROUND(EXTRACT(EPOCH FROM (c.end_time - c.start_time)) / 3600 * COALESCE(bt.price_per_hour, 0), 2),
+        0.01
+    )
+    INTO v_cost
+    FROM closed c
+    LEFT JOIN bikes b ON c.bike_id = b.bike_id
+    LEFT JOIN bike_types bt ON b.type_id = bt.type_id;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Rental % not found or already closed', p_rental_id;
+    END IF;
+
+    INSERT INTO payments (rental_id, amount, status)
+    VALUES (p_rental_id, v_cost, 'completed')
+    RETURNING payments.payment_id INTO v_payment_id;
+
+    RETURN QUERY SELECT v_payment_id, v_cost;
+END;
+$$;
@@ -0,0 +1,18 @@
+-- Краткосрочное удержание велосипеда между выбором и подтверждением аренды
+ALTER TABLE bikes
+    ADD COLUMN reserved_by BIGINT,
+    ADD COLUMN reserved_until TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION set_bike_rented()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE bikes
+    SET 
+        status = 'rented',
+        station_id = NULL,
+        reserved_by = NULL,
+        reserved_until = NULL
+    WHERE bike_id = NEW.bike_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,30 @@
+-- Индексы под запросы бота (для существующих БД).
+-- CONCURRENTLY не блокирует запись, но не работает внутри транзакции:
+-- применять через psql без --single-transaction.
+-- Проверка планов: python check_indexes.py
+
+-- Аренды пользователя по убыванию даты (get_user_rentals, get_rentals_per_day по пользователю)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_user_start ON rentals(user_id, start_time DESC);
+-- Аренды по дням (get_rentals_per_day)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_start_time ON rentals(start_time);
+-- Аренды по станции начала (get_station_stats)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_start_station ON rentals(start_station_id);
+-- Открытые аренды (active_rentals, get_active_rentals)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rentals_open ON rentals(user_id) WHERE end_time IS NULL;
+-- Доступные велосипеды по станциям (get_available_bikes)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bikes_available_station ON bikes(station_id, bike_id) WHERE status = 'available';
+-- Платежи аренды (get_payments_by_user, close_rental)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_rental_id ON payments(rental_id);
+-- Завершенные платежи по дате (get_completed_payments, calculate_total_income)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_payments_completed_date ON payments(payment_date) INCLUDE (amount) WHERE status = 'completed';
+-- Отзывы по велосипеду и пользователю (get_reviews_by_bike, get_average_rating, get_user_reviews)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reviews_bike_id ON reviews(bike_id) INCLUDE (rating);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_reviews_user_date ON reviews(user_id, review_date DESC);
+
+-- Заменен индексом idx_rentals_user_start
+DROP INDEX CONCURRENTLY IF EXISTS idx_rentals_user_id;
+
+ANALYZE rentals;
+ANALYZE bikes;
+ANALYZE payments;
+ANALYZE reviews;
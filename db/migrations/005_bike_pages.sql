@@ -0,0 +1,7 @@
+-- Индексы постраничного списка доступных велосипедов (get_available_bikes_page).
+-- Применять через psql без --single-transaction (CONCURRENTLY).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bikes_available ON bikes(bike_id) WHERE status = 'available';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bikes_available_type ON bikes(type_id, bike_id) WHERE status = 'available';
+
+ANALYZE bikes;
@@ -0,0 +1,221 @@
+-- Счетчики заполненности станций и запрет возврата на заполненную станцию.
+-- Применять одной транзакцией: счетчики пересчитываются под блокировкой bikes и rentals,
+-- чтобы изменения между созданием триггеров и пересчетом не потерялись.
+
+BEGIN;
+
+LOCK TABLE bikes, rentals IN SHARE ROW EXCLUSIVE MODE;
+
+-- Счетчики велосипедов по станциям, поддерживаются триггерами на bikes и rentals:
+-- available и maintenance - велосипеды на станции, rented - взятые с нее и еще не возвращенные.
+-- Свободные места: capacity - available - maintenance
+CREATE TABLE station_occupancy (
+    station_id INT PRIMARY KEY,
+    available INT NOT NULL DEFAULT 0,
+    rented INT NOT NULL DEFAULT 0,
+    maintenance INT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION occupancy_add(
+    p_station_id INT,
+    p_available INT,
+    p_rented INT,
+    p_maintenance INT
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_station_id IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO station_occupancy AS o (station_id, available, rented, maintenance)
+    VALUES (p_station_id, p_available, p_rented, p_maintenance)
+    ON CONFLICT (station_id) DO UPDATE
+    SET 
+        available = o.available + EXCLUDED.available,
+        rented = o.rented + EXCLUDED.rented,
+        maintenance = o.maintenance + EXCLUDED.maintenance;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Велосипед на станции: вклад по станции и статусу (rented-велосипеды на станции не стоят)
+CREATE OR REPLACE FUNCTION occupancy_bikes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM occupancy_add(
+            OLD.station_id,
+            -(OLD.status = 'available')::int,
+            0,
+            -(OLD.status = 'under_maintenance')::int
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM occupancy_add(
+            NEW.station_id,
+            (NEW.status = 'available')::int,
+            0,
+            (NEW.status = 'under_maintenance')::int
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_occupancy_bikes_insert
+AFTER INSERT OR DELETE ON bikes
+FOR EACH ROW
+EXECUTE FUNCTION occupancy_bikes();
+
+CREATE TRIGGER trigger_occupancy_bikes_update
+AFTER UPDATE ON bikes
+FOR EACH ROW
+WHEN (
+    OLD.station_id IS DISTINCT FROM NEW.station_id OR
+    OLD.status IS DISTINCT FROM NEW.status
+)
+EXECUTE FUNCTION occupancy_bikes();
+
+-- Открытая аренда: велосипед числится взятым со станции начала
+CREATE OR REPLACE FUNCTION occupancy_rentals()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.end_time IS NULL THEN
+        PERFORM occupancy_add(OLD.start_station_id, 0, -1, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.end_time IS NULL THEN
+        PERFORM occupancy_add(NEW.start_station_id, 0, 1, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_occupancy_rentals_insert
+AFTER INSERT OR DELETE ON rentals
+FOR EACH ROW
+EXECUTE FUNCTION occupancy_rentals();
+
+CREATE TRIGGER trigger_occupancy_rentals_update
+AFTER UPDATE ON rentals
+FOR EACH ROW
+WHEN (
+    OLD.end_time IS DISTINCT FROM NEW.end_time OR
+    OLD.start_station_id IS DISTINCT FROM NEW.start_station_id
+)
+EXECUTE FUNCTION occupancy_rentals();
+
+-- Пересчет счетчиков из bikes и rentals (первичное заполнение, загрузка без триггеров)
+CREATE OR REPLACE FUNCTION rebuild_station_occupancy()
+RETURNS INT AS $$
+DECLARE
+    v_rows INT;
+BEGIN
+    LOCK TABLE station_occupancy IN SHARE ROW EXCLUSIVE MODE;
+
+    DELETE FROM station_occupancy;
+
+    INSERT INTO station_occupancy (station_id, available, rented, maintenance)
+    SELECT 
+        s.station_id,
+        COALESCE(b.available, 0),
+        COALESCE(r.rented, 0),
+        COALESCE(b.maintenance, 0)
+    FROM stations s
+    LEFT JOIN (
+        SELECT 
+            station_id,
+            COUNT(*) FILTER (WHERE status = 'available') AS available,
+            COUNT(*) FILTER (WHERE status = 'under_maintenance') AS maintenance
+        FROM bikes
+        WHERE station_id IS NOT NULL
+        GROUP BY station_id
+    ) b ON b.station_id = s.station_id
+    LEFT JOIN (
+        SELECT start_station_id AS station_id, COUNT(*) AS rented
+        FROM rentals
+        WHERE end_time IS NULL
+        GROUP BY start_station_id
+    ) r ON r.station_id = s.station_id;
+
+    GET DIAGNOSTICS v_rows = ROW_COUNT;
+    RETURN v_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Завершение аренды, расчет стоимости и оплата за один вызов.
+-- Велосипед возвращается на станцию триггером trigger_rental_end.
+-- Возврат на заполненную станцию отклоняется с кодом BR001 (счетчики station_occupancy)
+CREATE OR REPLACE FUNCTION close_rental(
+    p_rental_id INT,
+    p_end_station_id INT
+)
+RETURNS TABLE (payment_id INT, cost NUMERIC)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_cost NUMERIC(10, 2);
+    v_payment_id INT;
+    v_free_docks INT;
+    v_start_station_id INT;
+BEGIN
+    SELECT r.start_station_id INTO v_start_station_id
+    FROM rentals r
+    WHERE r.rental_id = p_rental_id;
+
+    -- Строки счетчиков станций начала и возврата блокируются до конца транзакции
+    -- в порядке station_id (триггеры ниже берут те же строки): параллельные возвраты
+    -- на одну станцию не превысят вместимость, встречные возвраты не взаимоблокируются
+    INSERT INTO station_occupancy (station_id)
+    SELECT DISTINCT s.station_id
+    FROM unnest(ARRAY[v_start_station_id, p_end_station_id]) AS s(station_id)
+    WHERE s.station_id IS NOT NULL
+    ON CONFLICT (station_id) DO NOTHING;
+
+    PERFORM 1
+    FROM station_occupancy o
+    WHERE o.station_id IN (v_start_station_id, p_end_station_id)
+    ORDER BY o.station_id
+    FOR UPDATE;
+
+    SELECT s.capacity - o.available - o.maintenance
+    INTO v_free_docks
+    FROM station_occupancy o
+    JOIN stations s ON s.station_id = o.station_id
+    WHERE o.station_id = p_end_station_id;
+
+    IF v_free_docks <= 0 THEN
+        RAISE EXCEPTION 'Station % is full', p_end_station_id USING ERRCODE = 'BR001';
+    END IF;
+
+    WITH closed AS (
+        UPDATE rentals r
+        SET 
+            end_time = NOW(),
+            end_station_id = p_end_station_id
+        WHERE r.rental_id = p_rental_id AND r.end_time IS NULL
+        RETURNING r.bike_id, r.start_time, r.end_time
+    )
+    -- Минимальная сумма платежа - 0.01 (payments.amount > 0)
+    SELECT GREATEST(
+        ROUND(EXTRACT(EPOCH FROM (c.end_time - c.start_time)) / 3600 * COALESCE(bt.price_per_hour, 0), 2),
+        0.01
+    )
+    INTO v_cost
+    FROM closed c
+    LEFT JOIN bikes b ON c.bike_id = b.bike_id
+    LEFT JOIN bike_types bt ON b.type_id = bt.type_id;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Rental % not found or already closed', p_rental_id;
+    END IF;
+
+    INSERT INTO payments (rental_id, amount, status)
+    VALUES (p_rental_id, v_cost, 'completed')
+    RETURNING payments.payment_id INTO v_payment_id;
+
+    RETURN QUERY SELECT v_payment_id, v_cost;
+END;
+$$;
+
+SELECT rebuild_station_occupancy();
+
+COMMIT;
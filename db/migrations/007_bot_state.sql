@@ -0,0 +1,9 @@
+-- Состояние бота между перезапусками и экземплярами (utils/persistence.py):
+-- namespace - user_data или conversation:<имя диалога>, key - ID пользователя или ключ диалога (JSON)
+CREATE TABLE bot_state (
+    namespace VARCHAR(64) NOT NULL,
+    key VARCHAR(64) NOT NULL,
+    data JSONB NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (namespace, key)
+);
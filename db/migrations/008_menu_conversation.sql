@@ -0,0 +1,3 @@
+-- Диалоги аренды, рейтингов и добавления велосипеда объединены в один диалог "menu":
+-- состояния, сохраненные под старыми именами, больше не читаются
+DELETE FROM bot_state WHERE namespace IN ('conversation:rental', 'conversation:ratings', 'conversation:add_bike');
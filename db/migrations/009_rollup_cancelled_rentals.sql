@@ -0,0 +1,131 @@
+-- Выручка в дневных агрегатах при отмене аренды и смене ее велосипеда или станции начала:
+-- платежи, удаляемые каскадом вместе с арендой, вычитались из группы "станция и тип неизвестны".
+-- Применять одной транзакцией; агрегаты, искаженные ранее, пересчитываются в конце.
+
+BEGIN;
+
+-- Вклад аренды: количество и минуты поездки относятся к дню и станции начала
+CREATE OR REPLACE FUNCTION rollup_rentals()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_old_type_id INT;
+    v_new_type_id INT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        v_old_type_id := (SELECT type_id FROM bikes WHERE bike_id = OLD.bike_id);
+        PERFORM rollup_add(
+            OLD.start_time::date,
+            OLD.start_station_id,
+            v_old_type_id,
+            -1,
+            -COALESCE(EXTRACT(EPOCH FROM (OLD.end_time - OLD.start_time)) / 60, 0),
+            0
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        v_new_type_id := (SELECT type_id FROM bikes WHERE bike_id = NEW.bike_id);
+        PERFORM rollup_add(
+            NEW.start_time::date,
+            NEW.start_station_id,
+            v_new_type_id,
+            1,
+            COALESCE(EXTRACT(EPOCH FROM (NEW.end_time - NEW.start_time)) / 60, 0),
+            0
+        );
+    END IF;
+    -- Смена станции начала или велосипеда переносит выручку аренды в другую группу
+    IF TG_OP = 'UPDATE' AND (
+        OLD.start_station_id IS DISTINCT FROM NEW.start_station_id OR
+        v_old_type_id IS DISTINCT FROM v_new_type_id
+    ) THEN
+        PERFORM rollup_rental_payments(OLD.rental_id, OLD.start_station_id, v_old_type_id, -1);
+        PERFORM rollup_rental_payments(NEW.rental_id, NEW.start_station_id, v_new_type_id, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Выручка по завершенным платежам аренды с указанным знаком (группа задается явно)
+CREATE OR REPLACE FUNCTION rollup_rental_payments(p_rental_id INT, p_station_id INT, p_type_id INT, p_sign INT)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM rollup_add(p.payment_date::date, p_station_id, p_type_id, 0, 0, p_sign * p.amount)
+    FROM payments p
+    WHERE p.rental_id = p_rental_id AND p.status = 'completed';
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаление аренды (cancel_rental): выручка каскадно удаляемых платежей вычитается, пока
+-- аренда еще существует - триггер платежа после каскада уже не найдет ее станцию и тип
+CREATE OR REPLACE FUNCTION rollup_rental_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM rollup_rental_payments(
+        OLD.rental_id,
+        OLD.start_station_id,
+        (SELECT type_id FROM bikes WHERE bike_id = OLD.bike_id),
+        -1
+    );
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_rollup_rentals_update ON rentals;
+CREATE TRIGGER trigger_rollup_rentals_update
+AFTER UPDATE ON rentals
+FOR EACH ROW
+WHEN (
+    OLD.start_time IS DISTINCT FROM NEW.start_time OR
+    OLD.end_time IS DISTINCT FROM NEW.end_time OR
+    OLD.start_station_id IS DISTINCT FROM NEW.start_station_id OR
+    OLD.bike_id IS DISTINCT FROM NEW.bike_id
+)
+EXECUTE FUNCTION rollup_rentals();
+
+DROP TRIGGER IF EXISTS trigger_rollup_rentals_delete ON rentals;
+CREATE TRIGGER trigger_rollup_rentals_delete
+BEFORE DELETE ON rentals
+FOR EACH ROW
+EXECUTE FUNCTION rollup_rental_delete();
+
+-- Вклад платежа: выручка по дню платежа, станции начала аренды и типу велосипеда
+CREATE OR REPLACE FUNCTION rollup_payment_amount(p_rental_id INT, p_payment_date TIMESTAMP, p_amount NUMERIC)
+RETURNS VOID AS $$
+DECLARE
+    v_station_id INT;
+    v_type_id INT;
+BEGIN
+    SELECT r.start_station_id, b.type_id
+    INTO v_station_id, v_type_id
+    FROM rentals r
+    LEFT JOIN bikes b ON r.bike_id = b.bike_id
+    WHERE r.rental_id = p_rental_id;
+
+    -- Аренда удалена: выручку ее платежей уже вычел rollup_rental_delete
+    IF p_rental_id IS NOT NULL AND NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    PERFORM rollup_add(p_payment_date::date, v_station_id, v_type_id, 0, 0, p_amount);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_payments()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'completed' THEN
+        PERFORM rollup_payment_amount(OLD.rental_id, OLD.payment_date, -OLD.amount);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'completed' THEN
+        PERFORM rollup_payment_amount(NEW.rental_id, NEW.payment_date, NEW.amount);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT backfill_daily_stats(
+    LEAST((SELECT MIN(start_time)::date FROM rentals), (SELECT MIN(payment_date)::date FROM payments)),
+    CURRENT_DATE
+);
+
+COMMIT;
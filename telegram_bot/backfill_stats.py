@@ -0,0 +1,35 @@
+import argparse
+import logging
+from datetime import date
+
+from config import LOGGING_CONFIG
+from utils.db import backfill_daily_stats, get_rentals_date_range, close_pool
+
+logging.basicConfig(
+    format=LOGGING_CONFIG["format"],
+    level=LOGGING_CONFIG["level"]
+)
+logger = logging.getLogger(__name__)
+
+def main():
+    """Пересчет дневных агрегатов (daily_station_stats) за период"""
+    parser = argparse.ArgumentParser(description="Пересчет дневных агрегатов аренд и выручки")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat,
+                        help="Первый день (YYYY-MM-DD), по умолчанию - день первой аренды")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat,
+                        help="Последний день (YYYY-MM-DD), по умолчанию - сегодня")
+    args = parser.parse_args()
+
+    start = args.start or get_rentals_date_range()['first_day'] or date.today()
+    end = args.end or date.today()
+    if start > end:
+        parser.error("--from должна быть не позже --to")
+
+    try:
+        rows = backfill_daily_stats(start, end)
+        logger.info(f"Daily stats rebuilt for {start}..{end}: {rows} rows")
+    finally:
+        close_pool()
+
+if __name__ == "__main__":
+    main()
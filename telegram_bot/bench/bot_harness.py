@@ -0,0 +1,341 @@
+"""
+Нагрузочный прогон бота целиком: синтетические Update подаются в self.application,
+ответы бота перехватывает заглушка транспорта Bot API - без обращений к Telegram.
+
+Запуск (из каталога telegram_bot, на локальной БД, заполненной bench.generate):
+    python -m bench.bot_harness --users 2000 --concurrency 200 --json bot.json
+
+Каждый симулированный пользователь проходит /start и сценарий в едином диалоге "menu"
+(_menu_conversation_handler): аренда -> возврат -> отзыв либо меню статистики.
+Отчет: обновлений в секунду, задержка по каждому обработчику и задержка цикла событий.
+
+С --webhook обновления отправляются POST-запросами на локальный webhook-сервер бота
+и проходят весь путь режима webhook, включая ChatOrderedUpdateProcessor:
+    python -m bench.bot_harness --webhook --users 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import defaultdict
+from itertools import count
+
+# Токен не используется (запросы к Bot API не уходят из процесса), но нужен для проверки конфигурации
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:HARNESS")
+
+import httpx
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+from config import LOGGING_CONFIG
+from main import BikeRentalBot
+from utils.catalog import catalog
+from bench.replay import percentile
+
+logging.basicConfig(
+    format=LOGGING_CONFIG["format"],
+    level=LOGGING_CONFIG["level"]
+)
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Harness", "username": "harness_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+HARNESS_SECRET = "harness-secret"
+
+BIKE_LINE = re.compile(r"^(\d+) - ", re.MULTILINE)
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Транспорт Bot API в памяти: отвечает на методы бота и запоминает отправленные сообщения"""
+
+    def __init__(self, latency: float = 0.0):
+        # Имитация сетевой задержки до Telegram (в секундах)
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self._message_ids = count(1)
+        self._replies = defaultdict(list)  # chat_id -> [(метод, текст)]
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def replies(self, chat_id: int) -> list:
+        """Забрать ответы бота в чат"""
+        return self._replies.pop(chat_id, [])
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method.startswith("send"):
+            chat_id = int(params["chat_id"])
+            text = params.get("text") or params.get("caption") or ""
+            self._replies[chat_id].append((api_method, text))
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": text,
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class SimulatedUser:
+    """Пользователь Telegram, который пишет боту и читает ответы"""
+
+    update_ids = count(1)
+
+    def __init__(self, user_id: int, bot: BikeRentalBot, transport: FakeTelegramRequest, stats: dict,
+                 webhook: "WebhookClient" = None):
+        self.user_id = user_id
+        self.bot = bot
+        self.transport = transport
+        self.stats = stats
+        self.webhook = webhook
+
+    def _update(self, text: str) -> dict:
+        update_id = next(self.update_ids)
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": {"id": self.user_id, "is_bot": False, "first_name": f"User {self.user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    async def send(self, handler: str, text: str) -> str:
+        """Отправить сообщение боту, вернуть текст последнего ответа"""
+        application = self.bot.application
+        update = self._update(text)
+        started = time.perf_counter()
+        if self.webhook:
+            await self.webhook.post(update)
+        else:
+            await application.process_update(Update.de_json(update, application.bot))
+        self.stats["latency"][handler].append(time.perf_counter() - started)
+        self.stats["updates"] += 1
+        replies = self.transport.replies(self.user_id)
+        return replies[-1][1] if replies else ""
+
+    async def rent_and_return(self, rng: random.Random, stations: list):
+        """Аренда -> возврат -> отзыв"""
+        reply = await self.send("start_rental", "🚲 Арендовать велосипед")
+        bike_ids = BIKE_LINE.findall(reply)
+        if not bike_ids:
+            return "no_bikes"
+        # Из начала списка, чтобы пользователи иногда конкурировали за один велосипед
+        reply = await self.send("select_bike", rng.choice(bike_ids[:20]))
+        if not reply.startswith("Вы выбрали"):
+            return "bike_taken"
+        reply = await self.send("confirm_rental", "✅ Подтвердить")
+        if not reply.startswith("🚴 Аренда начата"):
+            return "start_failed"
+        await self.send("rental_actions", "🔙 Завершить аренду")
+        # Заполненная станция отклоняет возврат - пробуем другую
+        for _ in range(5):
+            reply = await self.send("process_end_station", str(rng.choice(stations)))
+            if reply.startswith("⭐"):
+                break
+        else:
+            await self.send("cancel_rental", "/cancel")
+            return "stations_full"
+        await self.send("process_review_rating", str(rng.randint(1, 5)))
+        reply = await self.send("process_review_comment", "🚫 Пропустить")
+        return "completed" if reply.startswith("⭐ Спасибо") else "close_failed"
+
+    async def browse_stats(self, rng: random.Random, stations: list):
+        """Меню статистики и графики"""
+        await self.send("show_stats_menu", "📊 Статистика")
+        await self.send("show_rentals_stats", "📈 Аренды")
+        await self.send("show_income_stats", "💰 Доходы")
+        await self.send("start", "🔙 Назад")
+        return "stats"
+
+    async def run(self, rng: random.Random, stations: list, rental_share: float):
+        await self.send("start", "/start")
+        scenario = self.rent_and_return if rng.random() < rental_share else self.browse_stats
+        try:
+            outcome = await scenario(rng, stations)
+        except Exception as e:
+            logger.debug(f"User {self.user_id} failed: {e}")
+            outcome = "error"
+        self.stats["outcomes"][outcome] += 1
+
+
+class WebhookClient:
+    """Отправка обновлений на webhook бота и ожидание окончания их обработки"""
+
+    def __init__(self, application, port: int, timeout: float = 60):
+        self.url = f"http://127.0.0.1:{port}/harness"
+        self.timeout = timeout
+        self._client = httpx.AsyncClient(limits=httpx.Limits(max_connections=100))
+        self._waiting = {}  # update_id -> future
+        # Последняя группа: срабатывает после всех обработчиков бота
+        application.add_handler(TypeHandler(Update, self._processed), group=1000)
+
+    async def _processed(self, update: Update, context):
+        future = self._waiting.pop(update.update_id, None)
+        if future and not future.done():
+            future.set_result(None)
+
+    async def post(self, update: dict):
+        """POST обновления; возвращается, когда бот его обработал"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[update["update_id"]] = future
+        try:
+            response = await self._client.post(
+                self.url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": HARNESS_SECRET}
+            )
+            response.raise_for_status()
+            await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._waiting.pop(update["update_id"], None)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+async def loop_lag(samples: list, interval: float = 0.01):
+    """Задержка цикла событий: насколько позже запланированного просыпается задача"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+async def run(args) -> dict:
+    """Прогон симулированных пользователей через бота"""
+    transport = FakeTelegramRequest(latency=args.api_latency / 1000)
+    bot = BikeRentalBot(request=transport)
+    application = bot.application
+    stats = {"updates": 0, "latency": defaultdict(list), "outcomes": defaultdict(int)}
+    lag = []
+
+    webhook = WebhookClient(application, args.webhook_port) if args.webhook else None
+    await application.initialize()
+    await application.post_init(application)
+    if webhook:
+        # setWebhook уходит в заглушку транспорта
+        await application.updater.start_webhook(
+            listen="127.0.0.1", port=args.webhook_port, url_path="harness", secret_token=HARNESS_SECRET
+        )
+        await application.start()
+    lag_task = asyncio.create_task(loop_lag(lag))
+    try:
+        stations = [s['station_id'] for s in catalog.stations()]
+        if not stations:
+            raise RuntimeError("Нет станций: сначала запустите bench.generate")
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def simulate(i: int):
+            rng = random.Random(args.seed + i)
+            async with semaphore:
+                user = SimulatedUser(args.user_base + i, bot, transport, stats, webhook)
+                await user.run(rng, stations, args.rental_share)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate(i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        lag_task.cancel()
+        if webhook:
+            await webhook.close()
+            await application.updater.stop()
+            await application.stop()
+        await application.post_stop(application)
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+    report = {}
+    for handler, values in sorted(stats["latency"].items()):
+        values.sort()
+        report[handler] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    lag.sort()
+    report["_total"] = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "mode": "webhook" if args.webhook else "direct",
+        "updates": stats["updates"],
+        "updates_per_s": stats["updates"] / elapsed,
+        "elapsed_s": elapsed,
+        "outcomes": dict(stats["outcomes"]),
+        "api_calls": dict(transport.calls),
+        "loop_lag_p50_ms": percentile(lag, 50) * 1000,
+        "loop_lag_p99_ms": percentile(lag, 99) * 1000,
+        "loop_lag_max_ms": (lag[-1] if lag else 0.0) * 1000,
+    }
+    return report
+
+def print_report(report: dict):
+    """Таблица результатов"""
+    print(f"{'handler':<26}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, r in report.items():
+        if name.startswith("_"):
+            continue
+        print(f"{name:<26}{r['count']:>8}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}")
+    total = report["_total"]
+    print(f"total: {total['updates']} updates from {total['users']} users, "
+          f"{total['updates_per_s']:.1f} updates/s in {total['elapsed_s']:.1f}s "
+          f"at concurrency {total['concurrency']} ({total['mode']})")
+    print(f"event loop lag: p50 {total['loop_lag_p50_ms']:.2f} ms, "
+          f"p99 {total['loop_lag_p99_ms']:.2f} ms, max {total['loop_lag_max_ms']:.2f} ms")
+    print(f"outcomes: {total['outcomes']}")
+    print(f"Bot API calls: {total['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота с заглушкой Telegram")
+    parser.add_argument("--users", type=int, default=1000, help="Число симулированных пользователей")
+    parser.add_argument("--concurrency", type=int, default=100, help="Одновременно активных пользователей")
+    parser.add_argument("--rental-share", type=float, default=0.7,
+                        help="Доля пользователей со сценарием аренды (остальные смотрят статистику)")
+    parser.add_argument("--api-latency", type=float, default=0, help="Задержка ответа Bot API (в мс)")
+    parser.add_argument("--user-base", type=int, default=3_000_000_000,
+                        help="Первый ID симулированных пользователей")
+    parser.add_argument("--webhook", action="store_true",
+                        help="Отправлять обновления POST-запросами на webhook вместо прямого вызова")
+    parser.add_argument("--webhook-port", type=int, default=8444, help="Порт локального webhook-сервера")
+    parser.add_argument("--json", help="Сохранить отчет в JSON")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Генератор синтетического парка для нагрузочного тестирования.
+
+Запуск (из каталога telegram_bot, только на тестовой БД):
+    python -m bench.generate --stations 2000 --bikes 100000 --users 200000 --rentals 10000000
+
+Станции, пользователи, велосипеды и аренды загружаются через COPY потоком,
+без накопления строк в памяти. Платежи и отзывы строятся из загруженных аренд
+на стороне БД. Построчные триггеры на время загрузки отключаются
+(session_replication_role = replica, нужны права суперпользователя),
+дневные агрегаты и счетчики заполненности станций затем пересчитываются целиком.
+"""
+import argparse
+import logging
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from psycopg2 import sql
+
+from config import LOGGING_CONFIG
+from utils.db import DBManager, close_pool
+
+logging.basicConfig(
+    format=LOGGING_CONFIG["format"],
+    level=LOGGING_CONFIG["level"]
+)
+logger = logging.getLogger(__name__)
+
+# Относительная интенсивность аренд по часам суток: утренний и вечерний пики
+HOURLY_WEIGHTS = [
+    1, 1, 1, 1, 1, 2, 4, 9, 12, 8, 5, 5,
+    6, 6, 5, 6, 8, 12, 13, 10, 7, 5, 3, 2
+]
+# В выходные поездок меньше, но они длиннее
+WEEKEND_FACTOR = 0.7
+WEEKEND_DURATION_FACTOR = 1.6
+
+# Московский регион: станции распределены вокруг центра
+CENTER = (55.751244, 37.618423)
+
+class CsvStream:
+    """Файлоподобный поток CSV-строк для COPY ... FROM STDIN"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = b""
+        self.count = 0
+
+    @staticmethod
+    def _format(row) -> bytes:
+        # Значения синтетические: без запятых, кавычек и переводов строк
+        return (",".join("" if v is None else str(v) for v in row) + "\n").encode()
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = self._format(row)
+            chunks.append(line)
+            length += len(line)
+            self.count += 1
+        data = b"".join(chunks)
+        if size < 0:
+            self._buffer = b""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_rows(db: DBManager, table: str, columns: list, rows) -> int:
+    """Загрузка строк в таблицу через COPY FROM STDIN"""
+    query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns))
+    ).as_string(db.conn)
+    stream = CsvStream(rows)
+    started = time.perf_counter()
+    db.cursor.copy_expert(query, stream, size=1 << 16)
+    logger.info(f"COPY {table}: {stream.count} rows in {time.perf_counter() - started:.1f}s")
+    return stream.count
+
+def next_id(db: DBManager, table: str, column: str) -> int:
+    """Первый свободный ID таблицы"""
+    query = sql.SQL("SELECT COALESCE(MAX({}), 0) + 1 AS next_id FROM {}").format(
+        sql.Identifier(column), sql.Identifier(table)
+    )
+    return db.fetch_one(query)['next_id']
+
+def sync_sequence(db: DBManager, table: str, column: str):
+    """Сдвиг последовательности SERIAL после вставки явных ID"""
+    db.execute(
+        sql.SQL("SELECT setval(pg_get_serial_sequence(%s, %s), (SELECT MAX({}) FROM {}))").format(
+            sql.Identifier(column), sql.Identifier(table)
+        ),
+        (table, column)
+    )
+
+
+def station_rows(rng: random.Random, first_id: int, count: int):
+    """Станции вокруг центра города"""
+    for i in range(count):
+        # Плотность станций выше в центре
+        distance = abs(rng.gauss(0, 0.12))
+        angle = rng.uniform(0, 2 * math.pi)
+        yield (
+            first_id + i,
+            f"Станция {first_id + i}",
+            f"Адрес {first_id + i}",
+            rng.choice((30, 40, 50, 60, 80)),
+            round(CENTER[0] + distance * math.sin(angle), 6),
+            round(CENTER[1] + distance * 1.8 * math.cos(angle), 6),
+        )
+
+def user_rows(first_id: int, count: int):
+    """Клиенты с последовательными ID"""
+    for i in range(count):
+        user_id = first_id + i
+        yield (user_id, f"Пользователь {user_id}", f"user_{user_id}", "client")
+
+def bike_rows(rng: random.Random, first_id: int, count: int, type_ids: list, station_ids: list):
+    """Велосипеды, равномерно распределенные по станциям"""
+    for i in range(count):
+        status = "under_maintenance" if rng.random() < 0.03 else "available"
+        yield (
+            first_id + i,
+            rng.choice(type_ids),
+            rng.choice(station_ids),
+            status,
+            (datetime(2022, 1, 1) + timedelta(days=rng.randrange(1000))).date(),
+        )
+
+def rental_rows(rng: random.Random, first_id: int, count: int, days: int,
+                user_ids: range, bike_ids: range, station_ids: list):
+    """Аренды с суточными пиками, выходными и "тяжелыми" пользователями"""
+    now = datetime.now().replace(microsecond=0)
+    start_day = (now - timedelta(days=days)).replace(hour=0, minute=0, second=0)
+    day_weights = [
+        WEEKEND_FACTOR if (start_day + timedelta(days=d)).weekday() >= 5 else 1.0
+        for d in range(days + 1)
+    ]
+    day_cum_weights = list(accumulate(day_weights))
+    hour_cum_weights = list(accumulate(HOURLY_WEIGHTS))
+    day_choices = list(range(days + 1))
+    hours = list(range(24))
+
+    # Небольшая доля "постоянных" пользователей дает большую часть поездок
+    heavy_users = max(len(user_ids) // 20, 1)
+
+    for i in range(count):
+        day = rng.choices(day_choices, cum_weights=day_cum_weights)[0]
+        hour = rng.choices(hours, cum_weights=hour_cum_weights)[0]
+        start = start_day + timedelta(days=day, hours=hour, seconds=rng.randrange(3600))
+        if start >= now:
+            start = now - timedelta(seconds=rng.randrange(1, 3600))
+
+        duration_factor = WEEKEND_DURATION_FACTOR if start.weekday() >= 5 else 1.0
+        minutes = max(2, min(int(rng.lognormvariate(3.0, 0.6) * duration_factor), 600))
+        end = start + timedelta(minutes=minutes)
+        open_rental = end > now
+
+        if rng.random() < 0.5:
+            user_id = user_ids[rng.randrange(heavy_users)]
+        else:
+            user_id = user_ids[rng.randrange(len(user_ids))]
+
+        yield (
+            first_id + i,
+            user_id,
+            bike_ids[rng.randrange(len(bike_ids))],
+            start,
+            None if open_rental else end,
+            rng.choice(station_ids),
+            None if open_rental else rng.choice(station_ids),
+        )
+
+
+def scaled(rentals: int) -> dict:
+    """Размеры парка, пропорциональные числу аренд (для быстрых проверок на небольшой БД)"""
+    return {
+        "stations": max(rentals // 5000, 5),
+        "bikes": max(rentals // 100, 10),
+        "users": max(rentals // 50, 10),
+        "rentals": rentals,
+    }
+
+def generate(stations: int, bikes: int, users: int, rentals: int, days: int = 365,
+             review_share: float = 0.2, user_base: int = 2_000_000_000, seed: int = 42):
+    """Генерация и загрузка синтетического парка"""
+    rng = random.Random(seed)
+
+    with DBManager() as db:
+        db.execute("SET session_replication_role = replica")
+
+        type_ids = [row['type_id'] for row in db.fetch_all("SELECT type_id FROM bike_types")]
+        if not type_ids:
+            db.execute("""
+                INSERT INTO bike_types (name, description, price_per_hour) VALUES
+                ('Городской', 'Удобный для города', 150),
+                ('Горный', 'Проходимый с амортизацией', 200),
+                ('Шоссейный', 'Легкий для скоростной езды', 250),
+                ('Электро', 'С электроприводом', 350)
+            """)
+            type_ids = [row['type_id'] for row in db.fetch_all("SELECT type_id FROM bike_types")]
+
+        first_station = next_id(db, "stations", "station_id")
+        copy_rows(db, "stations",
+                  ["station_id", "name", "address", "capacity", "latitude", "longitude"],
+                  station_rows(rng, first_station, stations))
+        station_ids = list(range(first_station, first_station + stations))
+
+        first_user = max(next_id(db, "users", "user_id"), user_base)
+        copy_rows(db, "users", ["user_id", "full_name", "username", "role"],
+                  user_rows(first_user, users))
+        user_ids = range(first_user, first_user + users)
+
+        first_bike = next_id(db, "bikes", "bike_id")
+        copy_rows(db, "bikes", ["bike_id", "type_id", "station_id", "status", "purchase_date"],
+                  bike_rows(rng, first_bike, bikes, type_ids, station_ids))
+        bike_ids = range(first_bike, first_bike + bikes)
+
+        first_rental = next_id(db, "rentals", "rental_id")
+        copy_rows(db, "rentals",
+                  ["rental_id", "user_id", "bike_id", "start_time", "end_time",
+                   "start_station_id", "end_station_id"],
+                  rental_rows(rng, first_rental, rentals, days, user_ids, bike_ids, station_ids))
+
+        for table, column in (("stations", "station_id"), ("bikes", "bike_id"), ("rentals", "rental_id")):
+            sync_sequence(db, table, column)
+
+        # Платежи и отзывы строятся из загруженных аренд на стороне БД
+        started = time.perf_counter()
+        db.execute("""
+            INSERT INTO payments (rental_id, amount, payment_date, status)
+            SELECT
+                r.rental_id,
+                GREATEST(ROUND(EXTRACT(EPOCH FROM (r.end_time - r.start_time)) / 3600 * bt.price_per_hour, 2), 0.01),
+                r.end_time,
+                CASE WHEN random() < 0.03 THEN 'failed' ELSE 'completed' END
+            FROM rentals r
+            JOIN bikes b ON r.bike_id = b.bike_id
+            JOIN bike_types bt ON b.type_id = bt.type_id
+            WHERE r.rental_id >= %(first)s AND r.end_time IS NOT NULL
+        """, {"first": first_rental})
+        db.execute("""
+            INSERT INTO reviews (user_id, bike_id, rating, comment, review_date)
+            SELECT
+                r.user_id,
+                r.bike_id,
+                LEAST(5, 1 + FLOOR(random() * 5 + random())::int),
+                NULL,
+                r.end_time + INTERVAL '5 minutes'
+            FROM rentals r
+            WHERE r.rental_id >= %(first)s AND r.end_time IS NOT NULL AND random() < %(share)s
+        """, {"first": first_rental, "share": review_share})
+
+        # Велосипеды в открытых арендах - в статусе rented, без станции
+        db.execute("""
+            UPDATE bikes b
+            SET status = 'rented', station_id = NULL
+            FROM rentals r
+            WHERE r.bike_id = b.bike_id AND r.end_time IS NULL AND r.rental_id >= %(first)s
+        """, {"first": first_rental})
+        logger.info(f"Payments, reviews and bike states built in {time.perf_counter() - started:.1f}s")
+
+        db.execute("SET session_replication_role = DEFAULT")
+        db.execute("SELECT rebuild_station_occupancy()")
+        db.execute(
+            "SELECT backfill_daily_stats((SELECT MIN(start_time)::date FROM rentals), CURRENT_DATE)",
+            commit=True
+        )
+
+    with DBManager() as db:
+        db.conn.autocommit = True
+        db.execute("VACUUM ANALYZE")
+        db.conn.autocommit = False
+    logger.info("Synthetic fleet loaded")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетические данные для нагрузочного теста (только тестовая БД!)")
+    parser.add_argument("--stations", type=int, default=2000)
+    parser.add_argument("--bikes", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--rentals", type=int, default=10_000_000)
+    parser.add_argument("--days", type=int, default=365, help="Глубина истории аренд")
+    parser.add_argument("--review-share", type=float, default=0.2, help="Доля аренд с отзывом")
+    parser.add_argument("--user-base", type=int, default=2_000_000_000,
+                        help="Первый ID синтетических пользователей")
+    parser.add_argument("--seed", type=int, default=42, help="Зерно генератора случайных чисел")
+    args = parser.parse_args()
+
+    try:
+        generate(args.stations, args.bikes, args.users, args.rentals, args.days,
+                 args.review_share, args.user_base, args.seed)
+    finally:
+        close_pool()
+
+if __name__ == "__main__":
+    main()
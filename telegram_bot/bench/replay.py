@@ -0,0 +1,211 @@
+"""
+Нагрузочный прогон: смесь запросов бота к utils.db и utils.plots с заданной параллельностью.
+
+Запуск (из каталога telegram_bot, на БД, заполненной bench.generate):
+    python -m bench.replay --concurrency 32 --duration 60 --json result.json
+    python -m bench.replay --baseline result.json --max-regression 0.2
+
+Отчет: число вызовов, ошибки, пропускная способность и p50/p95/p99 по каждому хелперу.
+С --baseline процесс завершается с кодом 1, если p95 какого-либо хелпера вырос
+больше допустимого - для проверки перед выкладкой.
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DB_CONFIG, LOGGING_CONFIG
+from utils import db, plots, catalog
+from utils.db import DBManager, init_pool, close_pool
+
+logging.basicConfig(
+    format=LOGGING_CONFIG["format"],
+    level=LOGGING_CONFIG["level"]
+)
+logger = logging.getLogger(__name__)
+
+
+class Params:
+    """Выборка реальных ID из БД для параметров хелперов"""
+
+    def __init__(self, sample_size: int = 1000):
+        with DBManager() as dbm:
+            self.users = [r['user_id'] for r in dbm.fetch_all(
+                "SELECT DISTINCT user_id FROM rentals TABLESAMPLE SYSTEM (1) LIMIT %s", (sample_size,))]
+            self.bikes = [r['bike_id'] for r in dbm.fetch_all(
+                "SELECT DISTINCT bike_id FROM reviews TABLESAMPLE SYSTEM (1) LIMIT %s", (sample_size,))]
+        self.stations = [s['station_id'] for s in catalog.get_all_stations()]
+        if not (self.users and self.bikes and self.stations):
+            raise RuntimeError("Недостаточно данных: сначала запустите bench.generate")
+
+
+def rental_flow(p: Params, rng: random.Random):
+    """Полный цикл аренды: удержание, старт и завершение с оплатой"""
+    bikes = db.get_available_bikes(rng.choice(p.stations))
+    if not bikes:
+        return
+    user_id = rng.choice(p.users)
+    bike = db.reserve_bike(bikes[0]['bike_id'], user_id)
+    if not bike:
+        return
+    rental_id = db.start_rental(user_id, bike['bike_id'], bike['station_id'])
+    if rental_id:
+        db.close_rental(rental_id, rng.choice(p.stations))
+
+def check_user_role(p: Params, rng: random.Random):
+    """Проверка роли с чтением из БД: в боте она почти всегда обслуживается кэшем, здесь кэш сбрасывается"""
+    user_id = rng.choice(p.users)
+    db.invalidate_identity(user_id)
+    return db.check_user_role(user_id, "admin")
+
+# pyplot не потокобезопасен: графики строятся по одному (в боте - в отдельных процессах render_service)
+_plot_lock = threading.Lock()
+
+def plot(call):
+    """Построение графика под общей блокировкой (время ожидания входит в задержку)"""
+    def locked(p: Params, rng: random.Random):
+        with _plot_lock:
+            return call(p, rng)
+    return locked
+
+# Смесь операций: (название, вес, вызов). Веса - примерная доля нажатий кнопок в боте
+MIX = [
+    ("check_user_role(uncached)", 30, check_user_role),
+    ("get_available_bikes", 20, lambda p, rng: db.get_available_bikes(rng.choice(p.stations))),
+    ("get_user_rentals", 8, lambda p, rng: db.get_user_rentals(rng.choice(p.users))),
+    ("station_exists", 5, lambda p, rng: catalog.station_exists(rng.choice(p.stations))),
+    ("rental_flow", 5, rental_flow),
+    ("get_payments_by_user", 3, lambda p, rng: db.get_payments_by_user(rng.choice(p.users))),
+    ("get_average_rating", 3, lambda p, rng: db.get_average_rating(rng.choice(p.bikes))),
+    ("get_reviews_by_bike", 2, lambda p, rng: db.get_reviews_by_bike(rng.choice(p.bikes))),
+    ("get_rentals_per_day", 3, lambda p, rng: db.get_rentals_per_day(7)),
+    ("get_daily_income", 2, lambda p, rng: db.get_daily_income(30)),
+    ("get_station_activity", 1, lambda p, rng: db.get_station_activity(30)),
+    ("plot_rentals", 1, plot(lambda p, rng: plots.generate_rentals_plot(days=7, output="bytes"))),
+    ("plot_income", 1, plot(lambda p, rng: plots.generate_income_plot(days=30, output="bytes"))),
+    ("plot_ratings", 1, plot(lambda p, rng: plots.generate_rating_distribution(rng.choice(p.bikes), output="bytes"))),
+]
+
+
+def percentile(values: list, q: float) -> float:
+    """Перцентиль отсортированного списка"""
+    if not values:
+        return 0.0
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+def run(mix: list, params: Params, concurrency: int, duration: float, seed: int) -> dict:
+    """Прогон смеси операций, возвращает статистику по операциям"""
+    names = [name for name, _, _ in mix]
+    weights = [weight for _, weight, _ in mix]
+    calls = {name: call for name, _, call in mix}
+    latencies = {name: [] for name in names}
+    errors = defaultdict(int)
+    errors_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id: int):
+        rng = random.Random(seed + worker_id)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights=weights)[0]
+            started = time.perf_counter()
+            try:
+                calls[name](params, rng)
+            except Exception as e:
+                with errors_lock:
+                    errors[name] += 1
+                logger.debug(f"{name} failed: {e}")
+                continue
+            latencies[name].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for name in names:
+        values = sorted(latencies[name])
+        report[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": (values[-1] if values else 0.0) * 1000,
+        }
+    total = sum(r["count"] for r in report.values())
+    report["_total"] = {"count": total, "rps": total / elapsed, "elapsed_s": elapsed, "concurrency": concurrency}
+    return report
+
+def print_report(report: dict):
+    """Таблица результатов"""
+    print(f"{'helper':<24}{'count':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, r in report.items():
+        if name.startswith("_"):
+            continue
+        print(f"{name:<24}{r['count']:>8}{r['errors']:>6}{r['rps']:>9.1f}"
+              f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['max_ms']:>10.2f}")
+    total = report["_total"]
+    print(f"total: {total['count']} calls, {total['rps']:.1f} calls/s "
+          f"in {total['elapsed_s']:.1f}s at concurrency {total['concurrency']}")
+
+def regressions(report: dict, baseline: dict, max_regression: float, min_count: int = 20) -> list:
+    """Хелперы, у которых p95 вырос больше допустимого относительно baseline"""
+    found = []
+    for name, base in baseline.items():
+        current = report.get(name)
+        if name.startswith("_") or not current or current["count"] < min_count or not base.get("p95_ms"):
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            found.append(f"{name}: p95 {base['p95_ms']:.2f} -> {current['p95_ms']:.2f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон запросов бота")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="Длительность прогона (в секундах)")
+    parser.add_argument("--only", nargs="*", help="Прогнать только указанные операции")
+    parser.add_argument("--no-plots", action="store_true", help="Без построения графиков")
+    parser.add_argument("--json", help="Сохранить отчет в JSON")
+    parser.add_argument("--baseline", help="Сравнить с отчетом предыдущего прогона")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Допустимый рост p95 относительно baseline (доля)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    mix = [m for m in MIX if not (args.no_plots and m[0].startswith("plot_"))]
+    if args.only:
+        mix = [m for m in mix if m[0] in args.only]
+
+    # Каждому потоку - свое соединение без ожидания пула
+    DB_CONFIG["pool"]["max_size"] = max(DB_CONFIG["pool"]["max_size"], args.concurrency)
+    init_pool()
+    try:
+        params = Params()
+        report = run(mix, params, args.concurrency, args.duration, args.seed)
+    finally:
+        close_pool()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.max_regression)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import logging
+import sys
+
+from bench.generate import generate, scaled
+from config import LOGGING_CONFIG
+from utils import db
+from utils.db import DBManager, capture_plans, close_pool
+
+logging.basicConfig(
+    format=LOGGING_CONFIG["format"],
+    level=LOGGING_CONFIG["level"]
+)
+logger = logging.getLogger(__name__)
+
+# Таблицы, которые растут вместе с историей: полное сканирование недопустимо
+LARGE_TABLES = {"rentals", "payments", "reviews", "bikes", "users", "daily_station_stats"}
+
+# Хелперы, которые по смыслу читают всю таблицу и не проверяются
+EXCLUDED = {
+    "get_available_bikes()": "без фильтра по станции возвращает большую часть bikes",
+    "get_all_rentals": "SELECT * FROM rentals",
+    "get_station_stats": "агрегат по всей истории (заменен get_station_activity)",
+    "calculate_total_income": "сумма по всей истории",
+}
+
+# Синтетические пользователи check_indexes не пересекаются с пользователями bench.generate по умолчанию
+SEED_USER_BASE = 1_000_000_000
+
+def seed(rentals: int):
+    """Заполнение БД синтетическими данными тем же генератором, что и для нагрузочного теста"""
+    params = scaled(rentals)
+    logger.info(f"Seeding synthetic data: {params}")
+    generate(**params, days=730, user_base=SEED_USER_BASE)
+
+def sample_ids() -> dict:
+    """ID для параметров хелперов: самые "тяжелые" пользователь, велосипед и станция"""
+    with DBManager() as dbm:
+        return dbm.fetch_one("""
+            SELECT
+                (SELECT user_id FROM rentals GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1) AS user_id,
+                (SELECT bike_id FROM reviews GROUP BY bike_id ORDER BY COUNT(*) DESC LIMIT 1) AS bike_id,
+                (SELECT station_id FROM bikes WHERE status = 'available'
+                 GROUP BY station_id ORDER BY COUNT(*) DESC LIMIT 1) AS station_id
+        """)
+
+def helper_calls(ids: dict) -> list:
+    """Проверяемые хелперы utils.db с параметрами"""
+    return [
+        ("get_available_bikes(station)", lambda: db.get_available_bikes(ids['station_id'])),
+        ("get_available_bikes_page", lambda: db.get_available_bikes_page(after_id=ids['bike_id'])),
+        ("get_available_bikes_page(station)", lambda: db.get_available_bikes_page(ids['station_id'])),
+        ("get_available_bikes_page(type, before)",
+         lambda: db.get_available_bikes_page(type_id=1, before_id=ids['bike_id'])),
+        ("get_user_rentals", lambda: db.get_user_rentals(ids['user_id'])),
+        ("get_payments_by_user", lambda: db.get_payments_by_user(ids['user_id'])),
+        ("get_completed_payments", lambda: db.get_completed_payments(30)),
+        ("get_reviews_by_bike", lambda: db.get_reviews_by_bike(ids['bike_id'])),
+        ("get_average_rating", lambda: db.get_average_rating(ids['bike_id'])),
+        ("get_user_reviews", lambda: db.get_user_reviews(ids['user_id'])),
+        ("get_rentals_per_day", lambda: db.get_rentals_per_day(7)),
+        ("get_rentals_per_day(user)", lambda: db.get_rentals_per_day(7, ids['user_id'])),
+        ("get_rentals_per_day(by_station)", lambda: db.get_rentals_per_day(7, by_station=True)),
+        ("get_daily_income", lambda: db.get_daily_income(30)),
+        ("get_station_activity", lambda: db.get_station_activity(30)),
+        ("get_active_rentals", lambda: db.get_active_rentals()),
+        ("get_bike_info", lambda: db.get_bike_info(ids['bike_id'])),
+        ("user_exists", lambda: (db.invalidate_identity(ids['user_id']), db.user_exists(ids['user_id']))),
+    ]
+
+def seq_scans(plan: dict) -> list:
+    """Полные сканирования больших таблиц в плане"""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in LARGE_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+def main():
+    """Проверка: каждый читающий хелпер utils.db использует индексы"""
+    parser = argparse.ArgumentParser(description="Проверка планов запросов хелперов utils.db")
+    parser.add_argument("--seed", type=int, metavar="RENTALS",
+                        help="Сначала заполнить БД синтетическими данными (только для тестовой БД!)")
+    args = parser.parse_args()
+
+    try:
+        if args.seed:
+            seed(args.seed)
+
+        ids = sample_ids()
+        failed = 0
+        for name, call in helper_calls(ids):
+            with capture_plans() as plans:
+                call()
+            scans = sorted({table for p in plans for table in seq_scans(p["plan"]["Plan"])})
+            if scans:
+                failed += 1
+                print(f"FAIL  {name}: Seq Scan on {', '.join(scans)}")
+            else:
+                print(f"OK    {name}")
+
+        for name, reason in EXCLUDED.items():
+            print(f"SKIP  {name}: {reason}")
+    finally:
+        close_pool()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
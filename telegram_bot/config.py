@@ -19,7 +19,16 @@ DB_CONFIG = {
     "password": os.getenv("POSTGRES_PASSWORD", "secure_password"),
     "host": os.getenv("POSTGRES_HOST", "localhost"),
     "port": os.getenv("POSTGRES_PORT", 5432),
-    "client_encoding": "utf8"  # Кодировка подключения
+    "client_encoding": "utf8",  # Кодировка подключения
+    # Настройки пула соединений (не передаются в psycopg2.connect)
+    "pool": {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 1)),  # Соединений, открываемых при старте
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),  # Максимум одновременных соединений
+        "timeout": 10,  # Ожидание свободного соединения (в секундах)
+        "max_idle": 300,  # Закрывать соединения, простаивающие дольше (в секундах)
+        "max_lifetime": 3600,  # Переоткрывать соединения старше (в секундах)
+        "health_check_interval": 30  # Проверять SELECT 1 после простоя дольше (в секундах)
+    }
 }
 
 # Пути к SQL-скриптам
@@ -33,7 +42,12 @@ DML_SCRIPT = SQL_DIR / "dml.sql"
 TELEGRAM_CONFIG = {
     "token": os.getenv("TELEGRAM_BOT_TOKEN", ""),
     "admin_ids": list(map(int, os.getenv("ADMIN_IDS", "").split(","))) if os.getenv("ADMIN_IDS") else [],
-    "retry_delay": 5  # Задержка при ошибках подключения (в секундах)
+    "retry_delay": 5,  # Задержка при ошибках подключения (в секундах)
+    "reservation_ttl": 300,  # Удержание выбранного велосипеда до подтверждения (в секундах)
+    "page_size": 10,  # Велосипедов на странице списка
+    "nearest_stations": 5,  # Станций в ответ на геопозицию
+    "nearest_max_km": float(os.getenv("NEAREST_MAX_KM", 3)),  # Радиус поиска ближайших станций (в км)
+    "persistence_interval": 5  # Передача измененных user_data и состояний диалогов в БД (в секундах)
 }
 
 # ----------------------------
@@ -42,7 +56,12 @@ TELEGRAM_CONFIG = {
 PLOT_CONFIG = {
     "save_path": BASE_DIR / "bot" / "plots",  # Путь для сохранения графиков
     "default_style": "ggplot",  # Стиль графиков (ggplot, seaborn, classic)
-    "dpi": 150  # Качество изображений
+    "dpi": 150,  # Качество изображений
+    "workers": int(os.getenv("PLOT_WORKERS", 2)),  # Процессы для рендеринга графиков
+    "queue_size": 8,  # Задачи, ожидающие свободного процесса (сверх - отказ)
+    "job_timeout": 30,  # Максимальное время ожидания графика (в секундах)
+    "cache_ttl": 300,  # Время жизни готового графика в кэше (в секундах)
+    "cache_size": 64  # Максимум графиков в кэше
 }
 
 # ----------------------------
@@ -55,7 +74,59 @@ LOGGING_CONFIG = {
 }
 
 # ----------------------------
-# 6. Проверка обязательных переменных
+# 6. Настройки кэшей
+# ----------------------------
+CACHE_CONFIG = {
+    "catalog_ttl": 600,  # Перечитывать справочники станций и типов (в секундах)
+    "identity_ttl": 300,  # Время жизни записи "пользователь -> роль" (в секундах)
+    "identity_size": 10000  # Максимум пользователей в кэше ролей
+}
+
+# ----------------------------
+# 7. Настройки метрик
+# ----------------------------
+METRICS_CONFIG = {
+    "enabled": os.getenv("METRICS_ENABLED", "1") == "1",  # Эндпоинт /metrics и сводка в лог
+    "host": os.getenv("METRICS_HOST", "127.0.0.1"),  # Только локальный доступ по умолчанию
+    "port": int(os.getenv("METRICS_PORT", 9108)),
+    "summary_interval": 300,  # Периодичность сводки в лог (в секундах, 0 - отключить)
+    "slow_query_ms": int(os.getenv("SLOW_QUERY_MS", 200)),  # Порог медленного запроса (в мс)
+    "slow_query_sample": 0.2,  # Доля медленных запросов, для которых снимается EXPLAIN ANALYZE
+    "slow_query_log_size": 100  # Последних медленных запросов в памяти (команда /slow)
+}
+
+# ----------------------------
+# 8. Режим получения обновлений
+# ----------------------------
+WEBHOOK_CONFIG = {
+    "mode": os.getenv("BOT_MODE", "polling"),  # polling или webhook
+    "listen": os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),  # Адрес HTTP-сервера (TLS - на обратном прокси)
+    "port": int(os.getenv("WEBHOOK_PORT", 8443)),
+    "url_path": os.getenv("WEBHOOK_PATH", "telegram"),
+    "url": os.getenv("WEBHOOK_URL", ""),  # Публичный адрес, например https://bot.example.com
+    "secret_token": os.getenv("WEBHOOK_SECRET", ""),  # Заголовок X-Telegram-Bot-Api-Secret-Token (обязателен для webhook)
+    "max_connections": 40,  # Одновременных соединений от Telegram
+    "concurrent_updates": int(os.getenv("BOT_CONCURRENT_UPDATES", 64)),  # Чатов, обрабатываемых одновременно
+    "drain_timeout": 30  # Ожидание обработки принятых обновлений при остановке (в секундах)
+}
+
+# ----------------------------
+# 9. Настройки очереди исходящих сообщений
+# ----------------------------
+OUTBOX_CONFIG = {
+    "workers": 8,  # Сообщений, отправляемых одновременно
+    "queue_size": 1000,  # Сообщений в очереди (сверх - отбрасываются)
+    "global_rate": 25,  # Сообщений в секунду на бота (лимит Telegram - около 30)
+    "global_burst": 30,
+    "chat_rate": 1,  # Сообщений в секунду в один чат
+    "chat_burst": 3,
+    "max_retries": 3,  # Повторы при сетевых ошибках
+    "alert_window": 60,  # Повторные уведомления администраторам собираются в сводку за окно (в секундах)
+    "drain_timeout": 10  # Ожидание отправки очереди при остановке (в секундах)
+}
+
+# ----------------------------
+# 10. Проверка обязательных переменных
 # ----------------------------
 def validate_config():
     """Проверка корректности конфигурации"""
@@ -67,6 +138,18 @@ def validate_config():
     if not Path(PLOT_CONFIG["save_path"]).exists():
         os.makedirs(PLOT_CONFIG["save_path"], exist_ok=True)
         
+    if WEBHOOK_CONFIG["mode"] not in ("polling", "webhook"):
+        errors.append("BOT_MODE должен быть polling или webhook")
+    elif WEBHOOK_CONFIG["mode"] == "webhook":
+        if not WEBHOOK_CONFIG["url"]:
+            errors.append("WEBHOOK_URL не задан в .env")
+        # Без секрета любой, кто достучится до сервера, может прислать поддельное обновление
+        if not WEBHOOK_CONFIG["secret_token"]:
+            errors.append("WEBHOOK_SECRET не задан в .env")
+        
+    if WEBHOOK_CONFIG["concurrent_updates"] < 1:
+        errors.append("BOT_CONCURRENT_UPDATES должен быть положительным")
+        
     if errors:
         raise EnvironmentError("\n".join(errors))
 
@@ -1,9 +1,6 @@
-import io
 from logging.handlers import RotatingFileHandler
-import os
 import logging
 import tempfile
-import pandas as pd
 from datetime import datetime, timedelta
 
 from telegram import (
@@ -11,10 +8,14 @@ from telegram import (
     Update,
     ReplyKeyboardMarkup,
     KeyboardButton,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
     InputFile
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     filters,
@@ -24,33 +25,47 @@ from telegram.ext import (
 from config import (
     TELEGRAM_CONFIG,
     LOGGING_CONFIG,
-    PLOT_CONFIG
+    PLOT_CONFIG,
+    METRICS_CONFIG,
+    WEBHOOK_CONFIG
 )
-from utils.db import (
-    get_available_bikes,
-    get_user_rentals,
+from utils.db import init_pool, close_pool, seed_admins, StationFullError
+from utils.metrics import track_handler
+from utils import metrics
+from utils.slowlog import slow_query_log, format_plan
+from utils.async_db import (
+    shutdown_executor,
+    ensure_catalog,
+    get_available_bikes_page,
+    get_station_occupancy,
+    find_nearest_stations,
+    export_rentals_csv,
+    reserve_bike,
+    release_bike,
     start_rental,
     close_rental,
     get_payments_by_user,
     add_review,
     get_average_rating,
     check_user_role,
-    get_bike_info,
     cancel_rental,
     create_user_if_not_exists,
     user_exists,
     station_exists,
     add_bike,
     get_station_id,
-    get_all_stations,
-    get_bike_type_id,
-    get_bike_types
-)
-from utils.plots import (
-    generate_rentals_plot,
-    generate_income_plot,
-    generate_rating_distribution
+    get_bike_type_id
 )
+from utils.render import render_service, RenderBusyError
+from utils.catalog import catalog
+from utils.persistence import PostgresPersistence, ActiveRentals
+from utils.routing import Buttons
+from utils.outbox import outbox
+from utils import keyboards
+from utils.keyboards import catalog_keyboards
+from utils.identity import get_identity
+from utils.cache import MISSING
+from utils.updates import ChatOrderedUpdateProcessor
 
 # Настройка логирования
 logging.basicConfig(
@@ -68,7 +83,7 @@ file_handler = RotatingFileHandler(
 logger = logging.getLogger(__name__)
 logger.addHandler(file_handler)
 
-# Состояния для ConversationHandler
+# Состояния для ConversationHandler (все сценарии в одном диалоге - значения не пересекаются)
 
 (
     SELECT_BIKE,
@@ -76,57 +91,87 @@ logger.addHandler(file_handler)
     RENTAL_IN_PROGRESS,
     END_STATION_INPUT,
     REVIEW_RATING,
-    REVIEW_COMMENT
-) = range(6)
-
-(ADD_BIKE_TYPE, ADD_BIKE_STATION, ADD_BIKE_CONFIRM) = range(3)
+    REVIEW_COMMENT,
+    RATINGS_BIKE_ID,
+    ADD_BIKE_TYPE,
+    ADD_BIKE_STATION,
+    ADD_BIKE_CONFIRM
+) = range(10)
 
 class BikeRentalBot:
-    def __init__(self):
-        self.application = ApplicationBuilder().token(TELEGRAM_CONFIG["token"]).build()
+    def __init__(self, request=None):
+        """
+        :param request: транспорт Bot API (telegram.request.BaseRequest);
+                        None - HTTP-запросы к Telegram, иначе - например, заглушка для нагрузочных тестов
+        """
+        builder = (
+            ApplicationBuilder()
+            .token(TELEGRAM_CONFIG["token"])
+            .persistence(PostgresPersistence())
+            .concurrent_updates(ChatOrderedUpdateProcessor())
+            .post_init(self._post_init)
+            .post_stop(self._post_stop)
+            .post_shutdown(self._post_shutdown)
+        )
+        if request is not None:
+            builder = builder.request(request).get_updates_request(request)
+        self.application = builder.build()
         self.user_states = {}
-        self.user_rentals = {}  #############
+        # Открытые аренды по chat_id (восстанавливаются из БД при старте)
+        self.user_rentals = ActiveRentals()
+        # Кнопка меню -> обработчик (строится один раз)
+        self._menu_routes = {
+            "🚲 Арендовать велосипед": self.start_rental,
+            "📖 Мои аренды": self.show_user_rentals,
+            "📊 Статистика": self.show_stats_menu,
+            "➕ Добавить велосипед": self.start_add_bike,
+            "❓ Помощь": self.help,
+            "📈 Аренды": self.show_rentals_stats,
+            "💰 Доходы": self.show_income_stats,
+            "⭐ Рейтинги": self.show_ratings_stats,
+            "🔙 Назад": self.start,
+            "❌ Отменить аренду": self.cancel_rental
+        }
+        # Кнопки, начинающие сценарий (не прерывают уже начатый)
+        self._flow_buttons = frozenset({"🚲 Арендовать велосипед", "➕ Добавить велосипед", "⭐ Рейтинги"})
         self._register_handlers()
 
+    async def _post_init(self, application):
+        """Инициализация ресурсов при старте бота"""
+        init_pool()
+        seed_admins()
+        catalog.refresh()
+        await self.user_rentals.load()
+        render_service.start()
+        if METRICS_CONFIG["enabled"]:
+            metrics.start()
+        outbox.start(application.bot)
+
+    async def _post_stop(self, application):
+        """Отправка накопленных сообщений, пока бот еще может отправлять"""
+        await outbox.stop()
+
+    async def _post_shutdown(self, application):
+        """Освобождение ресурсов при остановке бота"""
+        metrics.stop()
+        slow_query_log.shutdown()
+        render_service.stop()
+        shutdown_executor()
+        close_pool()
+
     def _register_handlers(self):
         """Регистрация обработчиков с обновленными зависимостями"""
         
-        self.application.add_handler(self._rental_conversation_handler()) ####################################
-        self.application.add_handler(self._ratings_conversation_handler())
-        
-        self.application.add_handler(ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex(r"^➕ Добавить велосипед$"), self.start_add_bike)],
-        states={
-            ADD_BIKE_TYPE: [MessageHandler(filters.TEXT, self.process_bike_type)],
-            ADD_BIKE_STATION: [MessageHandler(filters.TEXT, self.process_bike_station)],
-            ADD_BIKE_CONFIRM: [MessageHandler(filters.Regex(r"^(✅ Подтвердить|❌ Отменить)$"), self.confirm_add_bike)]
-        },
-        fallbacks=[CommandHandler("cancel", lambda u,c: self.cancel_conversation(u,c, "Добавление велосипеда отменено"))]
-        ))
-            
+        self.application.add_handler(self._menu_conversation_handler())
+
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("help", self.help))
+        self.application.add_handler(CommandHandler("slow", self.show_slow_queries))
+        self.application.add_handler(CommandHandler("history", self.show_user_rentals))
+        self.application.add_handler(CommandHandler("export", self.export_rentals))
+        self.application.add_handler(CommandHandler("bikes", self.show_available_bikes))
+        self.application.add_handler(CallbackQueryHandler(self.page_bikes, pattern=r"^bikes:"))
         
-        # self.application.add_handler(MessageHandler(filters.TEXT, self.handle_message))
-        
-        # self.application.add_handler(MessageHandler(
-        #     filters.TEXT & ~filters.COMMAND, 
-        #     self.handle_bike_id_input
-        # ))
-        
-
-        
-        
-        self.application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND, 
-            self.handle_message
-        ))        
-        
-        self.application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND,
-            self.handle_bike_id_input
-        ))
-
         # self.application.add_handler(ConversationHandler(
         #     entry_points=[CommandHandler("review", self.start_review)],
         #     states={
@@ -154,33 +199,18 @@ class BikeRentalBot:
         self.application.add_error_handler(self.error_handler)
         
 
-    def _main_menu(self, user_id: int = None):
-        """Главное меню с reply-кнопками"""
-        buttons = [
-            [KeyboardButton("🚲 Арендовать велосипед")],
-            [KeyboardButton("📖 Мои аренды"), KeyboardButton("📊 Статистика")],
-            [KeyboardButton("❓ Помощь")]
-        ]
-        
-        # Добавляем кнопку администратора
-        if user_id and self._is_admin(user_id):
-            buttons.insert(1, [KeyboardButton("➕ Добавить велосипед")])
-        
-        return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
-
-    def _is_admin(self, user_id: int) -> bool:
-        """Проверяет, является ли пользователь администратором"""
-        return check_user_role(user_id, "admin")
-
-    def _rental_menu(self):
-        """Меню во время аренды"""
-        return ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton("🔙 Завершить аренду")],
-                [KeyboardButton("❌ Отменить аренду")]
-            ],
-            resize_keyboard=True
-        )
+    async def _main_menu(self, user_id: int = None):
+        """Главное меню с reply-кнопками (готовая клавиатура роли пользователя)"""
+        return keyboards.main_menu("admin" if user_id and await self._is_admin(user_id) else "client")
+
+    async def _is_admin(self, user_id: int) -> bool:
+        """Проверяет, является ли пользователь администратором (роль из кэша - без обращения к пулу потоков)"""
+        identity = get_identity(user_id)
+        if identity is not MISSING:
+            return identity[1] == "admin"
+        return await check_user_role(user_id, "admin")
+
+    @track_handler
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user = update.effective_user
@@ -191,117 +221,196 @@ class BikeRentalBot:
             "username": user.username
         }
         
-        create_user_if_not_exists(user_data)
+        await create_user_if_not_exists(user_data)
         
         await update.message.reply_text(
             f"Привет, {user.first_name}!",
-            reply_markup=self._main_menu(user.id)
+            reply_markup=await self._main_menu(user.id)
         )
 
+    @track_handler
     async def help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
         help_text = (
             "📚 Доступные команды:\n"
-            "🚲 Доступные велосипеды - показать свободные\n"
+            "/bikes [ID станции] - свободные велосипеды\n"
             "📖 Мои аренды - история аренд\n"
+            "/history [с] [по] - история аренд за период (ГГГГ-ММ-ДД)\n"
             "📊 Статистика - аналитика системы\n"
             "❓ Помощь - эта справка"
         )
         await update.message.reply_text(help_text)
 
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик текстовых сообщений"""
-        
-        if context.user_data.get('in_conversation'):
+    @track_handler
+    async def show_slow_queries(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Медленные запросы к БД: /slow - список, /slow <номер> - запрос и план (только для администраторов)"""
+        if not await self._is_admin(update.effective_user.id):
+            await update.message.reply_text("⛔ Доступ запрещен")
             return
-        
-        text = update.message.text
-        handlers = {
-            "🚲 Арендовать велосипед": self.start_rental,
-            "📖 Мои аренды": self.show_user_rentals,
-            "📊 Статистика": self.show_stats_menu,
-            "➕ Добавить велосипед": self.start_add_bike,
-            "🔙 Назад": self.start,
-            "❓ Помощь": self.help,            
-            
-            "📈 Аренды": self.show_rentals_stats,
-            "💰 Доходы": self.show_income_stats,
-            "⭐ Рейтинги": self.show_ratings_stats,                        
-            
-            "🔙 Назад": self.start,
-            "❌ Отменить аренду": self.cancel_rental
-        }
-        
-        if text in handlers:
-            await handlers[text](update, context)
-        else:
-            await update.message.reply_text(
-                "⚠️ Неизвестная команда",
-                reply_markup=self._main_menu()
+
+        if context.args:
+            entry = slow_query_log.get(int(context.args[0])) if context.args[0].isdigit() else None
+            if not entry:
+                await update.message.reply_text("❌ Запись не найдена")
+                return
+            plan = format_plan(entry['plan']) if entry['plan'] else "План не снят"
+            text = (
+                f"#{entry['id']} {entry['helper']}: {entry['duration_ms']:.0f} мс ({entry['at']:%d.%m %H:%M:%S})\n\n"
+                f"{' '.join(entry['query'].split())}\n"
+                f"Параметры: {entry['params']}\n\n"
+                f"{plan}"
             )
+            await update.message.reply_text(text[:4000])
+            return
+
+        entries = slow_query_log.entries()[:20]
+        if not entries:
+            await update.message.reply_text("✅ Медленных запросов нет")
+            return
+        lines = [f"🐢 Медленные запросы (от {slow_query_log.threshold * 1000:.0f} мс):"]
+        lines.extend(
+            f"#{e['id']} {e['at']:%H:%M:%S} {e['helper']} - {e['duration_ms']:.0f} мс{' 📋' if e['plan'] else ''}"
+            for e in entries
+        )
+        lines.append("\n📋 - есть план выполнения. Подробнее: /slow <номер>")
+        await update.message.reply_text("\n".join(lines))
+
+    @track_handler
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик текстовых сообщений вне сценариев: кнопка меню -> обработчик по таблице"""
+        handler = self._menu_routes.get(update.message.text)
+        if handler:
+            return await handler(update, context)
+        await update.message.reply_text(
+            "⚠️ Неизвестная команда",
+            reply_markup=await self._main_menu(update.effective_user.id)
+        )
 
+    @track_handler
+    async def handle_message_in_flow(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Текст, который текущий шаг сценария не ожидает: кнопки меню работают, но новый сценарий не начинается"""
+        if update.message.text in self._flow_buttons:
+            await update.message.reply_text("⚠️ Сначала завершите текущее действие или отправьте /cancel")
+            return None
+        return await self.handle_message(update, context)
+
+    @track_handler
     async def show_stats_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Меню статистики"""
-        reply_markup = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton("📈 Аренды"), KeyboardButton("💰 Доходы")],
-                [KeyboardButton("⭐ Рейтинги"), KeyboardButton("🔙 Назад")]
-            ],
-            resize_keyboard=True
-        )
         await update.message.reply_text(
             "Выберите тип статистики:",
-            reply_markup=reply_markup
+            reply_markup=keyboards.STATS_MENU
+        )
+
+    async def _bikes_page(self, page: dict, mode: str, station_id: int = None, type_id: int = None) -> tuple:
+        """
+        Текст и inline-навигация страницы доступных велосипедов
+        :param mode: "rent" - выбор велосипеда для аренды, "list" - просмотр (/bikes)
+        :return: (текст, InlineKeyboardMarkup или None, если страница одна)
+        """
+        await ensure_catalog()
+        station = catalog.station(station_id, refresh=False) if station_id else None
+        title = f"🚲 Доступные велосипеды на станции {station['name']}:" if station else "🚲 Доступные велосипеды:"
+        lines = [title]
+        lines.extend(
+            f"{b['bike_id']} - {b['type']} ({b['station']}), цена: {b['price_per_hour']} ₽/час"
+            for b in page['bikes']
         )
+        if mode == "rent":
+            lines.append("Введите ID велосипеда для аренды (📎 геопозиция - ближайшие станции):")
 
+        # Ключ страницы в callback_data: bikes:<режим>:<станция>:<тип>:<a|b>:<ID границы>
+        key = f"bikes:{mode}:{station_id or 0}:{type_id or 0}"
+        buttons = []
+        if page['has_prev']:
+            buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f"{key}:b:{page['bikes'][0]['bike_id']}"))
+        if page['has_next']:
+            buttons.append(InlineKeyboardButton("Далее ▶️", callback_data=f"{key}:a:{page['bikes'][-1]['bike_id']}"))
+        return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+    @track_handler
     async def show_available_bikes(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать доступные велосипеды"""
+        """Доступные велосипеды: /bikes [ID станции]"""
         try:
-            bikes = get_available_bikes()
-            if not bikes:
+            station_id = None
+            if context.args:
+                if not context.args[0].isdigit() or not await station_exists(int(context.args[0])):
+                    await update.message.reply_text("❌ Станция не найдена")
+                    return
+                station_id = int(context.args[0])
+
+            page = await get_available_bikes_page(station_id)
+            if not page['bikes']:
                 await update.message.reply_text("😞 Нет доступных велосипедов")
                 return
 
-            response = ["🚴 Доступные велосипеды:\n"]
-            for bike in bikes:
-                response.append(
-                    f"ID: {bike['bike_id']}\n"
-                    f"Тип: {bike['type']}\n"
-                    f"Станция: {bike['station']}\n"
-                    f"Цена: {bike['price_per_hour']} руб/час\n"
-                )
-
-            await update.message.reply_text("\n".join(response))
+            text, reply_markup = await self._bikes_page(page, "list", station_id)
+            await update.message.reply_text(text, reply_markup=reply_markup)
         except Exception as e:
             logger.error(f"Available bikes error: {e}")
             await update.message.reply_text("⚠️ Ошибка при получении данных")
 
+    @track_handler
+    async def page_bikes(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Переход по страницам списка велосипедов (inline-кнопки)"""
+        query = update.callback_query
+        error = None
+        try:
+            _, mode, station_id, type_id, direction, bike_id = query.data.split(":")
+            station_id, type_id, bike_id = int(station_id) or None, int(type_id) or None, int(bike_id)
+
+            page = await get_available_bikes_page(
+                station_id, type_id,
+                after_id=bike_id if direction == "a" else None,
+                before_id=bike_id if direction == "b" else None
+            )
+            if not page['bikes']:
+                # Список изменился (велосипеды разобрали) - показываем первую страницу
+                page = await get_available_bikes_page(station_id, type_id)
+            if not page['bikes']:
+                await query.edit_message_text("😞 Нет доступных велосипедов")
+            else:
+                text, reply_markup = await self._bikes_page(page, mode, station_id, type_id)
+                await query.edit_message_text(text, reply_markup=reply_markup)
+        except BadRequest as e:
+            # Сообщение не изменилось или уже недоступно для редактирования
+            logger.debug(f"Bikes page not updated: {e}")
+        except Exception as e:
+            logger.error(f"Bikes page error: {e}")
+            error = "⚠️ Ошибка при получении данных"
+
+        # На callback отвечают ровно один раз: с текстом ошибки или без текста
+        try:
+            await query.answer(error)
+        except BadRequest as e:
+            # Запрос устарел (кнопка нажата слишком давно)
+            logger.debug(f"Callback query not answered: {e}")
+
+    @track_handler
     async def start_add_bike(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начало процесса добавления велосипеда"""
-        if not self._is_admin(update.effective_user.id):
+        if not await self._is_admin(update.effective_user.id):
             await update.message.reply_text("⛔ Доступ запрещен")
             return ConversationHandler.END
         
-        # Получаем список типов велосипедов
-        bike_types = get_bike_types()  
-        if not bike_types:
+        # Клавиатура с типами велосипедов
+        await ensure_catalog()
+        reply_markup = catalog_keyboards.bike_types()
+        if not reply_markup:
             await update.message.reply_text("❌ Нет доступных типов велосипедов")
             return ConversationHandler.END
         
-        # Формируем клавиатуру с типами
-        keyboard = [[t['name']] for t in bike_types]
-        keyboard.append(["🔙 Отмена"])
-        
         await update.message.reply_text(
             "🚴 Выберите тип велосипеда:",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            reply_markup=reply_markup
         )
         return ADD_BIKE_TYPE
 
+    @track_handler
     async def process_bike_type(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка выбранного типа"""
         selected_type = update.message.text
-        type_id = get_bike_type_id(selected_type)  
+        type_id = await get_bike_type_id(selected_type)  
         
         if not type_id:
             await update.message.reply_text("❌ Неверный тип велосипеда")
@@ -309,21 +418,24 @@ class BikeRentalBot:
         
         context.user_data['new_bike'] = {'type_id': type_id}
         
-        # Получаем список станций
-        stations = get_all_stations()  
-        keyboard = [[s['name']] for s in stations]
-        keyboard.append(["🔙 Отмена"])
+        # Клавиатура со станциями
+        await ensure_catalog()
+        reply_markup = catalog_keyboards.stations()
+        if not reply_markup:
+            await update.message.reply_text("❌ Нет станций", reply_markup=await self._main_menu(update.effective_user.id))
+            return ConversationHandler.END
         
         await update.message.reply_text(
             "📍 Выберите станцию:",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            reply_markup=reply_markup
         )
         return ADD_BIKE_STATION
 
+    @track_handler
     async def process_bike_station(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка выбранной станции"""
         station_name = update.message.text
-        station_id = get_station_id(station_name)  
+        station_id = await get_station_id(station_name)  
         
         if not station_id:
             await update.message.reply_text("❌ Станция не найдена")
@@ -336,42 +448,43 @@ class BikeRentalBot:
             f"Создать велосипед?\n"
             f"Тип: {update.message.text}\n"
             f"Станция: {station_name}",
-            reply_markup=ReplyKeyboardMarkup([["✅ Подтвердить", "❌ Отменить"]], resize_keyboard=True)
+            reply_markup=keyboards.CONFIRM
         )
         return ADD_BIKE_CONFIRM
 
+    @track_handler
     async def confirm_add_bike(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Финальное подтверждение"""
         if update.message.text == "✅ Подтвердить":
             bike_data = context.user_data['new_bike']
-            if add_bike(**bike_data):  
-                await update.message.reply_text("✅ Велосипед успешно добавлен", reply_markup=self._main_menu())
+            if await add_bike(**bike_data):  
+                await update.message.reply_text("✅ Велосипед успешно добавлен", reply_markup=await self._main_menu(update.effective_user.id))
             else:
-                await update.message.reply_text("⚠️ Ошибка при добавлении", reply_markup=self._main_menu())
+                await update.message.reply_text("⚠️ Ошибка при добавлении", reply_markup=await self._main_menu(update.effective_user.id))
         else:
-            await update.message.reply_text("❌ Добавление отменено", reply_markup=self._main_menu())
+            await update.message.reply_text("❌ Добавление отменено", reply_markup=await self._main_menu(update.effective_user.id))
         
         context.user_data.clear()
         return ConversationHandler.END
 
+    @track_handler
+    async def cancel_add_bike(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отмена добавления велосипеда"""
+        context.user_data.pop('new_bike', None)
+        await update.message.reply_text("❌ Добавление велосипеда отменено", reply_markup=await self._main_menu(update.effective_user.id))
+        return ConversationHandler.END
+
+    @track_handler
     async def start_rental(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начало процесса аренды"""
         try:
-            bikes = get_available_bikes()
-            if not bikes:
+            page = await get_available_bikes_page()
+            if not page['bikes']:
                 await update.message.reply_text("😞 Нет доступных велосипедов")
                 return ConversationHandler.END
-                
-            bike_list = "\n".join(
-                f"{b['bike_id']} - {b['type']} ({b['station']}), цена: {b['price_per_hour']} ₽/час" 
-                for b in bikes
-            )
-            
-            await update.message.reply_text(
-                f"🚲 Доступные велосипеды:\n{bike_list}\n"
-                "Введите ID велосипеда для аренды:",
-                reply_markup=ReplyKeyboardRemove()
-            )
+
+            text, reply_markup = await self._bikes_page(page, "rent")
+            await update.message.reply_text(text, reply_markup=reply_markup or ReplyKeyboardRemove())
             return SELECT_BIKE
             
         except Exception as e:
@@ -379,13 +492,15 @@ class BikeRentalBot:
             await update.message.reply_text("⚠️ Ошибка при получении данных")
             return ConversationHandler.END
 
+    @track_handler
     async def select_bike(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Выбор велосипеда"""
         try:
             bike_id = int(update.message.text)
-            bike = get_bike_info(bike_id) 
+            # Велосипед удерживается за пользователем до подтверждения аренды
+            bike = await reserve_bike(bike_id, update.effective_user.id)
             
-            if not bike or bike['status'] != 'available':
+            if not bike:
                 await update.message.reply_text("❌ Этот велосипед недоступен")
                 return ConversationHandler.END
                 
@@ -394,17 +509,12 @@ class BikeRentalBot:
                 'start_station': bike['station_id']
             }
             
-            reply_markup = ReplyKeyboardMarkup(
-                [[KeyboardButton("✅ Подтвердить"), KeyboardButton("❌ Отменить")]],
-                resize_keyboard=True
-            )
-            
             await update.message.reply_text(
                 f"Вы выбрали велосипед {bike_id}\n"
                 f"Тип: {bike['type']}\n"
                 f"Станция: {bike['station']}\n\n"
                 "Подтвердите аренду:",
-                reply_markup=reply_markup
+                reply_markup=keyboards.CONFIRM
             )
             return CONFIRM_RENTAL
             
@@ -417,6 +527,7 @@ class BikeRentalBot:
             return SELECT_BIKE
 
         
+    @track_handler
     async def confirm_rental(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Подтверждение аренды"""
         if update.message.text == "✅ Подтвердить":
@@ -424,21 +535,27 @@ class BikeRentalBot:
                 user_id = update.effective_user.id
                 rental_data = context.user_data['rental']
                 
-                if not user_exists(user_id):
-                    create_user_if_not_exists({
+                if not await user_exists(user_id):
+                    await create_user_if_not_exists({
                         "id": user_id,
                         "full_name": update.effective_user.full_name,
                         "username": update.effective_user.username
                     })
                 
-                rental_id = start_rental(
+                rental_id = await start_rental(
                     user_id=user_id,
                     bike_id=rental_data['bike_id'],
                     station_id=rental_data['start_station']
                 )
+                if not rental_id:
+                    await update.message.reply_text(
+                        "❌ Велосипед уже арендован другим пользователем",
+                        reply_markup=await self._main_menu(user_id)
+                    )
+                    return ConversationHandler.END
                 
-                self.user_rentals[update.message.chat_id] = rental_id
-                await update.message.reply_text("🚴 Аренда начата!", reply_markup=self._rental_menu())
+                self.user_rentals.set(update.message.chat_id, rental_id)
+                await update.message.reply_text("🚴 Аренда начата!", reply_markup=keyboards.RENTAL_MENU)
                 return RENTAL_IN_PROGRESS
                 
             except Exception as e:
@@ -446,75 +563,148 @@ class BikeRentalBot:
                 await update.message.reply_text("⚠️ Ошибка при старте аренды")
                 return ConversationHandler.END
         else:
+            await release_bike(context.user_data['rental']['bike_id'], update.effective_user.id)
             await update.message.reply_text("❌ Аренда отменена")
             return ConversationHandler.END
 
-    def _rental_conversation_handler(self):
+    def _menu_conversation_handler(self):
+        """
+        Все сценарии (аренда, рейтинги, добавление велосипеда) в одном диалоге:
+        единственная точка входа handle_message перед состояниями сценариев
+        """
+        text = filters.TEXT & ~filters.COMMAND
+        confirm = Buttons("✅ Подтвердить", "❌ Отменить")
+        cancel_rental = [CommandHandler("cancel", self.cancel_rental)]
+        cancel_ratings = [
+            CommandHandler("cancel", self.cancel_ratings),
+            MessageHandler(Buttons("🔙 Отмена"), self.cancel_ratings)
+        ]
+        cancel_add_bike = [
+            CommandHandler("cancel", self.cancel_add_bike),
+            MessageHandler(Buttons("🔙 Отмена"), self.cancel_add_bike)
+        ]
         return ConversationHandler(
-            entry_points=[MessageHandler(filters.Regex("^🚲 Арендовать велосипед$"), self.start_rental)],
+            name="menu",
+            persistent=True,
+            entry_points=[MessageHandler(text, self.handle_message)],
             states={
-                SELECT_BIKE: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.select_bike)
+                # Аренда
+                SELECT_BIKE: cancel_rental + [
+                    MessageHandler(text, self.select_bike),
+                    MessageHandler(filters.LOCATION, self.show_nearest_bike_stations)
+                ],
+                CONFIRM_RENTAL: cancel_rental + [
+                    MessageHandler(confirm, self.confirm_rental)
+                ],
+                RENTAL_IN_PROGRESS: cancel_rental + [
+                    MessageHandler(Buttons("🔙 Завершить аренду", "❌ Отменить аренду"), self.rental_actions)
                 ],
-                CONFIRM_RENTAL: [
-                    MessageHandler(filters.Regex("^(✅ Подтвердить|❌ Отменить)$"), self.confirm_rental)
+                END_STATION_INPUT: cancel_rental + [
+                    MessageHandler(text, self.process_end_station),
+                    MessageHandler(filters.LOCATION, self.show_nearest_return_stations)
                 ],
-                RENTAL_IN_PROGRESS: [
-                    MessageHandler(filters.Regex("^(🔙 Завершить аренду|❌ Отменить аренду)$"), self.rental_actions)
+                REVIEW_RATING: cancel_rental + [
+                    MessageHandler(text, self.process_review_rating)
                 ],
-                END_STATION_INPUT: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_end_station)
+                REVIEW_COMMENT: cancel_rental + [
+                    MessageHandler(text, self.process_review_comment)
                 ],
-                REVIEW_RATING: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_review_rating)
+                # Рейтинги велосипеда
+                RATINGS_BIKE_ID: cancel_ratings + [
+                    MessageHandler(text, self.handle_bike_id_input)
                 ],
-                REVIEW_COMMENT: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.process_review_comment)
-                ]
+                # Добавление велосипеда
+                ADD_BIKE_TYPE: cancel_add_bike + [MessageHandler(text, self.process_bike_type)],
+                ADD_BIKE_STATION: cancel_add_bike + [MessageHandler(text, self.process_bike_station)],
+                ADD_BIKE_CONFIRM: cancel_add_bike + [MessageHandler(confirm, self.confirm_add_bike)]
             },
-            fallbacks=[CommandHandler("cancel", self.cancel_rental)],
-            map_to_parent={ConversationHandler.END: None}
+            fallbacks=[MessageHandler(text, self.handle_message_in_flow)]
         )
 
-    def _ratings_conversation_handler(self):
-        return ConversationHandler(
-            entry_points=[
-                MessageHandler(filters.Regex("^⭐ Рейтинги$"), self.show_ratings_stats)
-            ],
-            states={
-                REVIEW_RATING: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_bike_id_input)
-                ]
-            },
-            fallbacks=[
-                CommandHandler("cancel", self.cancel_ratings)
-            ],
-            map_to_parent={ConversationHandler.END: None}
-        )
+    @track_handler
     async def rental_actions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Действия во время аренды"""
         if update.message.text == "🔙 Завершить аренду":
             await update.message.reply_text(
-                "Введите ID станции возврата:",
-                reply_markup=ReplyKeyboardRemove()
+                "Введите ID станции возврата или отправьте геопозицию:",
+                reply_markup=keyboards.SEND_LOCATION
             )
             return END_STATION_INPUT
         else:
             await update.message.reply_text(
                 "🚴 Аренда активна. Используйте меню ниже:",
-                reply_markup=self._rental_menu()
+                reply_markup=keyboards.RENTAL_MENU
             )
             return RENTAL_IN_PROGRESS
         
+    @staticmethod
+    def _format_distance(distance_km: float) -> str:
+        """Расстояние для пользователя: метры до километра, дальше - километры"""
+        return f"{distance_km * 1000:.0f} м" if distance_km < 1 else f"{distance_km:.1f} км"
+
+    @track_handler
+    async def show_nearest_bike_stations(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ближайшие станции со свободными велосипедами по геопозиции пользователя"""
+        location = update.message.location
+        stations = await find_nearest_stations(location.latitude, location.longitude, with_bikes=True)
+        if not stations:
+            await update.message.reply_text("😞 Рядом нет станций со свободными велосипедами")
+            return SELECT_BIKE
+
+        lines = ["📍 Ближайшие станции со свободными велосипедами:"]
+        lines.extend(
+            f"{s['name']} - {self._format_distance(s['distance_km'])}, велосипедов: {s['available']}"
+            for s in stations
+        )
+        lines.append("Выберите станцию или введите ID велосипеда:")
+        # Кнопка станции открывает первую страницу ее велосипедов (см. page_bikes)
+        buttons = [
+            [InlineKeyboardButton(f"🚲 {s['name']}", callback_data=f"bikes:rent:{s['station_id']}:0:a:0")]
+            for s in stations
+        ]
+        await update.message.reply_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(buttons))
+        return SELECT_BIKE
+
+    @track_handler
+    async def show_nearest_return_stations(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ближайшие станции со свободными местами для возврата по геопозиции пользователя"""
+        location = update.message.location
+        stations = await find_nearest_stations(location.latitude, location.longitude, with_docks=True)
+        if not stations:
+            await update.message.reply_text("😞 Рядом нет станций со свободными местами. Введите ID станции:")
+            return END_STATION_INPUT
+
+        lines = ["📍 Ближайшие станции со свободными местами:"]
+        lines.extend(
+            f"{s['station_id']} - {s['name']}: {self._format_distance(s['distance_km'])}, мест: {s['free_docks']}"
+            for s in stations
+        )
+        lines.append("Выберите станцию возврата:")
+        await update.message.reply_text(
+            "\n".join(lines),
+            reply_markup=ReplyKeyboardMarkup(
+                [[KeyboardButton(str(s['station_id']))] for s in stations],
+                resize_keyboard=True
+            )
+        )
+        return END_STATION_INPUT
+
+    @track_handler
     async def process_end_station(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка ID станции возврата"""
         try:
             end_station_id = int(update.message.text)
             
             # Проверка существования станции
-            if not station_exists(end_station_id):
+            if not await station_exists(end_station_id):
                 await update.message.reply_text("❌ Станция не найдена")
                 return END_STATION_INPUT
+
+            # Свободные места - по счетчикам заполненности (окончательная проверка - в close_rental)
+            occupancy = (await get_station_occupancy([end_station_id])).get(end_station_id)
+            if occupancy and occupancy['free_docks'] == 0:
+                await update.message.reply_text("❌ На станции нет свободных мест, выберите другую станцию")
+                return END_STATION_INPUT
             
             # Сохраняем station_id в контекст
             context.user_data['end_station'] = end_station_id
@@ -522,7 +712,7 @@ class BikeRentalBot:
             # Запрашиваем оценку
             await update.message.reply_text(
                 "⭐ Оцените аренду (1-5):",
-                reply_markup=ReplyKeyboardMarkup([[str(i) for i in range(1, 6)]], resize_keyboard=True)
+                reply_markup=keyboards.RATING
             )
             return REVIEW_RATING
             
@@ -530,126 +720,151 @@ class BikeRentalBot:
             await update.message.reply_text("❌ Введите числовой ID станции")
             return END_STATION_INPUT
 
+    @staticmethod
+    def _parse_period(args) -> tuple:
+        """Период выгрузки из аргументов команды: [с YYYY-MM-DD] [по YYYY-MM-DD]"""
+        dates = [datetime.strptime(arg, "%Y-%m-%d").date() for arg in (args or [])[:2]]
+        if len(dates) == 2 and dates[0] > dates[1]:
+            raise ValueError("Начало периода позже конца")
+        return (dates + [None, None])[:2]
+
+    @track_handler
     async def show_user_rentals(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать аренды пользователя"""
+        """История аренд пользователя в CSV (/history [с] [по] - за период)"""
         try:
-            user_id = update.effective_user.id
-            rentals = get_user_rentals(user_id)
-            
-            if not rentals:
-                await update.message.reply_text("📭 У вас нет активных аренд")
-                return
-            
-            df = pd.DataFrame(rentals)
-            
-            datetime_columns = ['start_time', 'end_time']
-            for col in datetime_columns:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col]).dt.strftime('%Y-%m-%d %H:%M')
-            
-           
-            columns_order = [
-                'rental_id', 
-                'start_time', 
-                'end_time', 
-                'start_station', 
-                'end_station', 
-                'bike_id', 
-                'bike_type'
-            ]
-            df = df[columns_order]
-
-            # Создаем CSV в памяти
-            csv_buffer = io.StringIO()
-            df.to_csv(csv_buffer, index=False)
-            csv_buffer.seek(0)
-
-            # Отправляем файл
-            await update.message.reply_document(
-                document=InputFile(
-                    io.BytesIO(csv_buffer.getvalue().encode()),
-                    filename="my_rentals.csv"
-                ),
-                caption="📊 История ваших аренд"
-            )
+            date_from, date_to = self._parse_period(context.args)
+        except ValueError:
+            await update.message.reply_text("❌ Формат: /history [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД]")
+            return
+
+        try:
+            export, rows = await export_rentals_csv(update.effective_user.id, date_from, date_to)
+            with export:
+                if not rows:
+                    await update.message.reply_text("📭 У вас нет аренд за этот период")
+                    return
+                await update.message.reply_document(
+                    document=InputFile(export, filename="my_rentals.csv"),
+                    caption=f"📊 История ваших аренд ({rows})"
+                )
 
         except Exception as e:
             logger.error(f"User rentals CSV error: {e}")
             await update.message.reply_text("⚠️ Ошибка при формировании отчета")
 
+    @track_handler
+    async def export_rentals(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузка аренд всего парка в CSV.gz: /export [с] [по] (только для администраторов)"""
+        if not await self._is_admin(update.effective_user.id):
+            await update.message.reply_text("⛔ Доступ запрещен")
+            return
+        try:
+            date_from, date_to = self._parse_period(context.args)
+        except ValueError:
+            await update.message.reply_text("❌ Формат: /export [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД]")
+            return
+
+        try:
+            export, rows = await export_rentals_csv(date_from=date_from, date_to=date_to, compress=True)
+            with export:
+                if not rows:
+                    await update.message.reply_text("📭 Нет аренд за этот период")
+                    return
+                period = f"{date_from or 'start'}_{date_to or datetime.now().date()}"
+                await update.message.reply_document(
+                    document=InputFile(export, filename=f"rentals_{period}.csv.gz"),
+                    caption=f"📦 Аренды всего парка: {rows}"
+                )
+
+        except Exception as e:
+            logger.error(f"Rentals export error: {e}")
+            await update.message.reply_text("⚠️ Ошибка при формировании выгрузки")
+
+    @track_handler
     async def show_rentals_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """График аренд за последнюю неделю"""
         try:
-            plot_path = generate_rentals_plot()
-            if plot_path and os.path.exists(plot_path):
+            plot = await render_service.render("rentals", days=7)
+            if plot:
                 await update.message.reply_photo(
-                    photo=open(plot_path, 'rb'),
+                    photo=plot,
                     caption="📈 Аренды за последние 7 дней"
                 )
             else:
                 await update.message.reply_text("📭 Нет данных об арендах за этот период")
+        except RenderBusyError:
+            await update.message.reply_text("⏳ Сервер перегружен, попробуйте позже")
         except Exception as e:
             logger.error(f"Rentals stats error: {e}")
             await update.message.reply_text("⚠️ Ошибка при генерации графика")
 
+    @track_handler
     async def show_income_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """График доходов за последний месяц"""
         try:
-            plot_path = generate_income_plot()
-            if plot_path and os.path.exists(plot_path):
+            plot = await render_service.render("income", days=30)
+            if plot:
                 await update.message.reply_photo(
-                    photo=open(plot_path, 'rb'),
+                    photo=plot,
                     caption="💰 Доходы за последние 30 дней"
                 )
             else:
                 await update.message.reply_text("📭 Нет данных о доходах за этот период")
+        except RenderBusyError:
+            await update.message.reply_text("⏳ Сервер перегружен, попробуйте позже")
         except Exception as e:
             logger.error(f"Income stats error: {e}")
             await update.message.reply_text("⚠️ Ошибка при генерации графика")
 
+    @track_handler
     async def show_ratings_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начало процесса запроса рейтингов"""
         try:
             await update.message.reply_text(
                 "🚴 Введите ID велосипеда:",
-                reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Отмена")]], resize_keyboard=True)
+                reply_markup=keyboards.CANCEL
             )
-            return REVIEW_RATING
+            return RATINGS_BIKE_ID
         except Exception as e:
             logger.error(f"Ratings start error: {e}")
             return ConversationHandler.END
         
         
+    @track_handler
     async def handle_bike_id_input(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка введенного ID"""
         try:
             bike_id = int(update.message.text)
-            plot_path = generate_rating_distribution(bike_id)
+            plot = await render_service.render("ratings", bike_id=bike_id)
             
-            if plot_path:
+            if plot:
                 await update.message.reply_photo(
-                    photo=open(plot_path, 'rb'),
+                    photo=plot,
                     caption=f"⭐ Рейтинги велосипеда {bike_id}",
-                    reply_markup=self._main_menu()
+                    reply_markup=await self._main_menu(update.effective_user.id)
                 )
             else:
                 await update.message.reply_text(
                     "🚴 Нет данных для этого велосипеда",
-                    reply_markup=self._main_menu()
+                    reply_markup=await self._main_menu(update.effective_user.id)
                 )
             return ConversationHandler.END
 
         except ValueError:
             await update.message.reply_text("❌ Введите число!")
-            return REVIEW_RATING
+            return RATINGS_BIKE_ID
+        except RenderBusyError:
+            await update.message.reply_text("⏳ Сервер перегружен, попробуйте позже")
+            return RATINGS_BIKE_ID
         except Exception as e:
             logger.error(f"Ratings error: {e}")
             return ConversationHandler.END
 
 
+    @track_handler
     async def cancel_ratings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Отмена запроса рейтингов"""
-        await update.message.reply_text("❌ Запрос отменен", reply_markup=self._main_menu())
+        await update.message.reply_text("❌ Запрос отменен", reply_markup=await self._main_menu(update.effective_user.id))
         return ConversationHandler.END
     # async def start_review(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
     #     """Начало процесса добавления отзыва"""
@@ -704,6 +919,7 @@ class BikeRentalBot:
     #         await update.message.reply_text("❌ Неверный формат оценки")
     #         return COMMENT
 
+    @track_handler
     async def process_review_rating(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка оценки аренды"""
         try:
@@ -716,7 +932,7 @@ class BikeRentalBot:
             
             await update.message.reply_text(
                 "💬 Напишите комментарий (или нажмите 'Пропустить'):",
-                reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🚫 Пропустить")]], resize_keyboard=True)
+                reply_markup=keyboards.SKIP
             )
             return REVIEW_COMMENT
             
@@ -759,34 +975,46 @@ class BikeRentalBot:
     #         return REVIEW_COMMENT
     
     
+    @track_handler
     async def process_review_comment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             # Получаем данные из контекста
             end_station_id = context.user_data.get('end_station')
-            rental_id = self.user_rentals.get(update.message.chat_id)
+            rental_id = await self.user_rentals.get(update.message.chat_id)
             rating = context.user_data.get('rating')
             
             if not end_station_id or not rental_id:
                 raise ValueError("Недостаточно данных для завершения аренды")
             
-            # Завершаем аренду
-            if not close_rental(rental_id, end_station_id):
+            # Завершаем аренду (с оплатой)
+            try:
+                closed = await close_rental(rental_id, end_station_id)
+            except StationFullError:
+                # Места на станции заняли, пока пользователь ставил оценку: станция выбирается заново
+                context.user_data.pop('end_station', None)
+                await update.message.reply_text(
+                    "❌ На станции закончились свободные места. Введите ID другой станции возврата:",
+                    reply_markup=keyboards.SEND_LOCATION
+                )
+                return END_STATION_INPUT
+            if not closed:
                 raise RuntimeError("Ошибка при закрытии аренды")
+            cost_text = f"Стоимость: {closed['cost']} ₽"
             
             # Сохраняем отзыв, если есть оценка
             if rating:
-                add_review(
+                await add_review(
                     user_id=update.effective_user.id,
                     bike_id=context.user_data['rental']['bike_id'],
                     rating=rating,
                     comment=update.message.text if update.message.text != "🚫 Пропустить" else None
                 )
-                await update.message.reply_text("⭐ Спасибо за отзыв!", reply_markup=self._main_menu())
+                await update.message.reply_text(f"⭐ Спасибо за отзыв!\n{cost_text}", reply_markup=await self._main_menu(update.effective_user.id))
             else:
-                await update.message.reply_text("✅ Аренда завершена", reply_markup=self._main_menu())
+                await update.message.reply_text(f"✅ Аренда завершена\n{cost_text}", reply_markup=await self._main_menu(update.effective_user.id))
             
             # Очистка данных
-            del self.user_rentals[update.message.chat_id]
+            self.user_rentals.pop(update.message.chat_id)
             context.user_data.clear()
             
             return ConversationHandler.END
@@ -796,25 +1024,32 @@ class BikeRentalBot:
             await update.message.reply_text("⚠️ Критическая ошибка")
             return ConversationHandler.END
 
+    @track_handler
     async def cancel_rental(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Отмена аренды"""
-        if update.message.chat_id in self.user_rentals:
-            cancel_rental(self.user_rentals[update.message.chat_id])  # Новая функция в utils.db
-            del self.user_rentals[update.message.chat_id]
+        rental_id = await self.user_rentals.get(update.message.chat_id)
+        if rental_id:
+            await cancel_rental(rental_id)  # Новая функция в utils.db
+            self.user_rentals.pop(update.message.chat_id)
+        elif 'rental' in context.user_data:
+            # Аренда еще не начата: снимаем удержание велосипеда
+            await release_bike(context.user_data['rental']['bike_id'], update.effective_user.id)
             
         await update.message.reply_text(
             "❌ Аренда отменена",
-            reply_markup=self._main_menu()
+            reply_markup=await self._main_menu(update.effective_user.id)
         )
         return ConversationHandler.END
 
+    @track_handler
     async def cancel_review(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Отмена оставления отзыва"""
         await update.message.reply_text(
             "❌ Отмена оставления отзыва",
-            reply_markup=self._main_menu()
+            reply_markup=await self._main_menu(update.effective_user.id)
         )
         return ConversationHandler.END
+    @track_handler
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Глобальный обработчик ошибок"""
         logger.error(msg="Exception while handling update:", exc_info=context.error)
@@ -824,18 +1059,28 @@ class BikeRentalBot:
             "Администратор уже уведомлен и работает над решением проблемы."
         )
         
-        if update.message:
-            await update.message.reply_text(error_text)
+        # Через очередь исходящих сообщений: при всплеске ошибок обработчик не ждет отправки
+        if isinstance(update, Update) and update.effective_chat:
+            outbox.send(update.effective_chat.id, error_text)
         
-        for admin_id in TELEGRAM_CONFIG["admin_ids"]:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"🚨 Ошибка в боте:\n{context.error}"
-            )
+        outbox.alert(f"{type(context.error).__name__}: {context.error}")
 
     def run(self):
-        """Запуск бота"""
-        self.application.run_polling()
+        """Запуск бота: long polling или HTTP-сервер для webhook (WEBHOOK_CONFIG["mode"])"""
+        if WEBHOOK_CONFIG["mode"] != "webhook":
+            self.application.run_polling()
+            return
+        url_path = WEBHOOK_CONFIG["url_path"].strip("/")
+        # Остановка: прием обновлений прекращается, принятые дообрабатываются (drain_timeout)
+        self.application.run_webhook(
+            listen=WEBHOOK_CONFIG["listen"],
+            port=WEBHOOK_CONFIG["port"],
+            url_path=url_path,
+            webhook_url=f"{WEBHOOK_CONFIG['url'].rstrip('/')}/{url_path}",
+            secret_token=WEBHOOK_CONFIG["secret_token"],
+            max_connections=WEBHOOK_CONFIG["max_connections"],
+            allowed_updates=Update.ALL_TYPES
+        )
 
 if __name__ == "__main__":
     bot = BikeRentalBot()
@@ -0,0 +1,71 @@
+"""
+Проверка пространственного индекса станций перебором.
+
+Запуск (из каталога telegram_bot, БД не нужна):
+    python -m pytest tests
+"""
+import os
+import random
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test")
+
+from config import LOGGING_CONFIG
+
+# Модули utils пишут лог в файл при импорте
+Path(LOGGING_CONFIG["file"]).parent.mkdir(parents=True, exist_ok=True)
+
+from utils.geo import StationIndex, distance_km
+
+CENTER = (55.751244, 37.618423)
+
+
+def make_stations(rng: random.Random, count: int) -> list:
+    """Станции вокруг центра города (часть - без координат)"""
+    stations = []
+    for station_id in range(1, count + 1):
+        if rng.random() < 0.02:
+            stations.append({"station_id": station_id, "latitude": None, "longitude": None})
+            continue
+        stations.append({
+            "station_id": station_id,
+            "latitude": CENTER[0] + rng.gauss(0, 0.1),
+            "longitude": CENTER[1] + rng.gauss(0, 0.18),
+        })
+    return stations
+
+def brute_force(stations: list, lat: float, lon: float, k: int, max_km: float = None) -> list:
+    """K ближайших станций полным перебором"""
+    found = [
+        (distance_km(lat, lon, s["latitude"], s["longitude"]), s)
+        for s in stations if s["latitude"] is not None
+    ]
+    if max_km is not None:
+        found = [item for item in found if item[0] <= max_km]
+    found.sort(key=lambda item: item[0])
+    return found[:k]
+
+
+@pytest.mark.parametrize("max_km", [None, 0.5, 3])
+def test_nearest_matches_brute_force(max_km):
+    rng = random.Random(42)
+    stations = make_stations(rng, 2000)
+    index = StationIndex()
+    index.build(stations)
+
+    for _ in range(200):
+        # Точки и внутри города, и далеко за его пределами
+        lat = CENTER[0] + rng.uniform(-0.6, 0.6)
+        lon = CENTER[1] + rng.uniform(-1.0, 1.0)
+        k = rng.randint(1, 20)
+        expected = brute_force(stations, lat, lon, k, max_km)
+        actual = index.nearest(lat, lon, k, max_km)
+        assert [d for d, _ in actual] == pytest.approx([d for d, _ in expected])
+        assert {s["station_id"] for _, s in actual} == {s["station_id"] for _, s in expected}
+
+def test_nearest_empty_index():
+    index = StationIndex()
+    index.build([])
+    assert index.nearest(*CENTER, k=5) == []
@@ -0,0 +1,108 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_CONFIG
+from . import db
+from . import catalog
+
+logger = logging.getLogger(__name__)
+
+# Синхронные запросы выполняются в ограниченном пуле потоков, чтобы не блокировать
+# event loop. Размер пула потоков равен размеру пула соединений: каждый поток
+# получает соединение без ожидания, лишние запросы ждут в очереди executor'а.
+_executor = None
+
+def get_executor() -> ThreadPoolExecutor:
+    """Пул потоков для запросов к БД (создается при первом обращении)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=DB_CONFIG["pool"]["max_size"],
+            thread_name_prefix="db"
+        )
+        logger.info("DB executor started")
+    return _executor
+
+def shutdown_executor():
+    """Остановка пула потоков с ожиданием выполняющихся запросов"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+        logger.info("DB executor stopped")
+
+def run_sync(func, *args, **kwargs):
+    """Выполнение синхронной функции в пуле потоков БД"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+def _to_async(func):
+    """Асинхронный двойник синхронного хелпера из utils.db"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_sync(func, *args, **kwargs)
+    return wrapper
+
+
+### Велосипеды и аренды ###
+get_available_bikes = _to_async(db.get_available_bikes)
+get_available_bikes_page = _to_async(db.get_available_bikes_page)
+get_bike_info = _to_async(db.get_bike_info)
+add_bike = _to_async(db.add_bike)
+reserve_bike = _to_async(db.reserve_bike)
+release_bike = _to_async(db.release_bike)
+start_rental = _to_async(db.start_rental)
+close_rental = _to_async(db.close_rental)
+cancel_rental = _to_async(db.cancel_rental)
+get_user_rentals = _to_async(db.get_user_rentals)
+get_all_rentals = _to_async(db.get_all_rentals)
+get_active_rentals = _to_async(db.get_active_rentals)
+get_open_rental = _to_async(db.get_open_rental)
+get_rentals_per_day = _to_async(db.get_rentals_per_day)
+export_rentals_csv = _to_async(db.export_rentals_csv)
+
+### Платежи ###
+create_payment = _to_async(db.create_payment)
+get_payments_by_user = _to_async(db.get_payments_by_user)
+update_payment_status = _to_async(db.update_payment_status)
+calculate_total_income = _to_async(db.calculate_total_income)
+get_completed_payments = _to_async(db.get_completed_payments)
+
+### Агрегаты ###
+get_daily_income = _to_async(db.get_daily_income)
+get_station_activity = _to_async(db.get_station_activity)
+backfill_daily_stats = _to_async(db.backfill_daily_stats)
+
+### Отзывы ###
+add_review = _to_async(db.add_review)
+get_reviews_by_bike = _to_async(db.get_reviews_by_bike)
+get_average_rating = _to_async(db.get_average_rating)
+get_user_reviews = _to_async(db.get_user_reviews)
+delete_review = _to_async(db.delete_review)
+
+### Станции и справочники ###
+get_station_stats = _to_async(db.get_station_stats)
+get_station_occupancy = _to_async(db.get_station_occupancy)
+find_nearest_stations = _to_async(db.find_nearest_stations)
+async def ensure_catalog():
+    """Актуальные справочники в памяти: устаревшие перечитываются в пуле потоков, а не в event loop"""
+    if catalog.catalog.is_stale():
+        await run_sync(catalog.catalog.ensure_loaded)
+
+station_exists = _to_async(catalog.station_exists)
+get_all_stations = _to_async(catalog.get_all_stations)
+get_station_id = _to_async(catalog.get_station_id)
+get_bike_types = _to_async(catalog.get_bike_types)
+get_bike_type_id = _to_async(catalog.get_bike_type_id)
+
+### Состояние бота ###
+load_bot_state = _to_async(db.load_bot_state)
+save_bot_state = _to_async(db.save_bot_state)
+delete_bot_state = _to_async(db.delete_bot_state)
+
+### Пользователи ###
+create_user_if_not_exists = _to_async(db.create_user_if_not_exists)
+user_exists = _to_async(db.user_exists)
+check_user_role = _to_async(db.check_user_role)
+set_user_role = _to_async(db.set_user_role)
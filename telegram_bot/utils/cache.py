@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Маркер отсутствия значения (None может быть закэшированным результатом)
+MISSING = object()
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Поколение увеличивается при каждой инвалидации: значения, вычисленные
+        # до нее, не должны попасть в кэш после
+        self.generation = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        """Получение значения (MISSING, если его нет или оно устарело)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, generation: int = None):
+        """
+        Сохранение значения
+        :param generation: поколение, в котором значение было вычислено
+                           (устаревшее значение не сохраняется)
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        """Удаление значения"""
+        with self._lock:
+            self.generation += 1
+            self._data.pop(key, None)
+
+    def invalidate(self, predicate=None):
+        """Удаление значений, ключи которых удовлетворяют predicate (все, если None)"""
+        with self._lock:
+            self.generation += 1
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        """Полная очистка кэша"""
+        self.invalidate()
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
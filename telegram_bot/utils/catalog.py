@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from psycopg2 import sql
+from config import CACHE_CONFIG
+from .db import DBManager
+
+logger = logging.getLogger(__name__)
+
+class Catalog:
+    """Справочники станций и типов велосипедов в памяти процесса"""
+
+    def __init__(self, ttl: float = CACHE_CONFIG["catalog_ttl"]):
+        self.ttl = ttl
+        # Версия увеличивается при каждой загрузке (для кэшей, построенных по каталогу)
+        self.version = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded_at = None
+        self._stations = {}  # station_id -> запись
+        self._station_ids = {}  # name -> station_id
+        self._bike_types = {}  # type_id -> запись
+        self._bike_type_ids = {}  # name -> type_id
+
+    def refresh(self):
+        """Загрузка справочников из БД"""
+        stations_query = sql.SQL("""
+            SELECT station_id, name, address, capacity, latitude, longitude
+            FROM stations
+            ORDER BY station_id
+        """)
+        bike_types_query = sql.SQL("""
+            SELECT type_id, name, description, price_per_hour
+            FROM bike_types
+            ORDER BY type_id
+        """)
+        with DBManager() as db:
+            stations = db.fetch_all(stations_query)
+            bike_types = db.fetch_all(bike_types_query)
+
+        station_ids = {}
+        for station in stations:
+            station_ids.setdefault(station['name'], station['station_id'])
+
+        with self._lock:
+            self._stations = {s['station_id']: dict(s) for s in stations}
+            self._station_ids = station_ids
+            self._bike_types = {t['type_id']: dict(t) for t in bike_types}
+            self._bike_type_ids = {t['name']: t['type_id'] for t in bike_types}
+            self._loaded_at = time.monotonic()
+            self.version += 1
+        logger.info(f"Catalog loaded: {len(stations)} stations, {len(bike_types)} bike types")
+
+    def invalidate(self):
+        """Пометить справочники устаревшими (перечитаются при следующем обращении)"""
+        self._loaded_at = None
+
+    def ensure_loaded(self):
+        """Загрузка справочников, если они не загружены или устарели (блокирует - не вызывать из event loop)"""
+        if not self.is_stale():
+            return
+        # Загружает один поток, остальные дожидаются результата
+        with self._refresh_lock:
+            if self.is_stale():
+                self.refresh()
+
+    def is_stale(self) -> bool:
+        """Справочники не загружены или устарели"""
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at > self.ttl
+
+    ### Станции ###
+    def stations(self, refresh: bool = True) -> list:
+        """
+        Все станции (копии записей)
+        :param refresh: False - только данные в памяти, без загрузки из БД (для кода в event loop)
+        """
+        if refresh:
+            self.ensure_loaded()
+        return [dict(s) for s in self._stations.values()]
+
+    def station(self, station_id: int, refresh: bool = True) -> dict:
+        """Станция по ID (копия записи)"""
+        if refresh:
+            self.ensure_loaded()
+        station = self._stations.get(station_id)
+        return dict(station) if station else None
+
+    def station_id(self, name: str) -> int:
+        """ID станции по названию"""
+        self.ensure_loaded()
+        return self._station_ids.get(name)
+
+    ### Типы велосипедов ###
+    def bike_types(self, refresh: bool = True) -> list:
+        """Все типы велосипедов (копии записей)"""
+        if refresh:
+            self.ensure_loaded()
+        return [dict(t) for t in self._bike_types.values()]
+
+    def bike_type(self, type_id: int) -> dict:
+        """Тип велосипеда по ID (копия записи)"""
+        self.ensure_loaded()
+        bike_type = self._bike_types.get(type_id)
+        return dict(bike_type) if bike_type else None
+
+    def bike_type_id(self, name: str) -> int:
+        """ID типа велосипеда по названию"""
+        self.ensure_loaded()
+        return self._bike_type_ids.get(name)
+
+
+catalog = Catalog()
+
+### Хелперы справочников (синхронные, как хелперы utils.db) ###
+def station_exists(station_id: int) -> bool:
+    """Проверяет существование станции"""
+    return catalog.station(station_id) is not None
+
+def get_all_stations() -> list:
+    """Получение списка всех станций"""
+    return catalog.stations()
+
+def get_station_id(station_name: str) -> int:
+    """Получение ID станции по названию"""
+    return catalog.station_id(station_name)
+
+def get_bike_types() -> list:
+    """Получение списка типов велосипедов"""
+    return catalog.bike_types()
+
+def get_bike_type_id(type_name: str) -> int:
+    """Получение ID типа по названию"""
+    return catalog.bike_type_id(type_name)
@@ -1,8 +1,28 @@
+import gzip
 import logging
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 import psycopg2
+from psycopg2 import extensions
 from psycopg2 import sql
-from psycopg2.extras import RealDictCursor
-from config import DB_CONFIG, LOGGING_CONFIG
+from psycopg2.extras import RealDictCursor, Json
+from config import DB_CONFIG, LOGGING_CONFIG, TELEGRAM_CONFIG
+from . import metrics
+from .slowlog import slow_query_log
+from .cache import MISSING
+from .identity import (
+    is_config_admin,
+    config_admins,
+    get_identity,
+    identity_generation,
+    remember_identity,
+    invalidate_identity
+)
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
@@ -15,10 +35,221 @@ class DatabaseError(Exception):
     """Кастомное исключение для ошибок БД"""
     pass
 
+class StationFullError(DatabaseError):
+    """На станции возврата нет свободных мест"""
+    pass
+
+# SQLSTATE, с которым close_rental отклоняет возврат на заполненную станцию
+STATION_FULL = "BR001"
+# SQLSTATE взаимоблокировки и конфликта сериализации: транзакцию можно повторить
+RETRYABLE = frozenset({"40P01", "40001"})
+
+class ConnectionPool:
+    """Пул соединений с PostgreSQL с проверкой здоровья и вытеснением"""
+
+    def __init__(self, conn_params: dict, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 10, max_idle: float = 300, max_lifetime: float = 3600,
+                 health_check_interval: float = 30):
+        self.conn_params = conn_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, last_used); справа - последние возвращенные
+        self._created_at = {}  # conn -> время создания
+        self._size = 0  # Открытые соединения (свободные + выданные)
+        self._closed = False
+
+        for _ in range(min_size):
+            self._size += 1
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _open(self):
+        """Открытие нового соединения"""
+        try:
+            conn = psycopg2.connect(**self.conn_params)
+        except psycopg2.OperationalError as e:
+            logger.error(f"Connection error: {e}")
+            raise DatabaseError("Database connection failed") from e
+        self._created_at[conn] = time.monotonic()
+        logger.info("Connected to PostgreSQL")
+        return conn
+
+    def _discard(self, conn):
+        """Закрытие соединения и освобождение места в пуле"""
+        self._created_at.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        logger.info("Connection closed")
+
+    def _expired(self, conn, now: float) -> bool:
+        """Соединение закрыто или превысило максимальное время жизни"""
+        return bool(conn.closed) or now - self._created_at.get(conn, now) > self.max_lifetime
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        """Проверка соединения перед выдачей"""
+        now = time.monotonic()
+        if self._expired(conn, now) or now - last_used > self.max_idle:
+            return False
+        if now - last_used <= self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Health check failed: {e}")
+            return False
+
+    def getconn(self):
+        """Получение соединения из пула"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise DatabaseError("Connection pool is closed")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.error("Connection pool exhausted")
+                        raise DatabaseError("Connection pool exhausted")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._open()
+                except DatabaseError:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+
+    def putconn(self, conn):
+        """Возврат соединения в пул"""
+        now = time.monotonic()
+        if self._closed or self._expired(conn, now):
+            self._discard(conn)
+            return
+
+        if conn.status != extensions.STATUS_READY:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+
+        stale = []
+        with self._cond:
+            self._idle.append((conn, now))
+            # Вытеснение давно простаивающих соединений сверх минимального размера
+            while self._idle and self._size - len(stale) > self.min_size:
+                idle_conn, last_used = self._idle[0]
+                if now - last_used <= self.max_idle:
+                    break
+                self._idle.popleft()
+                stale.append(idle_conn)
+            self._cond.notify()
+
+        for idle_conn in stale:
+            self._discard(idle_conn)
+
+    def closeall(self):
+        """Закрытие всех свободных соединений и пула"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def init_pool() -> ConnectionPool:
+    """Создание пула соединений (вызывается один раз при старте бота)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            conn_params = {k: v for k, v in DB_CONFIG.items() if k != "pool"}
+            _pool = ConnectionPool(conn_params, **DB_CONFIG.get("pool", {}))
+            logger.info("Connection pool initialized")
+        return _pool
+
+def close_pool():
+    """Закрытие пула соединений"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            logger.info("Connection pool closed")
+
+def get_pool() -> ConnectionPool:
+    """Текущий пул соединений (создается при первом обращении)"""
+    return _pool or init_pool()
+
+
+_change_listeners = []
+
+def add_change_listener(callback):
+    """Подписка на изменения данных: callback(table) вызывается после коммита"""
+    _change_listeners.append(callback)
+
+def _notify_change(table: str):
+    """Оповещение подписчиков об изменении таблицы"""
+    for callback in _change_listeners:
+        try:
+            callback(table)
+        except Exception as e:
+            logger.error(f"Change listener error: {e}")
+
+
+# Список для сбора планов запросов (включается через capture_plans)
+_plan_capture = ContextVar("plan_capture", default=None)
+
+@contextmanager
+def capture_plans():
+    """
+    Сбор планов выполнения всех запросов внутри блока (для проверки индексов).
+    Перед каждым запросом выполняется EXPLAIN без ANALYZE, сам запрос выполняется как обычно
+    :return: список {"query", "plan"}
+    """
+    plans = []
+    token = _plan_capture.set(plans)
+    try:
+        yield plans
+    finally:
+        _plan_capture.reset(token)
+
+
 class DBManager:
     """Менеджер для работы с PostgreSQL"""
     
     def __init__(self):
+        self.pool = None
         self.conn = None
         self.cursor = None
 
@@ -30,35 +261,59 @@ class DBManager:
         self.close()
 
     def connect(self):
-        """Установка соединения с БД"""
-        try:
-            self.conn = psycopg2.connect(**DB_CONFIG)
-            self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            logger.info("Connected to PostgreSQL")
-        except psycopg2.OperationalError as e:
-            logger.error(f"Connection error: {e}")
-            raise DatabaseError("Database connection failed") from e
+        """Получение соединения из пула"""
+        self.pool = get_pool()
+        self.conn = self.pool.getconn()
+        self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
 
     def close(self):
-        """Закрытие соединения"""
+        """Возврат соединения в пул"""
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.conn:
-            self.conn.close()
-            logger.info("Connection closed")
+            self.pool.putconn(self.conn)
+            self.conn = None
+
+    def explain(self, query, params=None, analyze=False) -> dict:
+        """План выполнения запроса (EXPLAIN в формате JSON)"""
+        options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+        if isinstance(query, str):
+            query = sql.SQL(query)
+        self.cursor.execute(sql.SQL("EXPLAIN ({}) ").format(sql.SQL(options)) + query, params)
+        return self.cursor.fetchone()['QUERY PLAN'][0]
 
     def execute(self, query, params=None, commit=False):
         """Выполнение SQL-запроса"""
+        plans = _plan_capture.get()
+        started = time.perf_counter()
+        rows = None
         try:
+            if plans is not None:
+                plans.append({"query": query, "plan": self.explain(query, params)})
             self.cursor.execute(query, params)
             if commit:
                 self.conn.commit()
+            # Ошибка коммита учитывается как ошибка запроса
+            rows = self.cursor.rowcount
             logger.debug(f"Executed query: {query}")
             return self.cursor
         except psycopg2.Error as e:
             self.conn.rollback()
             logger.error(f"Query failed: {e}\nQuery: {query}")
             raise DatabaseError("Database operation failed") from e
+        finally:
+            # Учет метрик не должен подменять результат или исключение запроса
+            # (например, as_string на разорванном соединении)
+            try:
+                duration = time.perf_counter() - started
+                helper = _caller_name()
+                metrics.DB_QUERIES.observe(helper, duration, error=rows is None, rows=rows)
+                if duration >= slow_query_log.threshold:
+                    text = query if isinstance(query, str) else query.as_string(self.conn)
+                    slow_query_log.record(helper, text, params, duration)
+            except Exception as e:
+                logger.warning(f"Query metrics not recorded: {e}")
 
     def fetch_one(self, query, params=None):
         """Получение одной записи"""
@@ -70,6 +325,16 @@ class DBManager:
         self.execute(query, params)
         return self.cursor.fetchall()
 
+# Методы DBManager, через которые хелперы выполняют запросы (пропускаются при поиске хелпера)
+_DB_MANAGER_CODES = {DBManager.execute.__code__, DBManager.fetch_one.__code__, DBManager.fetch_all.__code__}
+
+def _caller_name() -> str:
+    """Имя хелпера, выполнившего запрос (метка метрик)"""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code in _DB_MANAGER_CODES:
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "unknown"
+
 
 def get_available_bikes(station_id=None):
     """Получение доступных велосипедов"""
@@ -79,6 +344,7 @@ def get_available_bikes(station_id=None):
         JOIN bike_types bt ON b.type_id = bt.type_id
         LEFT JOIN stations s ON b.station_id = s.station_id
         WHERE b.status = 'available'
+            AND (b.reserved_until IS NULL OR b.reserved_until < NOW())
     """)
     
     if station_id:
@@ -88,52 +354,87 @@ def get_available_bikes(station_id=None):
         return db.fetch_all(query, (station_id,)) if station_id else db.fetch_all(query)
 
 
+def get_available_bikes_page(station_id: int = None, type_id: int = None,
+                             after_id: int = None, before_id: int = None,
+                             limit: int = TELEGRAM_CONFIG["page_size"]) -> dict:
+    """
+    Страница доступных велосипедов по возрастанию ID (keyset-пагинация: один индексный запрос на страницу)
+    :param after_id: следующая страница - велосипеды с ID больше указанного
+    :param before_id: предыдущая страница - велосипеды с ID меньше указанного
+    :return: {"bikes", "has_prev", "has_next"}
+    """
+    filters = [sql.SQL("b.status = 'available'"),
+               sql.SQL("(b.reserved_until IS NULL OR b.reserved_until < NOW())")]
+    params = {"limit": limit + 1}
+    if station_id:
+        filters.append(sql.SQL("b.station_id = %(station_id)s"))
+        params["station_id"] = station_id
+    if type_id:
+        filters.append(sql.SQL("b.type_id = %(type_id)s"))
+        params["type_id"] = type_id
+    if before_id:
+        filters.append(sql.SQL("b.bike_id < %(before_id)s"))
+        params["before_id"] = before_id
+    elif after_id:
+        filters.append(sql.SQL("b.bike_id > %(after_id)s"))
+        params["after_id"] = after_id
 
-# def close_rental(rental_id: int, end_station_id: int) -> bool:
-#     """Завершение аренды"""
-#     query = sql.SQL("CALL close_rental(%s, %s)")
-    
-#     try:
-#         with DBManager() as db:
-#             db.execute(query, (rental_id, end_station_id), commit=True)
-#             return True
-#     except Exception as e:
-#         logger.error(f"Close rental error: {e}")
-#         return False
+    query = sql.SQL("""
+        SELECT b.bike_id, b.station_id, bt.name as type, s.name as station, bt.price_per_hour
+        FROM bikes b
+        JOIN bike_types bt ON b.type_id = bt.type_id
+        LEFT JOIN stations s ON b.station_id = s.station_id
+        WHERE {filters}
+        ORDER BY b.bike_id {direction}
+        LIMIT %(limit)s
+    """).format(
+        filters=sql.SQL(" AND ").join(filters),
+        # Назад - в обратном порядке от before_id, затем разворот страницы
+        direction=sql.SQL("DESC") if before_id else sql.SQL("ASC")
+    )
 
+    with DBManager() as db:
+        bikes = db.fetch_all(query, params)
 
-def close_rental(rental_id: int, end_station_id: int) -> bool:
-    """Завершение аренды и обновление статуса велосипеда"""
-    try:
-        # 1. Обновление записи аренды
-        update_rental_query = sql.SQL("""
-            UPDATE rentals 
-            SET 
-                end_time = NOW(),
-                end_station_id = %s
-            WHERE rental_id = %s
-        """)
-        
-        # 2. Обновление статуса велосипеда
-        update_bike_query = sql.SQL("""
-            UPDATE bikes 
-            SET 
-                status = 'available',
-                station_id = %s
-            WHERE bike_id = (
-                SELECT bike_id FROM rentals WHERE rental_id = %s
-            )
-        """)
-        
-        with DBManager() as db:
-            # Выполняем в транзакции
-            db.execute(update_rental_query, (end_station_id, rental_id), commit=False)
-            db.execute(update_bike_query, (end_station_id, rental_id), commit=True)
-            
-        return True
-    except Exception as e:
-        logger.error(f"Close rental error: {e}")
-        return False
+    # Лишняя строка сверх limit означает, что в этом направлении есть еще страница
+    more = len(bikes) > limit
+    bikes = bikes[:limit]
+    if before_id:
+        bikes.reverse()
+        return {"bikes": bikes, "has_prev": more, "has_next": True}
+    return {"bikes": bikes, "has_prev": bool(after_id), "has_next": more}
+
+def close_rental(rental_id: int, end_station_id: int) -> dict:
+    """
+    Завершение аренды с расчетом стоимости и оплатой (одна операция в БД)
+    :return: {"payment_id", "cost"} или None, если аренду не удалось закрыть
+    :raises StationFullError: на станции возврата нет свободных мест
+    """
+    query = sql.SQL("SELECT payment_id, cost FROM close_rental(%s, %s)")
+    attempts = 3
+    
+    for attempt in range(1, attempts + 1):
+        try:
+            with DBManager() as db:
+                result = db.execute(query, (rental_id, end_station_id), commit=True).fetchone()
+            break
+        except DatabaseError as e:
+            pgcode = getattr(e.__cause__, "pgcode", None)
+            if pgcode == STATION_FULL:
+                raise StationFullError(f"Station {end_station_id} is full") from e
+            if pgcode in RETRYABLE and attempt < attempts:
+                logger.warning(f"Close rental {rental_id} conflict ({pgcode}), retry {attempt}")
+                time.sleep(0.05 * attempt)
+                continue
+            logger.error(f"Close rental error: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Close rental error: {e}")
+            return None
+    
+    _notify_change("rentals")
+    _notify_change("payments")
+    return result
 
 def get_user_rentals(user_id: int) -> list[dict]:
     """Получение всех аренд пользователя с деталями"""
@@ -167,8 +468,10 @@ def create_payment(rental_id: int, amount: float, status: str = "pending") -> di
     """)
     
     with DBManager() as db:
-        result = db.execute(query, (rental_id, amount, status), commit=True)
-        return result.fetchone()
+        result = db.execute(query, (rental_id, amount, status), commit=True).fetchone()
+    
+    _notify_change("payments")
+    return result
 
 def get_payments_by_user(user_id: int) -> list:
     """Получение всех платежей пользователя"""
@@ -197,7 +500,9 @@ def update_payment_status(payment_id: int, new_status: str) -> bool:
     
     with DBManager() as db:
         db.execute(query, (new_status, payment_id), commit=True)
-        return True
+    
+    _notify_change("payments")
+    return True
 
 def calculate_total_income() -> float:
     """Общий доход системы (только завершенные платежи)"""
@@ -221,7 +526,9 @@ def add_review(user_id: int, bike_id: int, rating: int, comment: str = None) ->
     try:
         with DBManager() as db:
             db.execute(query, (user_id, bike_id, rating, comment), commit=True)
-            return True
+        
+        _notify_change("reviews")
+        return True
     except Exception as e:
         logger.error(f"Add review error: {e}")
         return False
@@ -270,7 +577,9 @@ def delete_review(review_id: int) -> bool:
     
     with DBManager() as db:
         db.execute(query, (review_id,), commit=True)
-        return True
+    
+    _notify_change("reviews")
+    return True
         
 def get_all_rentals():
     """Получение всех аренд"""
@@ -278,6 +587,47 @@ def get_all_rentals():
     with DBManager() as db:
         return db.fetch_all(query)
 
+def get_rentals_per_day(days: int = 7, user_id: int = None, by_station: bool = False) -> list:
+    """
+    Количество аренд по дням за последние N дней (агрегация на стороне БД)
+    :param user_id: ID пользователя (None - все аренды)
+    :param by_station: разбивка по станциям начала аренды
+    :return: [{day, rentals}] - по строке на каждый день окна, включая пустые;
+             с by_station - [{day, station_id, rentals}] только для непустых пар
+    """
+    user_filter = sql.SQL(" AND r.user_id = %(user_id)s") if user_id else sql.SQL("")
+    
+    if by_station:
+        query = sql.SQL("""
+            SELECT 
+                date_trunc('day', r.start_time)::date AS day,
+                r.start_station_id AS station_id,
+                COUNT(*) AS rentals
+            FROM rentals r
+            WHERE r.start_time >= date_trunc('day', NOW()) - %(days)s * INTERVAL '1 day'{user_filter}
+            GROUP BY 1, 2
+            ORDER BY 1, 2
+        """).format(user_filter=user_filter)
+    else:
+        query = sql.SQL("""
+            SELECT 
+                d.day::date AS day,
+                COUNT(r.rental_id) AS rentals
+            FROM generate_series(
+                date_trunc('day', NOW()) - %(days)s * INTERVAL '1 day',
+                date_trunc('day', NOW()),
+                INTERVAL '1 day'
+            ) AS d(day)
+            LEFT JOIN rentals r 
+                ON r.start_time >= d.day 
+                AND r.start_time < d.day + INTERVAL '1 day'{user_filter}
+            GROUP BY d.day
+            ORDER BY d.day
+        """).format(user_filter=user_filter)
+    
+    with DBManager() as db:
+        return db.fetch_all(query, {"days": days, "user_id": user_id})
+
 def get_completed_payments(days: int = 30):
     """Завершенные платежи за N дней"""
     query = sql.SQL("""
@@ -303,7 +653,247 @@ def get_station_stats():
     """)
     with DBManager() as db:
         return db.fetch_all(query)
+
+def get_station_occupancy(station_ids: list) -> dict:
+    """
+    Заполненность станций из счетчиков station_occupancy (без подсчета по bikes)
+    :return: {station_id: {"capacity", "available", "rented", "maintenance", "free_docks"}}
+    """
+    query = sql.SQL("""
+        SELECT
+            s.station_id,
+            s.capacity,
+            COALESCE(o.available, 0) AS available,
+            COALESCE(o.rented, 0) AS rented,
+            COALESCE(o.maintenance, 0) AS maintenance,
+            -- Вместимость не задана - число мест не ограничено (NULL)
+            CASE WHEN s.capacity IS NOT NULL
+                THEN GREATEST(s.capacity - COALESCE(o.available, 0) - COALESCE(o.maintenance, 0), 0)
+            END AS free_docks
+        FROM stations s
+        LEFT JOIN station_occupancy o ON o.station_id = s.station_id
+        WHERE s.station_id = ANY(%s)
+    """)
+    with DBManager() as db:
+        rows = db.fetch_all(query, (list(station_ids),))
+    return {row['station_id']: row for row in rows}
+
+def find_nearest_stations(latitude: float, longitude: float, k: int = TELEGRAM_CONFIG["nearest_stations"],
+                          with_bikes: bool = False, with_docks: bool = False,
+                          max_km: float = TELEGRAM_CONFIG["nearest_max_km"]) -> list:
+    """
+    K ближайших станций (пространственный индекс по справочнику в памяти)
+    :param max_km: радиус поиска (ограничивает обход сетки, если рядом нет подходящих станций)
+    :param with_bikes: только станции со свободными велосипедами
+    :param with_docks: только станции со свободными местами
+    :return: [{станция, distance_km, available, free_docks}] по возрастанию расстояния
+    """
+    from .geo import nearest_stations
+    # Кандидатов с запасом: часть ближайших станций может быть пустой или заполненной
+    candidates = nearest_stations(latitude, longitude, k * 4 if with_bikes or with_docks else k, max_km)
+    if not candidates:
+        return []
+    occupancy = get_station_occupancy([station['station_id'] for _, station in candidates])
+
+    result = []
+    for distance, station in candidates:
+        counts = occupancy.get(station['station_id'])
+        if counts is None:
+            continue
+        if (with_bikes and not counts['available']) or (with_docks and counts['free_docks'] == 0):
+            continue
+        result.append({
+            **station,
+            "distance_km": distance,
+            "available": counts['available'],
+            "free_docks": counts['free_docks']
+        })
+        if len(result) == k:
+            break
+    return result
     
+### Агрегаты ###
+def get_daily_income(days: int = 30) -> list:
+    """Выручка по дням за последние N дней из дневных агрегатов (включая пустые дни)"""
+    query = sql.SQL("""
+        SELECT 
+            d.day::date AS day,
+            COALESCE(SUM(s.revenue), 0) AS revenue
+        FROM generate_series(
+            CURRENT_DATE - %(days)s * INTERVAL '1 day',
+            CURRENT_DATE,
+            INTERVAL '1 day'
+        ) AS d(day)
+        LEFT JOIN daily_station_stats s ON s.day = d.day::date
+        GROUP BY d.day
+        ORDER BY d.day
+    """)
+    with DBManager() as db:
+        return db.fetch_all(query, {"days": days})
+
+def get_station_activity(days: int = None, limit: int = 5) -> list:
+    """
+    Самые активные станции по числу аренд из дневных агрегатов
+    :param days: период в днях (None - вся история)
+    :param limit: количество станций
+    """
+    period_filter = sql.SQL("WHERE ds.day >= CURRENT_DATE - %(days)s") if days else sql.SQL("")
+    query = sql.SQL("""
+        SELECT 
+            s.station_id,
+            s.name,
+            a.total_rentals,
+            a.ride_minutes,
+            a.revenue
+        FROM (
+            SELECT 
+                ds.station_id,
+                SUM(ds.rentals) AS total_rentals,
+                SUM(ds.ride_minutes) AS ride_minutes,
+                SUM(ds.revenue) AS revenue
+            FROM daily_station_stats ds
+            {period_filter}
+            GROUP BY ds.station_id
+        ) a
+        JOIN stations s ON a.station_id = s.station_id
+        ORDER BY a.total_rentals DESC
+        LIMIT %(limit)s
+    """).format(period_filter=period_filter)
+    with DBManager() as db:
+        return db.fetch_all(query, {"days": days, "limit": limit})
+
+def backfill_daily_stats(start_date, end_date) -> int:
+    """Пересчет дневных агрегатов за период [start_date, end_date], возвращает число строк"""
+    query = sql.SQL("SELECT backfill_daily_stats(%s, %s) AS rows")
+    with DBManager() as db:
+        result = db.execute(query, (start_date, end_date), commit=True).fetchone()
+    
+    _notify_change("daily_station_stats")
+    return result['rows']
+
+def get_rentals_date_range() -> dict:
+    """Даты первой и последней аренды"""
+    query = sql.SQL("""
+        SELECT 
+            MIN(start_time)::date AS first_day,
+            MAX(start_time)::date AS last_day
+        FROM rentals
+    """)
+    with DBManager() as db:
+        return db.fetch_one(query)
+    
+def get_active_rentals() -> list:
+    """Открытые аренды (end_time IS NULL)"""
+    query = sql.SQL("""
+        SELECT rental_id, user_id, bike_id, start_station_id, start_time
+        FROM rentals
+        WHERE end_time IS NULL
+        ORDER BY start_time
+    """)
+    with DBManager() as db:
+        return db.fetch_all(query)
+
+def get_open_rental(user_id: int) -> dict:
+    """Открытая аренда пользователя (последняя начатая) или None"""
+    query = sql.SQL("""
+        SELECT rental_id, bike_id, start_station_id, start_time
+        FROM rentals
+        WHERE user_id = %s AND end_time IS NULL
+        ORDER BY start_time DESC
+        LIMIT 1
+    """)
+    with DBManager() as db:
+        return db.fetch_one(query, (user_id,))
+
+### Состояние бота ###
+def load_bot_state(namespace: str) -> dict:
+    """Сохраненное состояние бота: {ключ: данные} (user_data, состояния диалогов)"""
+    query = sql.SQL("SELECT key, data FROM bot_state WHERE namespace = %s")
+    with DBManager() as db:
+        return {row['key']: row['data'] for row in db.fetch_all(query, (namespace,))}
+
+def save_bot_state(namespace: str, key: str, data):
+    """Сохранение состояния по ключу"""
+    query = sql.SQL("""
+        INSERT INTO bot_state (namespace, key, data, updated_at)
+        VALUES (%s, %s, %s, NOW())
+        ON CONFLICT (namespace, key) DO UPDATE
+        SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+    """)
+    with DBManager() as db:
+        db.execute(query, (namespace, key, Json(data)), commit=True)
+
+def delete_bot_state(namespace: str, key: str):
+    """Удаление состояния по ключу"""
+    query = sql.SQL("DELETE FROM bot_state WHERE namespace = %s AND key = %s")
+    with DBManager() as db:
+        db.execute(query, (namespace, key), commit=True)
+
+### Выгрузки ###
+# Выгрузка до 1 МБ собирается в памяти, больше - во временном файле на диске
+EXPORT_SPOOL_SIZE = 1 << 20
+
+def export_rentals_csv(user_id: int = None, date_from=None, date_to=None, compress: bool = False) -> tuple:
+    """
+    Выгрузка истории аренд в CSV потоком (COPY ... TO STDOUT), без загрузки строк в память
+    :param user_id: ID пользователя (None - весь парк, с колонкой user_id)
+    :param date_from: первый день периода (по началу аренды)
+    :param date_to: последний день периода (включительно)
+    :param compress: сжатие gzip
+    :return: (файл, открытый на чтение с начала, число аренд)
+    """
+    filters = []
+    if user_id:
+        filters.append(sql.SQL("r.user_id = {}").format(sql.Literal(user_id)))
+    if date_from:
+        filters.append(sql.SQL("r.start_time >= {}").format(sql.Literal(date_from)))
+    if date_to:
+        filters.append(sql.SQL("r.start_time < {} + INTERVAL '1 day'").format(sql.Literal(date_to)))
+
+    query = sql.SQL("""
+        COPY (
+            SELECT
+                r.rental_id,{user_column}
+                to_char(r.start_time, 'YYYY-MM-DD HH24:MI') AS start_time,
+                to_char(r.end_time, 'YYYY-MM-DD HH24:MI') AS end_time,
+                s_start.name AS start_station,
+                s_end.name AS end_station,
+                b.bike_id,
+                bt.name AS bike_type
+            FROM rentals r
+            JOIN bikes b ON r.bike_id = b.bike_id
+            JOIN bike_types bt ON b.type_id = bt.type_id
+            LEFT JOIN stations s_start ON r.start_station_id = s_start.station_id
+            LEFT JOIN stations s_end ON r.end_station_id = s_end.station_id
+            WHERE {filters}
+            ORDER BY {order}
+        ) TO STDOUT WITH (FORMAT csv, HEADER)
+    """).format(
+        user_column=sql.SQL("") if user_id else sql.SQL(" r.user_id,"),
+        filters=sql.SQL(" AND ").join(filters) if filters else sql.SQL("TRUE"),
+        # История пользователя - от новых к старым, весь парк - в порядке первичного ключа
+        order=sql.SQL("r.start_time DESC") if user_id else sql.SQL("r.rental_id")
+    )
+
+    export = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    target = gzip.GzipFile(fileobj=export, mode="wb") if compress else export
+    started = time.perf_counter()
+    try:
+        with DBManager() as db:
+            db.cursor.copy_expert(query.as_string(db.conn), target, size=1 << 16)
+            rows = db.cursor.rowcount
+        if compress:
+            # Закрывается только gzip-поток (дописывается трейлер), файл остается открытым
+            target.close()
+    except psycopg2.Error as e:
+        export.close()
+        logger.error(f"Rentals export failed: {e}")
+        raise DatabaseError("Database operation failed") from e
+
+    metrics.DB_QUERIES.observe("export_rentals_csv", time.perf_counter() - started, rows=rows)
+    export.seek(0)
+    return export, rows
+
 def get_bike_info(bike_id: int) -> dict:
     """Возвращает информацию о велосипеде"""
     query = sql.SQL("""
@@ -329,81 +919,179 @@ def cancel_rental(rental_id: int):
     """)
     with DBManager() as db:
         db.execute(query, (rental_id,), commit=True)
-        
-def station_exists(station_id: int) -> bool:
-    """Проверяет существование станции"""
-    query = sql.SQL("SELECT 1 FROM stations WHERE station_id = %s")
-    with DBManager() as db:
-        result = db.fetch_one(query, (station_id,))
-        return bool(result)
+    
+    _notify_change("rentals")
     
 def create_user_if_not_exists(user_data: dict):
     """Создает пользователя, если его нет в базе"""
+    identity = get_identity(user_data["id"])
+    if identity is not MISSING and identity[0]:
+        return
+    
+    # Роль существующего пользователя возвращается тем же запросом; ADMIN_IDS получают admin при регистрации
     query = sql.SQL("""
-        INSERT INTO users (user_id, full_name, username, registration_date)
-        VALUES (%(id)s, %(name)s, %(username)s, NOW())
-        ON CONFLICT (user_id) DO NOTHING
+        WITH created AS (
+            INSERT INTO users (user_id, full_name, username, registration_date, role)
+            VALUES (%(id)s, %(name)s, %(username)s, NOW(), %(role)s)
+            ON CONFLICT (user_id) DO NOTHING
+            RETURNING role
+        )
+        SELECT role FROM created
+        UNION ALL
+        SELECT role FROM users WHERE user_id = %(id)s AND NOT EXISTS (SELECT 1 FROM created)
     """)
     
+    generation = identity_generation()
     with DBManager() as db:
-        db.execute(query, {
+        user = db.execute(query, {
             "id": user_data["id"],
             "name": user_data["full_name"],
-            "username": user_data["username"]
-        }, commit=True)
-        
+            "username": user_data["username"],
+            "role": "admin" if is_config_admin(user_data["id"]) else None
+        }, commit=True).fetchone()
+    
+    remember_identity(user_data["id"], True, user['role'], generation=generation)
+
+def _load_identity(user_id: int) -> tuple:
+    """Загрузка (exists, role) пользователя из БД в кэш"""
+    query = sql.SQL("SELECT role FROM users WHERE user_id = %s")
+    generation = identity_generation()
+    with DBManager() as db:
+        result = db.fetch_one(query, (user_id,))
+    
+    identity = (result is not None, result['role'] if result else None)
+    remember_identity(user_id, *identity, generation=generation)
+    return identity
+
 def user_exists(user_id: int) -> bool:
     """Проверяет существование пользователя"""
-    query = sql.SQL("SELECT 1 FROM users WHERE user_id = %s")
+    identity = get_identity(user_id)
+    if identity is MISSING:
+        identity = _load_identity(user_id)
+    return identity[0]
+
+def reserve_bike(bike_id: int, user_id: int, ttl: int = TELEGRAM_CONFIG["reservation_ttl"]) -> dict:
+    """
+    Удержание доступного велосипеда за пользователем на ttl секунд
+    :return: информация о велосипеде или None, если он занят или удерживается другим
+    """
+    # Условный UPDATE: при одновременных запросах строку получает ровно один,
+    # остальные сразу получают пустой результат без повторных попыток
+    query = sql.SQL("""
+        UPDATE bikes b
+        SET 
+            reserved_by = %(user_id)s,
+            reserved_until = NOW() + %(ttl)s * INTERVAL '1 second'
+        FROM bike_types bt, stations s
+        WHERE b.bike_id = %(bike_id)s
+            AND b.status = 'available'
+            AND (b.reserved_until IS NULL OR b.reserved_until < NOW() OR b.reserved_by = %(user_id)s)
+            AND bt.type_id = b.type_id
+            AND s.station_id = b.station_id
+        RETURNING 
+            b.bike_id, 
+            bt.name as type, 
+            s.station_id,
+            s.name as station,
+            b.status,
+            b.reserved_until
+    """)
     with DBManager() as db:
-        result = db.fetch_one(query, (user_id,))
-        return bool(result)
+        return db.execute(query, {"bike_id": bike_id, "user_id": user_id, "ttl": ttl}, commit=True).fetchone()
+
+def release_bike(bike_id: int, user_id: int) -> bool:
+    """Снятие удержания велосипеда пользователем"""
+    query = sql.SQL("""
+        UPDATE bikes
+        SET reserved_by = NULL, reserved_until = NULL
+        WHERE bike_id = %s AND reserved_by = %s
+    """)
+    with DBManager() as db:
+        return bool(db.execute(query, (bike_id, user_id), commit=True).rowcount)
 
 def start_rental(user_id: int, bike_id: int, station_id: int) -> int:
-    """Начинает аренду и возвращает rental_id"""
+    """
+    Начинает аренду и возвращает rental_id
+    :return: rental_id или None, если велосипед уже занят или удерживается другим
+    """
+    # Строка велосипеда блокируется до вставки аренды: из параллельных попыток
+    # арендовать один велосипед успешна только первая
     query = sql.SQL("""
+        WITH claimed AS (
+            SELECT bike_id
+            FROM bikes
+            WHERE bike_id = %(bike_id)s
+                AND status = 'available'
+                AND (reserved_by = %(user_id)s OR reserved_until IS NULL OR reserved_until < NOW())
+            FOR UPDATE
+        )
         INSERT INTO rentals (user_id, bike_id, start_station_id)
-        VALUES (%s, %s, %s)
+        SELECT %(user_id)s, bike_id, %(station_id)s
+        FROM claimed
         RETURNING rental_id
     """)
     
     with DBManager() as db:
-        result = db.execute(query, (user_id, bike_id, station_id), commit=True)
-        return result.fetchone()['rental_id']
-
-def check_user_role(user_id: int, role: str) -> bool:
-    """Проверяет роль пользователя"""
-    query = sql.SQL("SELECT 1 FROM users WHERE user_id = %s AND role = %s")
-    with DBManager() as db:
-        result = db.fetch_one(query, (user_id, role))
-        return bool(result)
+        result = db.execute(query, {
+            "user_id": user_id,
+            "bike_id": bike_id,
+            "station_id": station_id
+        }, commit=True).fetchone()
     
-def get_bike_types() -> list:
-    """Получение списка типов велосипедов"""
-    query = "SELECT type_id, name FROM bike_types"
-    with DBManager() as db:
-        return db.fetch_all(query)
+    if not result:
+        return None
+    
+    _notify_change("rentals")
+    return result['rental_id']
 
-def get_bike_type_id(type_name: str) -> int:
-    """Получение ID типа по названию"""
-    query = "SELECT type_id FROM bike_types WHERE name = %s"
-    with DBManager() as db:
-        result = db.fetch_one(query, (type_name,))
-        return result['type_id'] if result else None
+def check_user_role(user_id: int, role: str) -> bool:
+    """Проверяет роль пользователя (по users.role)"""
+    identity = get_identity(user_id)
+    if identity is MISSING:
+        identity = _load_identity(user_id)
+    return identity[1] == role
 
-def get_all_stations() -> list:
-    """Получение списка всех станций"""
-    query = "SELECT station_id, name FROM stations"
+def set_user_role(user_id: int, role: str) -> bool:
+    """Изменение роли пользователя"""
+    allowed_roles = ['client', 'admin']
+    if role not in allowed_roles:
+        raise ValueError(f"Invalid role. Allowed: {allowed_roles}")
+    
+    query = sql.SQL("""
+        UPDATE users
+        SET role = %s
+        WHERE user_id = %s
+    """)
+    
     with DBManager() as db:
-        return db.fetch_all(query)
+        updated = db.execute(query, (role, user_id), commit=True).rowcount
+    
+    invalidate_identity(user_id)
+    _notify_change("users")
+    return bool(updated)
 
-def get_station_id(station_name: str) -> int:
-    """Получение ID станции по названию"""
-    query = "SELECT station_id FROM stations WHERE name = %s"
+def seed_admins() -> int:
+    """
+    Роль admin для пользователей из ADMIN_IDS, которым роль еще не назначена
+    (назначенную роль, в том числе понижение до client, не перезаписывает)
+    :return: число обновленных пользователей
+    """
+    admin_ids = config_admins()
+    if not admin_ids:
+        return 0
+    query = sql.SQL("""
+        UPDATE users
+        SET role = 'admin'
+        WHERE user_id = ANY(%s) AND role IS NULL
+    """)
     with DBManager() as db:
-        result = db.fetch_one(query, (station_name,))
-        return result['station_id'] if result else None
-
+        updated = db.execute(query, (admin_ids,), commit=True).rowcount
+    
+    if updated:
+        invalidate_identity()
+        _notify_change("users")
+    return updated
+    
 def add_bike(type_id: int, station_id: int) -> bool:
     """Добавление нового велосипеда"""
     query = """
@@ -0,0 +1,106 @@
+import math
+import threading
+from collections import defaultdict
+from .catalog import catalog
+
+EARTH_RADIUS_KM = 6371.0
+# Километров в одном градусе широты
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние между точками по поверхности Земли (гаверсинус)"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class StationIndex:
+    """Сеточный пространственный индекс станций: поиск ближайших без перебора всех станций"""
+
+    def __init__(self, cell_size: float = 0.01):
+        # Размер ячейки в градусах (~1 км по широте)
+        self.cell_size = cell_size
+        self.version = None
+        self._cells = {}  # (i, j) -> [станции]
+        self._bounds = None  # (min_i, max_i, min_j, max_j)
+        self._lock = threading.Lock()
+
+    def _cell(self, lat: float, lon: float) -> tuple:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def build(self, stations: list, version=None):
+        """Построение индекса по станциям с координатами"""
+        cells = defaultdict(list)
+        for station in stations:
+            if station.get('latitude') is None or station.get('longitude') is None:
+                continue
+            cells[self._cell(float(station['latitude']), float(station['longitude']))].append(station)
+        bounds = None
+        if cells:
+            rows = [i for i, _ in cells]
+            columns = [j for _, j in cells]
+            bounds = (min(rows), max(rows), min(columns), max(columns))
+        with self._lock:
+            self._cells = dict(cells)
+            self._bounds = bounds
+            self.version = version
+
+    def _ring(self, center: tuple, radius: int):
+        """Ячейки на расстоянии radius от центральной (по Чебышеву)"""
+        ci, cj = center
+        if radius == 0:
+            yield center
+            return
+        for j in range(cj - radius, cj + radius + 1):
+            yield ci - radius, j
+            yield ci + radius, j
+        for i in range(ci - radius + 1, ci + radius):
+            yield i, cj - radius
+            yield i, cj + radius
+
+    def nearest(self, lat: float, lon: float, k: int = 5, max_km: float = None) -> list:
+        """
+        K ближайших станций
+        :param max_km: не дальше указанного расстояния
+        :return: [(расстояние в км, станция)] по возрастанию расстояния
+        """
+        with self._lock:
+            cells, bounds = self._cells, self._bounds
+        if not cells or k <= 0:
+            return []
+
+        center = self._cell(lat, lon)
+        # Сколько колец нужно, чтобы накрыть всю сетку из любой точки
+        max_radius = max(
+            abs(center[0] - bounds[0]), abs(center[0] - bounds[1]),
+            abs(center[1] - bounds[2]), abs(center[1] - bounds[3])
+        )
+        # Нижняя оценка расстояния до ячеек кольца r: (r - 1) ячеек по долготе (она короче широты)
+        cell_km = self.cell_size * KM_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + 1, 90))), 0.01)
+
+        found = []
+        for radius in range(max_radius + 1):
+            if len(found) >= k and found[k - 1][0] <= (radius - 1) * cell_km:
+                break
+            if max_km is not None and (radius - 1) * cell_km > max_km:
+                break
+            for cell in self._ring(center, radius):
+                for station in cells.get(cell, ()):
+                    distance = distance_km(lat, lon, float(station['latitude']), float(station['longitude']))
+                    if max_km is None or distance <= max_km:
+                        found.append((distance, station))
+            found.sort(key=lambda item: item[0])
+        return found[:k]
+
+
+station_index = StationIndex()
+
+def nearest_stations(lat: float, lon: float, k: int = 5, max_km: float = None) -> list:
+    """K ближайших станций из справочника (индекс перестраивается при обновлении справочника)"""
+    catalog.ensure_loaded()
+    # Версия читается до снимка: при параллельном refresh индекс получит старую версию и перестроится
+    version = catalog.version
+    if station_index.version != version:
+        station_index.build(catalog.stations(refresh=False), version)
+    return station_index.nearest(lat, lon, k, max_km)
@@ -0,0 +1,41 @@
+from config import CACHE_CONFIG, TELEGRAM_CONFIG
+from . import metrics
+from .cache import TTLCache
+
+# Кэш user_id -> (существует ли пользователь, роль)
+identity_cache = TTLCache(maxsize=CACHE_CONFIG["identity_size"], ttl=CACHE_CONFIG["identity_ttl"])
+metrics.register_cache("identity", identity_cache)
+
+# Администраторы из конфигурации: роль admin выдается им при регистрации (источник истины - users.role)
+_config_admins = frozenset(TELEGRAM_CONFIG["admin_ids"])
+
+def is_config_admin(user_id: int) -> bool:
+    """Пользователь указан в ADMIN_IDS"""
+    return user_id in _config_admins
+
+def config_admins() -> list:
+    """ID из ADMIN_IDS"""
+    return list(_config_admins)
+
+def get_identity(user_id: int):
+    """(exists, role) из кэша или MISSING"""
+    return identity_cache.get(user_id)
+
+def identity_generation() -> int:
+    """Поколение кэша: запоминается до запроса к БД и передается в remember_identity"""
+    return identity_cache.generation
+
+def remember_identity(user_id: int, exists: bool, role: str = None, generation: int = None):
+    """
+    Сохранение (exists, role) в кэш
+    :param generation: поколение до запроса к БД (результат, прочитанный до смены роли, не сохраняется)
+    """
+    identity_cache.set(user_id, (exists, role), generation)
+
+def invalidate_identity(user_id: int = None):
+    """Сброс кэша пользователя (всех пользователей, если user_id не указан)"""
+    if user_id is None:
+        identity_cache.clear()
+    else:
+        identity_cache.pop(user_id)
+
@@ -0,0 +1,91 @@
+import threading
+from telegram import KeyboardButton, ReplyKeyboardMarkup
+from .catalog import catalog
+
+# Клавиатуры неизменяемы (TelegramObject), поэтому одни и те же объекты отправляются всем пользователям
+
+def _reply(rows: list) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True)
+
+### Статические клавиатуры (строятся один раз) ###
+MAIN_MENU = {
+    "client": _reply([
+        [KeyboardButton("🚲 Арендовать велосипед")],
+        [KeyboardButton("📖 Мои аренды"), KeyboardButton("📊 Статистика")],
+        [KeyboardButton("❓ Помощь")]
+    ]),
+    "admin": _reply([
+        [KeyboardButton("🚲 Арендовать велосипед")],
+        [KeyboardButton("➕ Добавить велосипед")],
+        [KeyboardButton("📖 Мои аренды"), KeyboardButton("📊 Статистика")],
+        [KeyboardButton("❓ Помощь")]
+    ])
+}
+
+RENTAL_MENU = _reply([
+    [KeyboardButton("🔙 Завершить аренду")],
+    [KeyboardButton("❌ Отменить аренду")]
+])
+
+STATS_MENU = _reply([
+    [KeyboardButton("📈 Аренды"), KeyboardButton("💰 Доходы")],
+    [KeyboardButton("⭐ Рейтинги"), KeyboardButton("🔙 Назад")]
+])
+
+CONFIRM = _reply([[KeyboardButton("✅ Подтвердить"), KeyboardButton("❌ Отменить")]])
+
+SEND_LOCATION = _reply([[KeyboardButton("📍 Ближайшие станции", request_location=True)]])
+
+CANCEL = _reply([[KeyboardButton("🔙 Отмена")]])
+
+SKIP = _reply([[KeyboardButton("🚫 Пропустить")]])
+
+RATING = _reply([[KeyboardButton(str(i)) for i in range(1, 6)]])
+
+def main_menu(role: str = "client") -> ReplyKeyboardMarkup:
+    """Главное меню для роли пользователя"""
+    return MAIN_MENU.get(role, MAIN_MENU["client"])
+
+
+### Клавиатуры из справочников ###
+class CatalogKeyboards:
+    """
+    Выбор типа велосипеда и станции: пересобираются только при новой версии справочников.
+    Читают справочники только из памяти - перед обращением их освежает async_db.ensure_catalog
+    """
+
+    def __init__(self):
+        self.version = None
+        self._bike_types = None
+        self._stations = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _choice(names: list):
+        """Клавиатура выбора из списка с кнопкой отмены (None, если выбирать не из чего)"""
+        if not names:
+            return None
+        return _reply([[KeyboardButton(name)] for name in names] + [[KeyboardButton("🔙 Отмена")]])
+
+    def _ensure_built(self):
+        version = catalog.version
+        if self.version == version:
+            return
+        with self._lock:
+            if self.version != version:
+                self._bike_types = self._choice([t['name'] for t in catalog.bike_types(refresh=False)])
+                self._stations = self._choice([s['name'] for s in catalog.stations(refresh=False)])
+                self.version = version
+
+    def bike_types(self) -> ReplyKeyboardMarkup:
+        """Типы велосипедов (None, если типов нет)"""
+        self._ensure_built()
+        return self._bike_types
+
+    def stations(self) -> ReplyKeyboardMarkup:
+        """Станции (None, если станций нет)"""
+        self._ensure_built()
+        return self._stations
+
+
+catalog_keyboards = CatalogKeyboards()
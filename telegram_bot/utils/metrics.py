@@ -0,0 +1,229 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (в секундах)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class _Series:
+    """Значения гистограммы для одной метки"""
+    __slots__ = ("buckets", "count", "total", "errors", "rows")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.rows = 0
+
+class Histogram:
+    """Гистограмма длительностей с одной меткой (имя хелпера, обработчика, графика)"""
+
+    def __init__(self, name: str, description: str, label: str,
+                 buckets: tuple = BUCKETS, track_rows: bool = False):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.track_rows = track_rows
+        self.bounds = buckets
+        self._series = {}  # значение метки -> _Series
+        self._lock = threading.Lock()
+
+    def observe(self, label: str, seconds: float, error: bool = False, rows: int = None):
+        """Учет одного вызова"""
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = _Series(len(self.bounds))
+            for i, bound in enumerate(self.bounds):
+                if seconds <= bound:
+                    series.buckets[i] += 1
+                    break
+            series.count += 1
+            series.total += seconds
+            if error:
+                series.errors += 1
+            if rows is not None and rows > 0:
+                series.rows += rows
+
+    @contextmanager
+    def time(self, label: str):
+        """Замер длительности блока (исключение учитывается как ошибка)"""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(label, time.perf_counter() - started, error=error)
+
+    def snapshot(self) -> dict:
+        """Копия значений: метка -> {buckets, count, total, errors, rows}"""
+        with self._lock:
+            return {
+                label: {
+                    "buckets": list(s.buckets), "count": s.count,
+                    "total": s.total, "errors": s.errors, "rows": s.rows
+                }
+                for label, s in self._series.items()
+            }
+
+    def quantile(self, buckets: list, count: int, q: float) -> float:
+        """Оценка перцентиля по корзинам (верхняя граница корзины)"""
+        threshold = q * count
+        cumulative = 0
+        for bound, n in zip(self.bounds, buckets):
+            cumulative += n
+            if cumulative >= threshold:
+                return bound
+        return float("inf")
+
+    def exposition(self) -> list:
+        """Строки в текстовом формате Prometheus"""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        base = self.name[:-len("_seconds")] if self.name.endswith("_seconds") else self.name
+        counters = []
+        for label, s in sorted(self.snapshot().items()):
+            tag = f'{self.label}="{_escape(label)}"'
+            cumulative = 0
+            for bound, n in zip(self.bounds, s["buckets"]):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{tag},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{tag},le="+Inf"}} {s["count"]}')
+            lines.append(f'{self.name}_sum{{{tag}}} {s["total"]:.6f}')
+            lines.append(f'{self.name}_count{{{tag}}} {s["count"]}')
+            counters.append((tag, s))
+        lines.append(f"# TYPE {base}_errors_total counter")
+        lines.extend(f"{base}_errors_total{{{tag}}} {s['errors']}" for tag, s in counters)
+        if self.track_rows:
+            lines.append(f"# TYPE {base}_rows_total counter")
+            lines.extend(f"{base}_rows_total{{{tag}}} {s['rows']}" for tag, s in counters)
+        return lines
+
+def _escape(value: str) -> str:
+    """Экранирование значения метки"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+DB_QUERIES = Histogram("bot_db_query_seconds", "Время выполнения запросов utils.db по хелперам", "helper",
+                       track_rows=True)
+HANDLERS = Histogram("bot_handler_seconds", "Время обработки обновления по обработчикам бота", "handler")
+RENDERS = Histogram("bot_render_seconds", "Время построения графиков по типам", "kind")
+HISTOGRAMS = (DB_QUERIES, HANDLERS, RENDERS)
+
+# Кэши процесса: имя -> объект со stats() (hits, misses, size)
+CACHES = {}
+
+def register_cache(name: str, cache):
+    """Публикация счетчиков попаданий и промахов кэша на /metrics"""
+    CACHES[name] = cache
+
+def cache_exposition() -> list:
+    """Счетчики кэшей в текстовом формате Prometheus"""
+    stats = {name: cache.stats() for name, cache in sorted(CACHES.items())}
+    lines = []
+    for metric, key, kind, description in (
+        ("bot_cache_hits_total", "hits", "counter", "Попадания в кэш"),
+        ("bot_cache_misses_total", "misses", "counter", "Промахи кэша"),
+        ("bot_cache_entries", "size", "gauge", "Записей в кэше"),
+    ):
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(f'{metric}{{cache="{_escape(name)}"}} {s[key]}' for name, s in stats.items())
+    return lines
+
+def track_handler(func):
+    """Декоратор обработчика бота: длительность и ошибки по имени обработчика"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with HANDLERS.time(func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+def exposition() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.exposition())
+    lines.extend(cache_exposition())
+    return "\n".join(lines) + "\n"
+
+def summary(top: int = 5) -> str:
+    """Сводка: самые затратные по суммарному времени метки каждой гистограммы"""
+    parts = []
+    for histogram in HISTOGRAMS:
+        series = sorted(histogram.snapshot().items(), key=lambda item: item[1]["total"], reverse=True)
+        for label, s in series[:top]:
+            p95 = histogram.quantile(s["buckets"], s["count"], 0.95)
+            parts.append(
+                f"{histogram.label}={label} count={s['count']} errors={s['errors']} "
+                f"total={s['total']:.2f}s avg={s['total'] / s['count'] * 1000:.1f}ms p95<={p95 * 1000:g}ms"
+            )
+    return "\n".join(parts)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    """HTTP-обработчик /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Запросы скрейпера не засоряют лог
+        pass
+
+_server = None
+_stop_summary = threading.Event()
+
+def _summary_loop(interval: float):
+    """Периодическая запись сводки в лог"""
+    while not _stop_summary.wait(interval):
+        text = summary()
+        if text:
+            logger.info(f"Metrics summary:\n{text}")
+
+def start(host: str = METRICS_CONFIG["host"], port: int = METRICS_CONFIG["port"],
+          summary_interval: float = METRICS_CONFIG["summary_interval"]):
+    """Запуск HTTP-эндпоинта /metrics и периодической сводки в лог"""
+    global _server
+    if _server is not None:
+        return
+    _server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    if summary_interval:
+        _stop_summary.clear()
+        threading.Thread(target=_summary_loop, args=(summary_interval,), name="metrics-summary", daemon=True).start()
+    logger.info(f"Metrics endpoint: http://{host}:{port}/metrics")
+
+def stop():
+    """Остановка эндпоинта и сводки (последняя сводка пишется в лог)"""
+    global _server
+    _stop_summary.set()
+    if _server is None:
+        return
+    _server.shutdown()
+    _server.server_close()
+    _server = None
+    text = summary()
+    if text:
+        logger.info(f"Metrics summary:\n{text}")
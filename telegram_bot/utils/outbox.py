@@ -0,0 +1,224 @@
+import asyncio
+import logging
+from collections import Counter, deque
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from config import OUTBOX_CONFIG, TELEGRAM_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста сообщения Telegram
+MAX_TEXT = 4096
+
+class TokenBucket:
+    """Ограничение частоты: rate токенов в секунду, не больше burst подряд"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = None
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def full(self) -> bool:
+        """Бакет успел наполниться (чат давно ничего не получал)"""
+        self._refill(asyncio.get_running_loop().time())
+        return self._tokens >= self.burst
+
+    async def acquire(self):
+        """Дождаться токена"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._refill(loop.time())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _Chat:
+    """Состояние отправки в один чат"""
+    __slots__ = ("bucket", "pending", "active")
+
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        # Сообщения в чат отправляет одна задача по порядку; ожидание лимита чата не задерживает другие чаты
+        self.pending = deque()
+        self.active = False
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений: до workers одновременных отправок с лимитами частоты
+    на бота и на чат, ожиданием RetryAfter и сводками повторяющихся уведомлений администраторам
+    """
+
+    def __init__(self, workers: int = OUTBOX_CONFIG["workers"],
+                 queue_size: int = OUTBOX_CONFIG["queue_size"],
+                 alert_window: float = OUTBOX_CONFIG["alert_window"]):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.alert_window = alert_window
+        self._bot = None
+        self._queue = None
+        self._sending = None
+        self._dispatcher = None
+        self._drainers = set()
+        self._unsent = 0  # Неотправленные сообщения: в общей очереди и в очередях чатов
+        self._global = None
+        self._chats = {}  # chat_id -> _Chat
+        self._paused_until = 0.0  # Конец ожидания после RetryAfter
+        self._alerts = None  # Текст -> повторы в текущем окне (None - окна нет)
+        self._alerts_timer = None
+
+    def start(self, bot):
+        """Запуск распределения сообщений по чатам"""
+        if self._dispatcher is not None:
+            return
+        self._bot = bot
+        self._queue = asyncio.Queue()
+        self._sending = asyncio.Semaphore(self.workers)
+        self._global = TokenBucket(OUTBOX_CONFIG["global_rate"], OUTBOX_CONFIG["global_burst"])
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        logger.info(f"Outbox started ({self.workers} workers)")
+
+    async def stop(self, timeout: float = OUTBOX_CONFIG["drain_timeout"]):
+        """Остановка: отправка накопленной сводки и очереди (не дольше timeout), затем отмена задач"""
+        if self._dispatcher is None:
+            return
+        if self._alerts_timer is not None:
+            self._alerts_timer.cancel()
+            self._flush_alerts(reopen=False)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Outbox stopped with {self._unsent} unsent messages")
+        tasks = [self._dispatcher, *self._drainers]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+        self._drainers.clear()
+        logger.info("Outbox stopped")
+
+    def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        """
+        Поставить сообщение в очередь (без ожидания отправки)
+        :return: False, если очередь переполнена и сообщение отброшено
+        """
+        if self._dispatcher is None:
+            logger.warning(f"Outbox is not started, message to {chat_id} dropped")
+            return False
+        if self._unsent >= self.queue_size:
+            logger.warning(f"Outbox queue is full, message to {chat_id} dropped")
+            return False
+        self._unsent += 1
+        self._queue.put_nowait((chat_id, text[:MAX_TEXT], kwargs))
+        return True
+
+    ### Уведомления администраторов ###
+    def alert(self, text: str):
+        """
+        Уведомление администраторам: первое сразу, повторы за alert_window - одной сводкой в конце окна
+        """
+        if self._alerts is not None:
+            self._alerts[text] += 1
+            return
+        self._send_admins(f"🚨 Ошибка в боте:\n{text}")
+        self._open_alert_window()
+
+    def _open_alert_window(self):
+        self._alerts = Counter()
+        self._alerts_timer = asyncio.get_running_loop().call_later(self.alert_window, self._flush_alerts)
+
+    def _flush_alerts(self, reopen: bool = True):
+        """Сводка за окно; пока уведомления продолжаются, открывается следующее окно"""
+        alerts, self._alerts, self._alerts_timer = self._alerts, None, None
+        if not alerts:
+            return
+        lines = [f"🚨 Повторные ошибки за {self.alert_window:g} с (всего: {sum(alerts.values())}):"]
+        top = alerts.most_common(10)
+        lines.extend(f"{count} × {text[:300]}" for text, count in top)
+        if len(alerts) > len(top):
+            lines.append(f"...и еще {len(alerts) - len(top)} видов ошибок")
+        self._send_admins("\n".join(lines))
+        if reopen:
+            self._open_alert_window()
+
+    def _send_admins(self, text: str):
+        for admin_id in TELEGRAM_CONFIG["admin_ids"]:
+            self.send(admin_id, text)
+
+    ### Отправка ###
+    def _chat(self, chat_id: int) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= 10 * self.queue_size:
+                # Забываем чаты, которые давно ничего не получали
+                self._chats = {cid: c for cid, c in self._chats.items() if c.active or not c.bucket.full}
+            chat = self._chats[chat_id] = _Chat(OUTBOX_CONFIG["chat_rate"], OUTBOX_CONFIG["chat_burst"])
+        return chat
+
+    async def _dispatch(self):
+        """Раскладка сообщений из общей очереди по чатам"""
+        while True:
+            chat_id, text, kwargs = await self._queue.get()
+            chat = self._chat(chat_id)
+            chat.pending.append((text, kwargs))
+            if not chat.active:
+                chat.active = True
+                task = asyncio.create_task(self._drain(chat_id, chat))
+                self._drainers.add(task)
+                task.add_done_callback(self._drainers.discard)
+
+    async def _drain(self, chat_id: int, chat: _Chat):
+        """Отправка сообщений одного чата по порядку"""
+        try:
+            while chat.pending:
+                text, kwargs = chat.pending.popleft()
+                try:
+                    await chat.bucket.acquire()
+                    async with self._sending:
+                        await self._deliver(chat_id, text, kwargs)
+                except Exception as e:
+                    logger.error(f"Outbox send to {chat_id} failed: {e}")
+                finally:
+                    self._unsent -= 1
+                    self._queue.task_done()
+        finally:
+            chat.active = False
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: dict):
+        """Отправка с ожиданием RetryAfter и повторами при сетевых ошибках"""
+        loop = asyncio.get_running_loop()
+        retries = 0
+        while True:
+            pause = self._paused_until - loop.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._global.acquire()
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return
+            except RetryAfter as e:
+                # Flood control действует на всего бота: ждут все задачи отправки
+                retry_after = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+                self._paused_until = max(self._paused_until, loop.time() + retry_after)
+                logger.warning(f"Flood control: sending paused for {retry_after} s")
+            except (Forbidden, BadRequest) as e:
+                # Бот заблокирован или сообщение некорректно - повтор не поможет
+                logger.warning(f"Message to {chat_id} rejected: {e}")
+                return
+            except NetworkError as e:
+                retries += 1
+                if retries > OUTBOX_CONFIG["max_retries"]:
+                    raise
+                logger.warning(f"Message to {chat_id} failed ({e}), retry {retries}")
+                await asyncio.sleep(2 ** retries)
+
+
+outbox = Outbox()
@@ -0,0 +1,149 @@
+import json
+import logging
+from copy import deepcopy
+from telegram.ext import BasePersistence, PersistenceInput
+from config import TELEGRAM_CONFIG
+from .async_db import (
+    get_active_rentals,
+    get_open_rental,
+    load_bot_state,
+    save_bot_state,
+    delete_bot_state
+)
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = "user_data"
+
+class PostgresPersistence(BasePersistence):
+    """
+    Хранение user_data и состояний диалогов в таблице bot_state для восстановления после перезапуска.
+    Application читает их из БД один раз при старте, дальше - из памяти;
+    изменения записываются в БД сразу, как только их передает Application.
+    Рассчитано на один экземпляр бота: изменения другого экземпляра не перечитываются
+    """
+
+    def __init__(self, update_interval: float = TELEGRAM_CONFIG["persistence_interval"]):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._user_data = None  # user_id -> dict
+        self._conversations = {}  # имя диалога -> {ключ: состояние}
+
+    @staticmethod
+    def _namespace(name: str) -> str:
+        return f"conversation:{name}"
+
+    ### user_data ###
+    async def get_user_data(self) -> dict:
+        if self._user_data is None:
+            rows = await load_bot_state(USER_DATA)
+            self._user_data = {int(key): data for key, data in rows.items()}
+            logger.info(f"Restored user_data for {len(self._user_data)} users")
+        return deepcopy(self._user_data)
+
+    async def update_user_data(self, user_id: int, data: dict):
+        if self._user_data is None:
+            self._user_data = {}
+        if self._user_data.get(user_id) == data:
+            return
+        if data:
+            self._user_data[user_id] = deepcopy(data)
+            await save_bot_state(USER_DATA, str(user_id), data)
+        elif self._user_data.pop(user_id, None) is not None:
+            await delete_bot_state(USER_DATA, str(user_id))
+
+    async def drop_user_data(self, user_id: int):
+        if self._user_data is not None:
+            self._user_data.pop(user_id, None)
+        await delete_bot_state(USER_DATA, str(user_id))
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    ### Состояния диалогов ###
+    async def get_conversations(self, name: str) -> dict:
+        if name not in self._conversations:
+            rows = await load_bot_state(self._namespace(name))
+            self._conversations[name] = {tuple(json.loads(key)): state for key, state in rows.items()}
+            logger.info(f"Restored {len(self._conversations[name])} '{name}' conversations")
+        return dict(self._conversations[name])
+
+    async def update_conversation(self, name: str, key: tuple, new_state):
+        conversations = self._conversations.setdefault(name, {})
+        if conversations.get(key) == new_state:
+            return
+        db_key = json.dumps(list(key))
+        if new_state is None:
+            conversations.pop(key, None)
+            await delete_bot_state(self._namespace(name), db_key)
+        else:
+            conversations[key] = new_state
+            await save_bot_state(self._namespace(name), db_key, new_state)
+
+    ### Не хранятся ###
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        # Изменения уже записаны в БД
+        pass
+
+
+class ActiveRentals:
+    """
+    Открытые аренды по chat_id поверх rentals (end_time IS NULL).
+    Источник истины - БД: get проверяет аренду в БД при каждом обращении, поэтому аренда,
+    завершенная вне этого процесса, не используется повторно
+    """
+
+    def __init__(self):
+        self._rentals = {}  # chat_id -> rental_id
+
+    async def load(self):
+        """Восстановление открытых аренд при старте (в личных чатах chat_id = user_id)"""
+        rentals = await get_active_rentals()
+        self._rentals = {r['user_id']: r['rental_id'] for r in rentals}
+        logger.info(f"Restored {len(self._rentals)} active rentals")
+
+    async def get(self, chat_id: int) -> int:
+        """ID открытой аренды по БД или None (запомненная аренда могла быть уже завершена)"""
+        rental = await get_open_rental(chat_id)
+        if rental is None:
+            self._rentals.pop(chat_id, None)
+            return None
+        rental_id = self._rentals[chat_id] = rental['rental_id']
+        return rental_id
+
+    def set(self, chat_id: int, rental_id: int):
+        """Аренда начата (строка в rentals уже создана)"""
+        self._rentals[chat_id] = rental_id
+
+    def pop(self, chat_id: int):
+        """Аренда завершена или отменена"""
+        self._rentals.pop(chat_id, None)
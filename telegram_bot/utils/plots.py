@@ -1,12 +1,12 @@
+import io
 import logging
 from pathlib import Path
 import matplotlib.pyplot as plt
 import matplotlib
 import pandas as pd
 import os
-from datetime import datetime, timedelta
 from config import PLOT_CONFIG, LOGGING_CONFIG
-from .db import get_user_rentals, get_payments_by_user, get_reviews_by_bike, get_all_rentals, get_completed_payments, get_station_stats
+from .db import get_reviews_by_bike, get_rentals_per_day, get_daily_income, get_station_activity
 
 # Настройка логгера
 logging.basicConfig(
@@ -19,18 +19,34 @@ logger = logging.getLogger(__name__)
 plt.style.use(PLOT_CONFIG["default_style"])
 matplotlib.rcParams['font.family'] = 'DejaVu Sans'
 
-def _save_plot(fig, plot_name: str) -> str:
-    """Сохранение графика в файл"""
-    save_path = PLOT_CONFIG["save_path"]
-    
-    # Создание папки, если не существует
-    if not os.path.exists(save_path):
-        os.makedirs(save_path, exist_ok=True)
-        logger.info(f"Created directory: {save_path}")
-
-    plot_path = os.path.join(save_path, f"{plot_name}.png")
-    
+PLOT_OUTPUTS = ("file", "bytes", "buffer")
+
+def _save_plot(fig, plot_name: str, output: str = "file"):
+    """
+    Сохранение графика
+    :param output: file - PNG в PLOT_CONFIG["save_path"] (архив),
+                   bytes - PNG в байтах, buffer - PNG в BytesIO (без записи на диск)
+    :return: путь к файлу, bytes или BytesIO
+    """
+    if output not in PLOT_OUTPUTS:
+        plt.close(fig)
+        raise ValueError(f"Invalid output. Allowed: {PLOT_OUTPUTS}")
+
     try:
+        if output != "file":
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png', dpi=PLOT_CONFIG["dpi"], bbox_inches='tight')
+            buffer.seek(0)
+            return buffer.getvalue() if output == "bytes" else buffer
+
+        save_path = PLOT_CONFIG["save_path"]
+
+        # Создание папки, если не существует
+        if not os.path.exists(save_path):
+            os.makedirs(save_path, exist_ok=True)
+            logger.info(f"Created directory: {save_path}")
+
+        plot_path = os.path.join(save_path, f"{plot_name}.png")
         fig.savefig(plot_path, dpi=PLOT_CONFIG["dpi"], bbox_inches='tight')
         logger.info(f"Plot saved: {plot_path}")
         return plot_path
@@ -40,29 +56,26 @@ def _save_plot(fig, plot_name: str) -> str:
     finally:
         plt.close(fig)
 
-def generate_rentals_plot(user_id: int = None, days: int = 7) -> str:
+def generate_rentals_plot(user_id: int = None, days: int = 7, output: str = "file"):
     """
     Генерирует график аренд за последние N дней
     :param user_id: ID пользователя (None - все аренды)
     :param days: период в днях
-    :return: путь к файлу
+    :param output: формат результата (file, bytes, buffer)
+    :return: путь к файлу, bytes или BytesIO
     """
     try:
         logger.info(f"Generating rentals plot (user_id={user_id}, days={days})")
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        date_range = pd.date_range(start_date, end_date)
 
-        # Получение данных
-        raw_data = get_user_rentals(user_id) if user_id else get_all_rentals()
-        df = pd.DataFrame(raw_data)
-        if df.empty:
+        # Получение данных: по строке на день, агрегированные в БД
+        raw_data = get_rentals_per_day(days, user_id)
+        if not any(row['rentals'] for row in raw_data):
             return None
 
-        # Фильтрация и агрегация
-        df['date'] = pd.to_datetime(df['start_time']).dt.date
-        filtered = df[df['date'].between(start_date.date(), end_date.date())]
-        daily_counts = filtered.groupby('date').size().reindex(date_range.date, fill_value=0)
+        daily_counts = pd.Series(
+            [row['rentals'] for row in raw_data],
+            index=[row['day'] for row in raw_data]
+        )
 
         # Построение
         fig, ax = plt.subplots(figsize=(10, 6))
@@ -73,29 +86,29 @@ def generate_rentals_plot(user_id: int = None, days: int = 7) -> str:
         ax.set_ylabel("Количество аренд")
         ax.grid(axis='y', linestyle='--')
 
-        return _save_plot(fig, f"rentals_{user_id or 'all'}")
+        return _save_plot(fig, f"rentals_{user_id or 'all'}", output)
 
     except Exception as e:
         logger.error(f"Rentals plot error: {e}", exc_info=True)
         return None
 
-def generate_income_plot(days: int = 30) -> str:
+def generate_income_plot(days: int = 30, output: str = "file"):
     """
     Генерирует график доходов
     :param days: период в днях
-    :return: путь к файлу
+    :param output: формат результата (file, bytes, buffer)
+    :return: путь к файлу, bytes или BytesIO
     """
     try:
-        # Получение данных
-        payments = get_completed_payments(days)
-        df = pd.DataFrame(payments)
-        if df.empty:
+        # Получение данных: по строке на день из дневных агрегатов
+        income = get_daily_income(days)
+        if not any(row['revenue'] for row in income):
             return None
 
-        # Преобразование данных
-        df['payment_date'] = pd.to_datetime(df['payment_date'])
-        df.set_index('payment_date', inplace=True)
-        daily_income = df.resample('D')['amount'].sum().fillna(0)
+        daily_income = pd.Series(
+            [float(row['revenue']) for row in income],
+            index=pd.to_datetime([row['day'] for row in income])
+        )
 
         # Построение
         fig, ax = plt.subplots(figsize=(10, 6))
@@ -106,17 +119,18 @@ def generate_income_plot(days: int = 30) -> str:
         ax.set_ylabel("Сумма (руб.)")
         ax.grid(True, linestyle='--')
 
-        return _save_plot(fig, "income")
+        return _save_plot(fig, "income", output)
 
     except Exception as e:
         logger.error(f"Income plot error: {e}")
         return None
 
-def generate_rating_distribution(bike_id: int) -> str:
+def generate_rating_distribution(bike_id: int, output: str = "file"):
     """
     Распределение оценок для велосипеда
     :param bike_id: ID велосипеда
-    :return: путь к файлу
+    :param output: формат результата (file, bytes, buffer)
+    :return: путь к файлу, bytes или BytesIO
     """
     try:
         reviews = get_reviews_by_bike(bike_id)
@@ -139,21 +153,24 @@ def generate_rating_distribution(bike_id: int) -> str:
         ax.set_title(f"Распределение оценок (велосипед {bike_id})")
         ax.set_ylabel("")
 
-        return _save_plot(fig, f"ratings_{bike_id}")
+        return _save_plot(fig, f"ratings_{bike_id}", output)
 
     except Exception as e:
         logger.error(f"Ratings plot error: {e}")
         return None
 
-def generate_station_activity_plot() -> str:
+def generate_station_activity_plot(output: str = "file"):
     """
     Активность станций (топ-5)
-    :return: путь к файлу
+    :param output: формат результата (file, bytes, buffer)
+    :return: путь к файлу, bytes или BytesIO
     """
     try:
-        # Получение данных
-        stations = get_station_stats()
-        df = pd.DataFrame(stations).nlargest(5, 'total_rentals')
+        # Получение данных из дневных агрегатов
+        stations = get_station_activity(limit=5)
+        df = pd.DataFrame(stations)
+        if df.empty:
+            return None
 
         # Построение
         fig, ax = plt.subplots(figsize=(10, 6))
@@ -170,7 +187,7 @@ def generate_station_activity_plot() -> str:
         ax.set_ylabel("Станция")
         ax.invert_yaxis()
 
-        return _save_plot(fig, "station_activity")
+        return _save_plot(fig, "station_activity", output)
 
     except Exception as e:
         logger.error(f"Station activity plot error: {e}")
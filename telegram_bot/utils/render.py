@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import PLOT_CONFIG, DB_CONFIG
+from . import metrics
+from .cache import MISSING, TTLCache
+from .db import add_change_listener
+
+logger = logging.getLogger(__name__)
+
+class RenderError(Exception):
+    """Ошибка рендеринга графика"""
+    pass
+
+class RenderBusyError(RenderError):
+    """Очередь рендеринга переполнена"""
+    pass
+
+class RenderTimeoutError(RenderError):
+    """График не построен за отведенное время"""
+    pass
+
+
+# Кэш готовых графиков: (тип, user_id, days, bike_id) -> PNG
+chart_cache = TTLCache(maxsize=PLOT_CONFIG["cache_size"], ttl=PLOT_CONFIG["cache_ttl"])
+metrics.register_cache("charts", chart_cache)
+
+# Какие графики устаревают при изменении таблицы
+_TABLE_CHARTS = {
+    "rentals": {"rentals", "station_activity"},
+    "payments": {"income"},
+    "daily_station_stats": {"income", "station_activity"},
+    "reviews": {"ratings"},
+}
+
+def chart_key(kind: str, user_id: int = None, days: int = None, bike_id: int = None) -> tuple:
+    """Ключ графика в кэше"""
+    return (kind, user_id, days, bike_id)
+
+def _invalidate_charts(table: str):
+    """Сброс графиков, построенных по измененной таблице"""
+    kinds = _TABLE_CHARTS.get(table)
+    if kinds:
+        chart_cache.invalidate(lambda key: key[0] in kinds)
+
+add_change_listener(_invalidate_charts)
+
+
+def _init_worker():
+    """Инициализация процесса-воркера"""
+    # Воркер строит один график за раз - большой пул соединений ему не нужен
+    DB_CONFIG["pool"].update(min_size=0, max_size=1)
+
+def _render_job(kind: str, params: dict):
+    """Построение графика в процессе-воркере, возвращает PNG в байтах (без записи на диск)"""
+    # matplotlib и pandas загружаются только в воркерах, процесс бота их не импортирует
+    from . import plots
+    renderers = {
+        "rentals": plots.generate_rentals_plot,
+        "income": plots.generate_income_plot,
+        "ratings": plots.generate_rating_distribution,
+        "station_activity": plots.generate_station_activity_plot,
+    }
+    return renderers[kind](**params, output="bytes")
+
+
+class RenderService:
+    """Пул процессов для построения графиков вне event loop"""
+
+    def __init__(self, workers: int = PLOT_CONFIG["workers"],
+                 queue_size: int = PLOT_CONFIG["queue_size"],
+                 timeout: float = PLOT_CONFIG["job_timeout"]):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor = None
+        self._slots = None
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        """Создание пула процессов"""
+        # spawn: воркеры не наследуют соединения пула и состояние event loop
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+
+    def start(self):
+        """Запуск процессов-воркеров"""
+        if self._executor is not None:
+            return
+        self._executor = self._new_executor()
+        self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+        logger.info(f"Render service started ({self.workers} workers)")
+
+    def stop(self):
+        """Остановка воркеров: задачи в очереди отменяются, текущие дорисовываются"""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        logger.info("Render service stopped")
+
+    async def render(self, kind: str, **params):
+        """
+        Построение графика в пуле процессов (с кэшированием результата)
+        :param kind: тип графика (rentals, income, ratings, station_activity)
+        :return: PNG в байтах или None, если данных нет
+        """
+        key = chart_key(kind, **params)
+        cached = chart_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        generation = chart_cache.generation
+
+        if self._executor is None:
+            self.start()
+
+        # Backpressure: при заполненной очереди сразу отказываем, а не копим задачи
+        if self._slots.locked():
+            raise RenderBusyError("Render queue is full")
+        await self._slots.acquire()
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(_render_job, kind, params)
+        except BrokenProcessPool as e:
+            self._slots.release()
+            self._restart()
+            raise RenderError("Render worker crashed") from e
+
+        # Слот освобождается, только когда воркер действительно закончил работу,
+        # даже если клиент уже перестал ждать по таймауту
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._slots.release))
+
+        try:
+            with metrics.RENDERS.time(kind):
+                result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError as e:
+            logger.warning(f"Render timeout: {kind} {params}")
+            raise RenderTimeoutError(f"Render of {kind} timed out") from e
+        except BrokenProcessPool as e:
+            self._restart()
+            raise RenderError("Render worker crashed") from e
+
+        chart_cache.set(key, result, generation)
+        return result
+
+    def _restart(self):
+        """Пересоздание пула после падения воркера"""
+        logger.error("Render worker pool is broken, restarting")
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+
+
+render_service = RenderService()
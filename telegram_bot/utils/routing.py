@@ -0,0 +1,13 @@
+from telegram.ext.filters import MessageFilter
+
+class Buttons(MessageFilter):
+    """Фильтр: текст сообщения совпадает с одной из кнопок (поиск в frozenset вместо регулярного выражения)"""
+
+    __slots__ = ("buttons",)
+
+    def __init__(self, *buttons: str):
+        self.buttons = frozenset(buttons)
+        super().__init__(name=f"Buttons({', '.join(sorted(self.buttons))})")
+
+    def filter(self, message) -> bool:
+        return message.text in self.buttons
@@ -0,0 +1,130 @@
+import logging
+import random
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import METRICS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# EXPLAIN ANALYZE выполняет запрос, поэтому повторяются только чтения:
+# SELECT без блокировок строк, изменений в CTE и вызовов изменяющих функций (close_rental и т.п.).
+# Функции только для чтения (generate_series, unnest) не мешают снятию плана
+_READ_ONLY = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+_WRITE_FUNCTIONS = (
+    r"close_rental|backfill_daily_stats|rebuild_station_occupancy|rollup_\w+|occupancy_add"
+    r"|nextval|setval|pg_notify|pg_(try_)?advisory_\w*lock\w*"
+)
+_WRITES = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE)\b|\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE)\b|\bFOR\s+KEY\s+SHARE\b"
+    rf"|\b({_WRITE_FUNCTIONS})\s*\(",
+    re.IGNORECASE
+)
+
+class SlowQueryLog:
+    """Кольцевой буфер медленных запросов с выборочным EXPLAIN (ANALYZE, BUFFERS)"""
+
+    def __init__(self, threshold_ms: float = METRICS_CONFIG["slow_query_ms"],
+                 sample_rate: float = METRICS_CONFIG["slow_query_sample"],
+                 size: int = METRICS_CONFIG["slow_query_log_size"]):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._ids = 0
+        # Один фоновый поток: EXPLAIN ANALYZE не должен конкурировать с запросами бота
+        self._executor = None
+        self._pending = 0
+
+    def record(self, helper: str, query: str, params, duration: float):
+        """Запись медленного запроса (и, выборочно, его плана)"""
+        with self._lock:
+            self._ids += 1
+            entry = {
+                "id": self._ids,
+                "at": datetime.now(),
+                "helper": helper,
+                "query": query,
+                "params": params,
+                "duration_ms": duration * 1000,
+                "plan": None,
+            }
+            self._entries.append(entry)
+        logger.warning(f"Slow query in {helper}: {duration * 1000:.0f} ms")
+        if self._explainable(query) and random.random() < self.sample_rate:
+            self._submit_explain(entry)
+
+    @staticmethod
+    def _explainable(query: str) -> bool:
+        """Запрос можно безопасно выполнить повторно под EXPLAIN ANALYZE"""
+        return bool(_READ_ONLY.match(query)) and not _WRITES.search(query)
+
+    def _submit_explain(self, entry: dict):
+        """Снятие плана в фоновом потоке (не больше одной задачи в очереди)"""
+        with self._lock:
+            if self._pending:
+                return
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slowlog")
+        self._executor.submit(self._explain, entry)
+
+    def _explain(self, entry: dict):
+        """EXPLAIN (ANALYZE, BUFFERS) медленного запроса"""
+        from .db import DBManager
+        try:
+            with DBManager() as db:
+                plan = db.explain(entry["query"], entry["params"], analyze=True)
+                # Откат на случай побочных эффектов внутри вызванных запросом функций
+                db.conn.rollback()
+            entry["plan"] = plan
+        except Exception as e:
+            logger.error(f"Slow query explain failed: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def entries(self) -> list:
+        """Записи от новых к старым"""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def get(self, entry_id: int) -> dict:
+        """Запись по номеру"""
+        with self._lock:
+            return next((e for e in self._entries if e["id"] == entry_id), None)
+
+    def shutdown(self):
+        """Остановка фонового потока"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def format_plan(plan: dict) -> str:
+    """Дерево плана EXPLAIN (ANALYZE, BUFFERS) в компактном текстовом виде"""
+    lines = [
+        f"Execution: {plan.get('Execution Time', 0):.1f} ms, planning: {plan.get('Planning Time', 0):.1f} ms"
+    ]
+
+    def walk(node: dict, depth: int):
+        name = node["Node Type"]
+        if node.get("Index Name"):
+            name += f" using {node['Index Name']}"
+        if node.get("Relation Name"):
+            name += f" on {node['Relation Name']}"
+        lines.append(
+            f"{'  ' * depth}{name} "
+            f"(time={node.get('Actual Total Time', 0):.1f} ms, rows={node.get('Actual Rows', 0)}, "
+            f"hit={node.get('Shared Hit Blocks', 0)}, read={node.get('Shared Read Blocks', 0)})"
+        )
+        for child in node.get("Plans", []):
+            walk(child, depth + 1)
+
+    walk(plan["Plan"], 0)
+    return "\n".join(lines)
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from collections import deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import WEBHOOK_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений разных чатов с сохранением порядка внутри чата.
+    max_concurrent_updates ограничивает число одновременно обрабатываемых чатов;
+    обновления занятого чата ставятся в его очередь и не занимают слот
+    """
+
+    def __init__(self, max_concurrent_updates: int = WEBHOOK_CONFIG["concurrent_updates"],
+                 drain_timeout: float = WEBHOOK_CONFIG["drain_timeout"]):
+        super().__init__(max_concurrent_updates)
+        self.drain_timeout = drain_timeout
+        self._queues = {}  # chat_id -> обновления, ожидающие обработки
+        self._pending = 0  # Принятые, но еще не обработанные обновления
+        self._idle = None
+
+    @staticmethod
+    def _chat_id(update: object):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def _process(self, coroutine):
+        try:
+            await coroutine
+        finally:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.set()
+
+    async def do_process_update(self, update: object, coroutine):
+        self._pending += 1
+        self._idle.clear()
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await self._process(coroutine)
+            return
+
+        queue = self._queues.get(chat_id)
+        if queue is not None:
+            # Чат уже обрабатывается - обновление выполнит та же задача, по порядку
+            queue.append(coroutine)
+            return
+
+        queue = self._queues[chat_id] = deque([coroutine])
+        try:
+            while queue:
+                await self._process(queue[0])
+                queue.popleft()
+        finally:
+            del self._queues[chat_id]
+            # Прерванная обработка: оставшиеся обновления чата отбрасываются
+            for rest in list(queue)[1:]:
+                rest.close()
+                self._pending -= 1
+            if not self._pending:
+                self._idle.set()
+
+    async def initialize(self):
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def shutdown(self):
+        """Дождаться обработки принятых обновлений"""
+        if self._idle is None or not self._pending:
+            return
+        logger.info(f"Draining {self._pending} pending updates")
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Drain timed out, {self._pending} updates not processed")
+
+    @property
+    def pending(self) -> int:
+        """Обновлений в обработке и в очередях чатов"""
+        return self._pending